@@ -0,0 +1,270 @@
+# File: api_server.py
+# bToDo - Local automation API server
+# Date: 2026-10-18
+#
+# An optional asyncio server exposing DataManager operations to scripts.
+# It listens on loopback TCP or a Unix socket only and speaks JSON lines:
+# each request is one line holding a JSON object (or a JSON array of
+# objects, a batch); each response is one or more JSON lines.
+#
+# Request:   {"id": 1, "method": "list", "params": {"from": "2025-01-01", "to": "2025-12-31"}}
+# Responses: {"id": 1, "event": {...}}        (streamed, one line per event)
+#            {"id": 1, "result": {"count": 42}}
+# Errors:    {"id": 1, "error": "message"}
+#
+# Methods:
+#   ping                                 -> {"pong": true}
+#   list    {from, to}                   -> streamed events, then {"count"}
+#   get     {id}                         -> {"event": {...} or null}
+#   add     {events: [...]}              -> {"added": [ids], "duplicate": [ids already taken]}
+#   update  {events: [...]}              -> {"updated": [ids], "missing": [ids]}
+#   delete  {ids: [...]}                 -> {"deleted": [ids], "missing": [ids]}
+#   bulk    {add, update, delete}        -> all of the above, saved once
+#   export  {path, since_seq}            -> {"change_seq": n}
+#
+# The server runs in its own process next to the GUI; the data file's
+# locking and merge-on-save keep both views consistent.
+#
+# With the 'group-commit' durability setting, a change is answered before it
+# is on disk; the server flushes once the commit window ends, so bursts of
+# requests share one save and fsync.
+#
+# Over TCP every request must carry {"token": "..."}. Without --token or
+# $BTODO_API_TOKEN the server uses the token in britton_data.api-token next
+# to the data file, creating it (readable by the owner only) if needed, so
+# other local users and processes cannot reach the decrypted calendar. The
+# Unix socket is created owner-only; a token there is optional.
+#
+# Run: python api_server.py [--port 8765 | --unix /path/to/socket] [--data-file FILE]
+# A store with a passphrase takes it from $BTODO_PASSPHRASE (or the terminal).
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import stat
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from data_manager import event_sort_key
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+STREAM_FLUSH_EVERY = 500 # Events written between writer.drain() calls
+MAX_LINE_BYTES = 256 * 1024 * 1024 # Bulk requests with attachments can be large
+TOKEN_SUFFIX = ".api-token"
+
+
+def token_path_for(data_file):
+    """Returns the API token file for a data file, e.g. britton_data.api-token."""
+    root, _ = os.path.splitext(data_file)
+    return root + TOKEN_SUFFIX
+
+
+def load_or_create_token(path):
+    """Returns the token stored at path, creating the file (mode 0600) with a random token if needed."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if hasattr(os, "fchmod"):
+            os.fchmod(fd, 0o600) # Also tightens a file created by hand
+        with os.fdopen(fd, 'r+', encoding='ascii') as f:
+            fd = None
+            token = f.read().strip()
+            if not token:
+                token = secrets.token_urlsafe(32)
+                f.write(token + "\n")
+        return token
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+class ApiServer:
+    """Serves DataManager operations over JSON lines."""
+
+    def __init__(self, data_manager, token=None):
+        self.data_manager = data_manager
+        self.token = token
+        # DataManager is not thread-safe; one worker serialises all access
+        # and keeps slow encryption/saves off the event loop.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._flush_handle = None # Pending group-commit flush
+        self._methods = {
+            "ping": self._ping,
+            "get": self._get,
+            "add": self._add,
+            "update": self._update,
+            "delete": self._delete,
+            "bulk": self._bulk,
+            "export": self._export,
+        }
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    await self._send(writer, {"id": None, "error": "Request line too long."})
+                    break
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    payload = json.loads(line)
+                except json.JSONDecodeError as e:
+                    await self._send(writer, {"id": None, "error": f"Invalid JSON: {e}"})
+                    continue
+                requests = payload if isinstance(payload, list) else [payload]
+                for request in requests:
+                    await self._dispatch(request, writer)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request, writer):
+        if not isinstance(request, dict):
+            await self._send(writer, {"id": None, "error": "Request must be a JSON object."})
+            return
+        request_id = request.get('id')
+        if self.token and not hmac.compare_digest(str(request.get('token', '')), self.token):
+            await self._send(writer, {"id": request_id, "error": "Invalid or missing token."})
+            return
+        method = request.get('method')
+        params = request.get('params') or {}
+        try:
+            await self._call(self.data_manager.reload_if_changed)
+            if method == "list":
+                count = await self._stream_list(request_id, params, writer)
+                result = {"count": count}
+            elif method in self._methods:
+                result = await self._call(self._methods[method], params)
+                self._schedule_flush()
+            else:
+                raise ValueError(f"Unknown method '{method}'.")
+            await self._send(writer, {"id": request_id, "result": result})
+        except Exception as e:
+            await self._send(writer, {"id": request_id, "error": str(e)})
+
+    def _schedule_flush(self):
+        """Arms one flush for the end of the group-commit window, if changes are held back."""
+        due = self.data_manager.commit_due_in()
+        if due is None or self._flush_handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(due, lambda: loop.create_task(self._flush()))
+
+    async def _flush(self):
+        self._flush_handle = None
+        try:
+            await self._call(self.data_manager.flush)
+        except Exception as e:
+            print(f"Error: Failed to save pending changes: {e}", file=sys.stderr)
+
+    @staticmethod
+    async def _send(writer, message):
+        writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b"\n")
+
+    async def _stream_list(self, request_id, params, writer):
+        """Writes one line per event in the range, draining periodically."""
+        start = params.get('from') or "0000-01-01"
+        end = params.get('to') or "9999-12-31"
+        events = await self._call(lambda: sorted(self.data_manager.events_in_range(start, end), key=event_sort_key))
+        for count, ev in enumerate(events, 1):
+            await self._send(writer, {"id": request_id, "event": ev})
+            if count % STREAM_FLUSH_EVERY == 0:
+                await writer.drain()
+        return len(events)
+
+    # --- Methods (run on the worker thread) ---
+
+    def _ping(self, params):
+        return {"pong": True}
+
+    def _get(self, params):
+        return {"event": self.data_manager.find_event(params.get('id'))}
+
+    def _add(self, params):
+        result = self.data_manager.apply_changes(added=params.get('events', []))
+        return {"added": result['added'], "duplicate": result['duplicate']}
+
+    def _update(self, params):
+        result = self.data_manager.apply_changes(updated=params.get('events', []))
+        return {"updated": result['updated'], "missing": result['missing']}
+
+    def _delete(self, params):
+        result = self.data_manager.apply_changes(deleted_ids=params.get('ids', []))
+        return {"deleted": result['deleted'], "missing": result['missing']}
+
+    def _bulk(self, params):
+        return self.data_manager.apply_changes(added=params.get('add', []),
+                                               updated=params.get('update', []),
+                                               deleted_ids=params.get('delete', []))
+
+    def _export(self, params):
+        path = params.get('path')
+        if not path:
+            raise ValueError("export requires a 'path'.")
+        return {"change_seq": self.data_manager.export_to_ics(path, since_seq=params.get('since_seq'))}
+
+    # --- Startup ---
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+        """Runs the server until cancelled."""
+        if unix_path:
+            try:
+                if not stat.S_ISSOCK(os.lstat(unix_path).st_mode):
+                    raise ValueError(f"'{unix_path}' exists and is not a socket.")
+                os.remove(unix_path) # Stale socket from an earlier run
+            except FileNotFoundError:
+                pass
+            old_umask = os.umask(0o177) # The socket is owner-only from the moment it is bound
+            try:
+                server = await asyncio.start_unix_server(self.handle_client, path=unix_path, limit=MAX_LINE_BYTES)
+            finally:
+                os.umask(old_umask)
+            os.chmod(unix_path, 0o600)
+            print(f"bToDo API listening on {unix_path}", file=sys.stderr)
+        else:
+            if host not in ("127.0.0.1", "::1", "localhost"):
+                raise ValueError("The API server only listens on loopback addresses.")
+            if not self.token: # Loopback TCP is open to every local user and process
+                token_path = token_path_for(self.data_manager.data_file)
+                self.token = load_or_create_token(token_path)
+                print(f"Info: API requests must carry the token in {token_path}", file=sys.stderr)
+            server = await asyncio.start_server(self.handle_client, host, port, limit=MAX_LINE_BYTES)
+            print(f"bToDo API listening on {host}:{port}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="bToDo local automation API server")
+    parser.add_argument("--data-file", default="britton_data.enc")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", dest="unix_path", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--token", default=os.environ.get("BTODO_API_TOKEN"),
+                        help="Require this token in every request (default: $BTODO_API_TOKEN, or over TCP "
+                             "the token file next to the data file)")
+    args = parser.parse_args(argv)
+    from btodo import open_store
+    server = ApiServer(open_store(args.data_file), token=args.token)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix_path))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
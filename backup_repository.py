@@ -0,0 +1,368 @@
+# File: backup_repository.py
+# bToDo - Snapshot backup repository
+# Date: 2026-10-18
+#
+# Stores incremental, deduplicated and encrypted snapshots of the calendar.
+# Each event (and each attachment payload) is stored once as a
+# content-addressed object; a snapshot is a small manifest that references
+# objects. Repeated daily backups therefore only write what changed.
+#
+# Layout of a repository directory:
+#   kdf.json                - salt and iteration count of the repository key, and
+#                             the data key wrapped under it once the passphrase changed
+#   config                  - encrypted repository config (object id key)
+#   index                   - object id -> SHA-256 of the stored object (cache)
+#   objects/ab/abcdef...    - encrypted, zlib-compressed JSON objects
+#   snapshots/<id>.snap     - encrypted snapshot manifests
+#
+# A manifest lists each event as [object id, sha256, attachment refs], so
+# verify() and garbage collection need only the manifests and checksums;
+# manifests written before attachment refs were recorded there still work,
+# but their event objects are decrypted to find the attachments.
+
+import hashlib
+import json
+import os
+import sys
+import uuid
+import zlib
+from datetime import datetime
+
+from Crypto.Hash import HMAC, SHA256
+from Crypto.Random import get_random_bytes
+
+from data_manager import LEGACY_KDF, new_kdf_params, sync_directory
+
+REPO_FORMAT_VERSION = 1
+SNAPSHOT_SUFFIX = ".snap"
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S.%fZ" # Microseconds keep ids of quick successive snapshots ordered
+
+# Default retention used by the GUI after each snapshot
+DEFAULT_KEEP_LAST = 7
+DEFAULT_KEEP_DAILY = 7
+DEFAULT_KEEP_WEEKLY = 4
+KDF_FILENAME = "kdf.json"
+
+
+def read_repository_kdf(repo_path):
+    """Returns the key parameters of an existing repository, or None if there is none."""
+    kdf_path = os.path.join(repo_path, KDF_FILENAME)
+    if os.path.exists(kdf_path):
+        with open(kdf_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    if os.path.exists(os.path.join(repo_path, "config")):
+        return dict(LEGACY_KDF) # Repository created before it had its own salt
+    return None
+
+
+def repository_data_key(kdf, derived_key):
+    """The key objects are encrypted with: the derived key itself, or the one it wraps."""
+    if kdf.get('wrapped_key'):
+        from rekey_job import unwrap_key
+        return unwrap_key(kdf['wrapped_key'], derived_key)
+    return derived_key
+
+
+def rewrap_repository_key(repo_path, data_key, new_kdf, new_derived_key):
+    """Stores the data key wrapped under a key derived with new parameters (a passphrase change).
+
+    Objects and manifests stay as they are, so their checksums remain valid.
+    """
+    from rekey_job import wrap_key
+    kdf = {key: value for key, value in new_kdf.items() if key != 'wrapped_key'}
+    kdf['wrapped_key'] = wrap_key(data_key, new_derived_key)
+    kdf_path = os.path.join(repo_path, KDF_FILENAME)
+    temp_path = kdf_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(kdf, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, kdf_path)
+    sync_directory(repo_path)
+
+
+class BackupRepository:
+    """An encrypted, content-addressed snapshot store for calendar data.
+
+    The repository key is derived from the DataManager's passphrase with the
+    repository's own salt, so it can only be read with the same passphrase as
+    the calendar it backs up, and re-keying the calendar does not affect it.
+    After a passphrase change the derived key unwraps the original one.
+    """
+
+    def __init__(self, repo_path, data_manager):
+        self.repo_path = repo_path
+        self.data_manager = data_manager
+        self._objects_dir = os.path.join(repo_path, "objects")
+        self._snapshots_dir = os.path.join(repo_path, "snapshots")
+        self._config_path = os.path.join(repo_path, "config")
+        self._kdf_path = os.path.join(repo_path, KDF_FILENAME)
+        self._key = None
+        self._index_path = os.path.join(repo_path, "index")
+        self._id_key = None
+        self._index = None # Loaded lazily by _put_object
+        self._open_or_init()
+
+    # --- Low level storage ---
+
+    def _open_or_init(self):
+        """Opens an existing repository or initialises a new one."""
+        kdf = read_repository_kdf(self.repo_path)
+        if kdf is None:
+            os.makedirs(self.repo_path, exist_ok=True)
+            kdf = new_kdf_params(self.data_manager._kdf.get('iterations', LEGACY_KDF['iterations']))
+            with open(self._kdf_path, 'w', encoding='utf-8') as f:
+                json.dump(kdf, f)
+        self._key = repository_data_key(kdf, self.data_manager.derive_key(kdf))
+        if os.path.exists(self._config_path):
+            config = json.loads(self._read_encrypted(self._config_path))
+            if config.get('version', 0) > REPO_FORMAT_VERSION:
+                raise ValueError(f"Backup repository '{self.repo_path}' uses a newer format ({config.get('version')}).")
+            self._id_key = bytes.fromhex(config['id_key'])
+            return
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._snapshots_dir, exist_ok=True)
+        # Object ids are keyed hashes so file names do not reveal content
+        self._id_key = get_random_bytes(32)
+        config = {"version": REPO_FORMAT_VERSION, "id_key": self._id_key.hex()}
+        self._write_encrypted(self._config_path, json.dumps(config).encode('utf-8'))
+
+    def _write_encrypted(self, path, plaintext):
+        """Encrypts bytes and writes them atomically. Returns the stored bytes' SHA-256."""
+        nonce, tag, ciphertext = self.data_manager._encrypt_data(plaintext, key=self._key)
+        blob = nonce + tag + ciphertext
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(blob)
+            os.replace(temp_path, path)
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                try: os.remove(temp_path)
+                except OSError: pass
+            raise
+        return hashlib.sha256(blob).hexdigest()
+
+    def _read_encrypted(self, path):
+        """Reads and decrypts a file written by _write_encrypted."""
+        with open(path, 'rb') as f:
+            blob = f.read()
+        if len(blob) < 32:
+            raise ValueError(f"Backup file '{path}' is too short.")
+        return self.data_manager._decrypt_data(blob[:16], blob[16:32], blob[32:], key=self._key)
+
+    def _object_path(self, object_id):
+        return os.path.join(self._objects_dir, object_id[:2], object_id)
+
+    def _put_object(self, value):
+        """Stores a JSON-serialisable value once. Returns (object_id, stored_sha256)."""
+        payload = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        object_id = HMAC.new(self._id_key, payload, digestmod=SHA256).hexdigest()
+        if self._index is None:
+            self._index = self._load_index()
+        path = self._object_path(object_id)
+        digest = self._index.get(object_id)
+        if digest and os.path.exists(path):
+            return object_id, digest # Already stored by an earlier snapshot
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = self._write_encrypted(path, zlib.compress(payload))
+        self._index[object_id] = digest
+        return object_id, digest
+
+    def _load_index(self):
+        """Loads the object digest cache. It only holds ids and checksums, so it is not encrypted."""
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            return index if isinstance(index, dict) else {}
+        except (IOError, ValueError):
+            return {} # Missing or damaged cache: objects are simply rewritten
+
+    def _save_index(self):
+        if self._index is None:
+            return
+        temp_path = self._index_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(temp_path, self._index_path)
+
+    def _get_object(self, object_id):
+        return json.loads(zlib.decompress(self._read_encrypted(self._object_path(object_id))))
+
+    # --- Snapshots ---
+
+    def create_snapshot(self, events, settings):
+        """Stores a snapshot of the given events and settings. Returns its id."""
+        created = datetime.utcnow()
+        snapshot_id = f"{created.strftime(TIMESTAMP_FORMAT)}-{uuid.uuid4().hex[:8]}"
+        event_refs = []
+        for ev in events:
+            # Attachments are stored as their own objects so editing an
+            # event's text does not store its attachments again.
+            stored_event = dict(ev)
+            attachment_refs = []
+            for attach in ev.get('attachments', []) or []:
+                data_ref = self._put_object(attach.get('data', ''))
+                attachment_refs.append({"filename": attach.get('filename'), "ref": list(data_ref)})
+            stored_event['attachments'] = attachment_refs
+            event_refs.append(list(self._put_object(stored_event)) + [[ref['ref'] for ref in attachment_refs]])
+        manifest = {
+            "id": snapshot_id,
+            "created": created.strftime(TIMESTAMP_FORMAT),
+            "events": event_refs,
+            "settings": list(self._put_object(settings)),
+        }
+        self._write_encrypted(os.path.join(self._snapshots_dir, snapshot_id + SNAPSHOT_SUFFIX),
+                              json.dumps(manifest).encode('utf-8'))
+        self._save_index()
+        return snapshot_id
+
+    def list_snapshots(self):
+        """Returns snapshot ids, oldest first. Ids sort by creation time."""
+        if not os.path.isdir(self._snapshots_dir):
+            return []
+        return sorted(name[:-len(SNAPSHOT_SUFFIX)] for name in os.listdir(self._snapshots_dir)
+                      if name.endswith(SNAPSHOT_SUFFIX))
+
+    @staticmethod
+    def snapshot_time(snapshot_id):
+        """Returns the UTC creation time encoded in a snapshot id."""
+        return datetime.strptime(snapshot_id.split('-')[0], TIMESTAMP_FORMAT)
+
+    def _load_manifest(self, snapshot_id):
+        path = os.path.join(self._snapshots_dir, snapshot_id + SNAPSHOT_SUFFIX)
+        return json.loads(self._read_encrypted(path))
+
+    def find_snapshot(self, at=None):
+        """Returns the id of the latest snapshot taken at or before `at` (UTC), or None."""
+        candidates = self.list_snapshots()
+        if at is not None:
+            candidates = [sid for sid in candidates if self.snapshot_time(sid) <= at]
+        return candidates[-1] if candidates else None
+
+    def restore(self, snapshot_id):
+        """Rebuilds (events, settings) from a snapshot."""
+        manifest = self._load_manifest(snapshot_id)
+        events = []
+        for ref in manifest.get('events', []):
+            ev = self._get_object(ref[0])
+            ev['attachments'] = [{"filename": ref.get('filename'), "data": self._get_object(ref['ref'][0])}
+                                 for ref in ev.get('attachments', [])]
+            events.append(ev)
+        settings_ref = manifest.get('settings')
+        settings = self._get_object(settings_ref[0]) if settings_ref else {}
+        return events, settings
+
+    # --- Maintenance ---
+
+    def _manifest_refs(self, manifest):
+        """Yields (object_id, stored_sha256) for every object a snapshot needs."""
+        for ref in manifest.get('events', []):
+            yield ref[0], ref[1]
+            if len(ref) > 2:
+                yield from (tuple(attachment) for attachment in ref[2])
+            else:
+                yield from self._legacy_attachment_refs(ref[0])
+        if manifest.get('settings'):
+            yield tuple(manifest['settings'])
+
+    def _legacy_attachment_refs(self, object_id):
+        """Attachment refs of an event in an older manifest, which only the event object records."""
+        try:
+            ev = self._get_object(object_id)
+        except Exception:
+            return # Reported by verify() via the event object itself
+        for ref in ev.get('attachments', []):
+            yield tuple(ref['ref'])
+
+    def verify(self, deep=False):
+        """Checks that every snapshot's objects exist and are unmodified.
+
+        The quick check compares the SHA-256 of each stored object with the
+        digest recorded when it was written, so only the manifests are
+        decrypted (and, for manifests from older versions, the event
+        objects). With deep=True every object is also decrypted, which
+        verifies its authentication tag. Returns a list of problem strings.
+        """
+        problems = []
+        checked = {}
+        for snapshot_id in self.list_snapshots():
+            try:
+                manifest = self._load_manifest(snapshot_id)
+            except Exception as e:
+                problems.append(f"{snapshot_id}: manifest unreadable ({e})")
+                continue
+            for object_id, digest in self._manifest_refs(manifest):
+                if object_id not in checked:
+                    checked[object_id] = self._check_object(object_id, digest, deep)
+                if checked[object_id]:
+                    problems.append(f"{snapshot_id}: {checked[object_id]}")
+        return problems
+
+    def _check_object(self, object_id, digest, deep):
+        """Returns a problem description for one object, or None if it is intact."""
+        path = self._object_path(object_id)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+        except IOError:
+            return f"object {object_id} is missing"
+        if hashlib.sha256(blob).hexdigest() != digest:
+            return f"object {object_id} is corrupt (checksum mismatch)"
+        if deep:
+            try:
+                self._get_object(object_id)
+            except Exception as e:
+                return f"object {object_id} failed to decrypt ({e})"
+        return None
+
+    def apply_retention(self, keep_last=DEFAULT_KEEP_LAST, keep_daily=DEFAULT_KEEP_DAILY,
+                        keep_weekly=DEFAULT_KEEP_WEEKLY):
+        """Deletes snapshots outside the retention policy and unreferenced objects.
+
+        Keeps the newest `keep_last` snapshots, plus the newest snapshot of
+        each of the last `keep_daily` days and `keep_weekly` ISO weeks that
+        have snapshots. Returns the list of removed snapshot ids.
+        """
+        snapshots = self.list_snapshots()
+        newest_first = list(reversed(snapshots))
+        keep = set(newest_first[:keep_last])
+        days_seen, weeks_seen = [], []
+        for sid in newest_first:
+            when = self.snapshot_time(sid)
+            day = when.date()
+            week = day.isocalendar()[:2]
+            if day not in days_seen and len(days_seen) < keep_daily:
+                days_seen.append(day)
+                keep.add(sid)
+            if week not in weeks_seen and len(weeks_seen) < keep_weekly:
+                weeks_seen.append(week)
+                keep.add(sid)
+        removed = [sid for sid in snapshots if sid not in keep]
+        for sid in removed:
+            try:
+                os.remove(os.path.join(self._snapshots_dir, sid + SNAPSHOT_SUFFIX))
+            except OSError as e:
+                print(f"Warning: Could not remove snapshot '{sid}': {e}", file=sys.stderr)
+        if removed:
+            self._collect_garbage()
+        return removed
+
+    def _collect_garbage(self):
+        """Removes objects no remaining snapshot references."""
+        live = set()
+        for sid in self.list_snapshots():
+            for object_id, _ in self._manifest_refs(self._load_manifest(sid)):
+                live.add(object_id)
+        for prefix in os.listdir(self._objects_dir):
+            prefix_dir = os.path.join(self._objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for object_id in os.listdir(prefix_dir):
+                if object_id not in live:
+                    try: os.remove(os.path.join(prefix_dir, object_id))
+                    except OSError: pass
+        if self._index is None:
+            self._index = self._load_index()
+        self._index = {oid: digest for oid, digest in self._index.items() if oid in live}
+        self._save_index()
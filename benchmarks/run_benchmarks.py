@@ -0,0 +1,527 @@
+# File: benchmarks/run_benchmarks.py
+# bToDo - Benchmark suite
+# Date: 2026-10-18
+#
+# Times DataManager, NotificationManager and MainWindow hot paths on
+# synthetic calendars and writes JSON results that can be compared across
+# commits.
+#
+# Usage (from the repository root):
+#   python benchmarks/run_benchmarks.py --sizes 1000,10000 --output bench.json
+#   python benchmarks/run_benchmarks.py --sizes 1000 --compare bench.json --threshold 0.25
+#   python benchmarks/run_benchmarks.py --no-gui ...      (skip Qt benchmarks)
+#
+# GUI benchmarks run with QT_QPA_PLATFORM=offscreen unless it is already set.
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from data_manager import (DURABILITY_FSYNC, DURABILITY_GROUP_COMMIT, DURABILITY_NONE, DataManager,
+                          new_kdf_params, shard_key_for_date)
+from rekey_job import reencrypt_file
+from synthetic_calendar import busiest_date, generate_events
+
+# Fixed so load timings do not depend on per-machine calibration
+BENCH_KDF_ITERATIONS = 100_000
+DEFAULT_SIZES = "1000,10000"
+DEFAULT_REPEAT = 5
+LOOKUPS_PER_RUN = 1000
+# Differences below this are treated as noise when comparing runs
+NOISE_FLOOR_SECONDS = 0.002
+# The event opened by open_event_dialog carries this much in image attachments
+HEAVY_ATTACHMENT_BYTES = 50 * 1024 * 1024
+HEAVY_IMAGE_SIDE = 1024
+OVERLAY_COUNT = 3
+MUTATIONS_PER_RUN = 20 # Updates per timed run of the durability benchmarks
+
+
+def time_op(func, repeat, per_call=1):
+    """Runs func `repeat` times; returns timing stats in seconds (per call if per_call > 1)."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) / per_call)
+    return {"median_s": statistics.median(samples), "min_s": min(samples), "runs": repeat}
+
+
+class BenchContext:
+    """Holds one synthetic store and everything benchmarks share for a size."""
+
+    def __init__(self, size, args, work_dir):
+        self.size = size
+        self.args = args
+        self.data_file = os.path.join(work_dir, "bench_data.enc")
+        self.events = generate_events(size, seed=args.seed, spread_days=args.spread_days,
+                                      notify_ratio=args.notify_ratio,
+                                      attachment_ratio=args.attachment_ratio,
+                                      attachment_bytes=args.attachment_bytes)
+        self.busy_date = busiest_date(self.events)
+        self.ics_path = os.path.join(work_dir, "bench_export.ics")
+        self.rng = random.Random(args.seed)
+        self.app = None
+
+    def open_store(self):
+        dm = DataManager(self.data_file)
+        dm.load_all_shards()
+        return dm
+
+    def new_event(self):
+        return {"id": str(uuid.uuid4()), "title": "Bench event", "date": self.busy_date, "time": "10:00 AM", "description": "",
+                "attachments": [], "notify": False, "notify_minutes": 30, "notify_time": None}
+
+
+# --- DataManager benchmarks ---
+
+def bench_bulk_add(ctx):
+    def run():
+        if os.path.exists(ctx.data_file):
+            for name in os.listdir(os.path.dirname(ctx.data_file)):
+                os.remove(os.path.join(os.path.dirname(ctx.data_file), name))
+        dm = DataManager(ctx.data_file, kdf_iterations=BENCH_KDF_ITERATIONS)
+        dm.apply_changes(added=[dict(ev) for ev in ctx.events])
+    return time_op(run, 1)
+
+def bench_load_startup(ctx):
+    return time_op(lambda: DataManager(ctx.data_file), ctx.args.repeat)
+
+def bench_load_all(ctx):
+    return time_op(ctx.open_store, ctx.args.repeat)
+
+def bench_save_full(ctx):
+    dm = ctx.open_store()
+    def run():
+        for key in list(dm.shards):
+            dm._mark_dirty(key)
+        dm.save_to_file()
+    return time_op(run, ctx.args.repeat)
+
+def bench_save_one_shard(ctx):
+    dm = ctx.open_store()
+    key = shard_key_for_date(ctx.busy_date)
+    def run():
+        dm._mark_dirty(key)
+        dm.save_to_file()
+    return time_op(run, ctx.args.repeat)
+
+def bench_save_settings(ctx):
+    dm = ctx.open_store()
+    colors = ["#2A82DA", "#DA2A82"]
+    def run():
+        colors.reverse()
+        dm.settings['accent_color'] = colors[0]
+        dm.save_settings()
+    return time_op(run, ctx.args.repeat)
+
+def bench_add_event(ctx):
+    dm = ctx.open_store()
+    return time_op(lambda: dm.add_event(ctx.new_event()), ctx.args.repeat)
+
+def bench_update_event(ctx):
+    dm = ctx.open_store()
+    def run():
+        target = ctx.rng.choice(dm.events)
+        dm.update_event(target['id'], dict(target, title=target['title'] + "!"))
+    return time_op(run, ctx.args.repeat)
+
+def bench_delete_event(ctx):
+    dm = ctx.open_store()
+    return time_op(lambda: dm.delete_event(ctx.rng.choice(dm.events)['id']), ctx.args.repeat)
+
+def _bench_mutations(ctx, mode):
+    """MUTATIONS_PER_RUN updates under a durability mode, flushed at the end; per-mutation time and rate."""
+    dm = ctx.open_store()
+    dm.settings['durability'] = mode
+    def run():
+        for _ in range(MUTATIONS_PER_RUN):
+            target = ctx.rng.choice(dm.events)
+            dm.update_event(target['id'], dict(target, title=target['title'] + "!"))
+        dm.flush()
+    stats = time_op(run, ctx.args.repeat, per_call=MUTATIONS_PER_RUN)
+    stats["mutations_per_s"] = 1 / stats["median_s"]
+    return stats
+
+def bench_mutations_none(ctx):
+    return _bench_mutations(ctx, DURABILITY_NONE)
+
+def bench_mutations_fsync(ctx):
+    return _bench_mutations(ctx, DURABILITY_FSYNC)
+
+def bench_mutations_group_commit(ctx):
+    return _bench_mutations(ctx, DURABILITY_GROUP_COMMIT)
+
+def bench_get_event_by_id(ctx):
+    dm = ctx.open_store()
+    ids = [ctx.rng.choice(dm.events)['id'] for _ in range(LOOKUPS_PER_RUN)]
+    def run():
+        for event_id in ids:
+            dm.get_event_by_id(event_id)
+    return time_op(run, ctx.args.repeat, per_call=LOOKUPS_PER_RUN)
+
+def _bench_starts(ctx, count):
+    """Query start times spread over the busiest date and the days around it."""
+    busy = datetime.datetime.strptime(ctx.busy_date, "%Y-%m-%d")
+    return [busy + datetime.timedelta(days=ctx.rng.randint(-3, 3), minutes=ctx.rng.randrange(7 * 60, 19 * 60, 15))
+            for _ in range(count)]
+
+def bench_overlapping_events(ctx):
+    dm = ctx.open_store()
+    starts = _bench_starts(ctx, LOOKUPS_PER_RUN)
+    dm.overlapping_events(starts[0], starts[0]) # Builds the interval index outside the timing
+    def run():
+        for start in starts:
+            dm.overlapping_events(start, start + datetime.timedelta(hours=1))
+    return time_op(run, ctx.args.repeat, per_call=LOOKUPS_PER_RUN)
+
+def bench_find_free_slot(ctx):
+    dm = ctx.open_store()
+    starts = _bench_starts(ctx, LOOKUPS_PER_RUN)
+    dm.overlapping_events(starts[0], starts[0])
+    def run():
+        for start in starts:
+            dm.find_free_slot(start, start + datetime.timedelta(days=30), 60)
+    return time_op(run, ctx.args.repeat, per_call=LOOKUPS_PER_RUN)
+
+def bench_events_on_day_by_tag(ctx):
+    dm = ctx.open_store()
+    days = [start.toordinal() for start in _bench_starts(ctx, LOOKUPS_PER_RUN)]
+    tags = ["work", "health"]
+    dm.events_on_day(days[0], tags) # Builds the bitmap index outside the timing
+    def run():
+        for day in days:
+            dm.events_on_day(day, tags, include_untagged=False)
+    return time_op(run, ctx.args.repeat, per_call=LOOKUPS_PER_RUN)
+
+def _busy_day_noon(ctx):
+    busy = datetime.datetime.strptime(ctx.busy_date, "%Y-%m-%d")
+    return busy.replace(hour=12).timestamp()
+
+def bench_upcoming_rebuild(ctx):
+    """Filling the upcoming-events window (next 7 days) from the day index."""
+    from upcoming_events import UpcomingWindow
+    window = UpcomingWindow(ctx.open_store())
+    now = _busy_day_noon(ctx)
+    return time_op(lambda: window.rebuild(now), ctx.args.repeat)
+
+def bench_upcoming_advance(ctx):
+    """One minute tick of the upcoming-events window, as the tray timer does."""
+    from upcoming_events import UpcomingWindow
+    window = UpcomingWindow(ctx.open_store())
+    clock = [_busy_day_noon(ctx)]
+    window.rebuild(clock[0])
+    def run():
+        clock[0] += 60
+        window.advance(clock[0])
+    return time_op(run, ctx.args.repeat)
+
+def bench_export_ics_full(ctx):
+    dm = ctx.open_store()
+    return time_op(lambda: dm.export_to_ics(ctx.ics_path), ctx.args.repeat)
+
+def bench_export_ics_delta(ctx):
+    dm = ctx.open_store()
+    since = max(0, dm.change_seq - 10)
+    return time_op(lambda: dm.export_to_ics(ctx.ics_path, since_seq=since), ctx.args.repeat)
+
+def bench_reencrypt_store(ctx):
+    """Streaming every file of the store through re-encryption, as a passphrase change does."""
+    dm = ctx.open_store()
+    paths = [dm.data_file] + [dm._shard_path(key) for key in sorted(dm.shards)]
+    kdfs = [new_kdf_params(BENCH_KDF_ITERATIONS) for _ in range(2)]
+    def run():
+        kdfs.reverse() # Alternate so every run converts every file
+        for path in paths:
+            reencrypt_file(path, dm.derive_key, kdfs[0], dm.derive_key(kdfs[0]))
+    result = time_op(run, ctx.args.repeat)
+    result["bytes"] = sum(os.path.getsize(path) for path in paths)
+    return result
+
+
+# --- Qt benchmarks ---
+
+def _ensure_app(ctx):
+    if ctx.app is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PySide6.QtWidgets import QApplication
+        ctx.app = QApplication.instance() or QApplication([])
+    return ctx.app
+
+class _NullToast:
+    """Stands in for winotify's Notification so reminder scans can be timed without showing toasts."""
+    def __init__(self, *args, **kwargs): pass
+    def set_audio(self, *args, **kwargs): pass
+    def show(self): pass
+
+def bench_check_notifications(ctx):
+    _ensure_app(ctx)
+    import notification_manager
+    notification_manager.Notification = _NullToast
+    notification_manager.audio = None
+    dm = ctx.open_store()
+    nm = notification_manager.NotificationManager(dm)
+    nm.timer.stop()
+    def run():
+        nm.notified_ids.clear()
+        nm.check_notifications()
+    return time_op(run, ctx.args.repeat)
+
+def bench_refresh_event_list(ctx):
+    _ensure_app(ctx)
+    from PySide6.QtCore import QDate
+    from main_window import DATE_FORMAT, MainWindow
+    dm = ctx.open_store()
+    window = MainWindow(dm, None)
+    window.calendar.setSelectedDate(QDate.fromString(ctx.busy_date, DATE_FORMAT))
+    result = time_op(window.refresh_event_list, ctx.args.repeat)
+    with contextlib.redirect_stdout(sys.stderr): # closeEvent prints; keep stdout pure JSON
+        window.close()
+    return result
+
+def bench_edit_in_day_view(ctx):
+    """Renaming an event on the busiest day: the save plus the day view's in-place update."""
+    _ensure_app(ctx)
+    from PySide6.QtCore import QDate
+    from main_window import DATE_FORMAT, MainWindow
+    dm = ctx.open_store()
+    dm.settings['durability'] = DURABILITY_NONE # Time the view update, not the disk
+    window = MainWindow(dm, None)
+    window.calendar.setSelectedDate(QDate.fromString(ctx.busy_date, DATE_FORMAT))
+    day_events = [ev for ev in dm.events if ev.get('date') == ctx.busy_date]
+    def run():
+        target = ctx.rng.choice(day_events)
+        dm.update_event(target['id'], dict(target, title=target['title'] + "!"))
+        day_events[day_events.index(target)] = dm.find_event(target['id'])
+    result = time_op(run, ctx.args.repeat)
+    with contextlib.redirect_stdout(sys.stderr):
+        window.close()
+    return result
+
+def bench_refresh_with_overlays(ctx):
+    """The day view with OVERLAY_COUNT read-only copies of the calendar overlaid."""
+    _ensure_app(ctx)
+    from PySide6.QtCore import QDate
+    from main_window import DATE_FORMAT, MainWindow
+    from overlay_calendars import OverlaySource
+    dm = ctx.open_store()
+    window = MainWindow(dm, None)
+    for number in range(OVERLAY_COUNT):
+        path = os.path.join(os.path.dirname(ctx.data_file), f"bench_overlay{number}.enc")
+        if not os.path.exists(path):
+            dm.backup_to_file(path)
+        window.overlays.add(OverlaySource(path, dm.read_calendar_file(path), window.overlays.next_color()))
+    window.calendar.setSelectedDate(QDate.fromString(ctx.busy_date, DATE_FORMAT))
+    result = time_op(window.refresh_event_list, ctx.args.repeat)
+    with contextlib.redirect_stdout(sys.stderr):
+        window.close()
+    return result
+
+def bench_restyle(ctx):
+    """Switching between two stylesheet themes with the busiest day's events listed."""
+    _ensure_app(ctx)
+    from PySide6.QtCore import QDate
+    from main_window import DATE_FORMAT, MainWindow
+    dm = ctx.open_store()
+    window = MainWindow(dm, None)
+    window.calendar.setSelectedDate(QDate.fromString(ctx.busy_date, DATE_FORMAT))
+    window.show()
+    themes = ["Graphite Dark (QSS)", "Ocean Breeze (QSS)"]
+    def run():
+        themes.reverse()
+        window.apply_theme(themes[0], "#2A82DA", save_settings=False)
+        ctx.app.processEvents() # Includes the repaint the new style causes
+    result = time_op(run, ctx.args.repeat)
+    with contextlib.redirect_stdout(sys.stderr):
+        window.close()
+    return result
+
+def bench_toggle_tag_filter(ctx):
+    """Hiding and showing a tag, each refreshing the day view."""
+    _ensure_app(ctx)
+    from PySide6.QtCore import QDate
+    from main_window import DATE_FORMAT, MainWindow
+    dm = ctx.open_store()
+    window = MainWindow(dm, None)
+    window.calendar.setSelectedDate(QDate.fromString(ctx.busy_date, DATE_FORMAT))
+    def run():
+        window._set_tag_visible("work", False)
+        window._set_tag_visible("work", True)
+    result = time_op(run, ctx.args.repeat)
+    with contextlib.redirect_stdout(sys.stderr):
+        window.close()
+    return result
+
+def _heavy_attachments(total_bytes):
+    """PNG attachments of about total_bytes in all; noise keeps the images from compressing."""
+    import base64
+    from PySide6.QtCore import QBuffer, QByteArray, QIODevice
+    from PySide6.QtGui import QImage
+    size = HEAVY_IMAGE_SIDE * HEAVY_IMAGE_SIDE * 4
+    pixels = random.Random(0).getrandbits(8 * size).to_bytes(size, 'little')
+    image = QImage(pixels, HEAVY_IMAGE_SIDE, HEAVY_IMAGE_SIDE, QImage.Format.Format_RGB32)
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "PNG")
+    png_b64 = base64.b64encode(bytes(data)).decode('ascii')
+    count = max(1, total_bytes // data.size())
+    return [{"filename": f"photo{n}.png", "data": png_b64} for n in range(count)]
+
+def bench_open_event_dialog(ctx):
+    """Opening the event dialog on an event with ~50 MB of image attachments."""
+    _ensure_app(ctx)
+    from main_window import MainWindow
+    dm = ctx.open_store()
+    window = MainWindow(dm, None)
+    heavy = dict(dm.events[0] if dm.events else ctx.new_event(), attachments=_heavy_attachments(HEAVY_ATTACHMENT_BYTES))
+    def run():
+        dialog = window._prepare_event_dialog(heavy)
+        dialog.show()
+        ctx.app.processEvents()
+        dialog.reject()
+    result = time_op(run, ctx.args.repeat)
+    with contextlib.redirect_stdout(sys.stderr):
+        window.close()
+    return result
+
+
+DATA_BENCHMARKS = [
+    ("bulk_add", bench_bulk_add), # Must run first: creates the store
+    ("load_startup", bench_load_startup),
+    ("load_all", bench_load_all),
+    ("save_full", bench_save_full),
+    ("save_one_shard", bench_save_one_shard),
+    ("save_settings", bench_save_settings),
+    ("add_event", bench_add_event),
+    ("update_event", bench_update_event),
+    ("delete_event", bench_delete_event),
+    ("mutations_none", bench_mutations_none),
+    ("mutations_fsync", bench_mutations_fsync),
+    ("mutations_group_commit", bench_mutations_group_commit),
+    ("get_event_by_id", bench_get_event_by_id),
+    ("overlapping_events", bench_overlapping_events),
+    ("find_free_slot", bench_find_free_slot),
+    ("events_on_day_by_tag", bench_events_on_day_by_tag),
+    ("upcoming_rebuild", bench_upcoming_rebuild),
+    ("upcoming_advance", bench_upcoming_advance),
+    ("export_ics_full", bench_export_ics_full),
+    ("export_ics_delta", bench_export_ics_delta),
+    ("reencrypt_store", bench_reencrypt_store),
+]
+GUI_BENCHMARKS = [
+    ("check_notifications", bench_check_notifications),
+    ("refresh_event_list", bench_refresh_event_list),
+    ("refresh_with_overlays", bench_refresh_with_overlays),
+    ("edit_in_day_view", bench_edit_in_day_view),
+    ("toggle_tag_filter", bench_toggle_tag_filter),
+    ("restyle", bench_restyle),
+    ("open_event_dialog", bench_open_event_dialog),
+]
+
+
+def run_suite(args):
+    results = {}
+    benchmarks = DATA_BENCHMARKS + ([] if args.no_gui else GUI_BENCHMARKS)
+    only = set(args.only.split(",")) if args.only else None
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        work_dir = tempfile.mkdtemp(prefix="btodo_bench_")
+        try:
+            ctx = BenchContext(size, args, work_dir)
+            results[str(size)] = {}
+            for name, func in benchmarks:
+                if only and name not in only and name != "bulk_add":
+                    continue
+                stats = func(ctx)
+                results[str(size)][name] = stats
+                rate = f" ({stats['mutations_per_s']:.0f} mutations/s)" if 'mutations_per_s' in stats else ""
+                print(f"{size:>9} {name:<22} median {stats['median_s'] * 1000:10.3f} ms{rate}", file=sys.stderr)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Returns a list of regression descriptions (median slower by more than threshold)."""
+    regressions = []
+    for size, ops in current.get('results', {}).items():
+        for name, stats in ops.items():
+            old = baseline.get('results', {}).get(size, {}).get(name)
+            if not old:
+                continue
+            new_s, old_s = stats['median_s'], old['median_s']
+            if new_s - old_s > NOISE_FLOOR_SECONDS and new_s > old_s * (1 + threshold):
+                regressions.append(f"{name} @ {size} events: {old_s * 1000:.3f} ms -> {new_s * 1000:.3f} ms "
+                                   f"(+{(new_s / old_s - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="bToDo benchmark suite")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated event counts (e.g. 1000,100000,1000000)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spread-days", type=int, default=730, help="Events fall within +/- this many days of today")
+    parser.add_argument("--notify-ratio", type=float, default=0.3)
+    parser.add_argument("--attachment-ratio", type=float, default=0.05)
+    parser.add_argument("--attachment-bytes", type=int, default=0, help="Size of each attachment (0 = none)")
+    parser.add_argument("--only", help="Comma-separated benchmark names to run")
+    parser.add_argument("--no-gui", action="store_true", help="Skip benchmarks that need Qt")
+    parser.add_argument("--output", help="Write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="Baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown before a regression (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        },
+        "results": run_suite(args),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION: {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions beyond threshold.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# File: benchmarks/synthetic_calendar.py
+# bToDo - Synthetic calendar generator for benchmarks
+# Date: 2026-10-18
+#
+# Generates reproducible event lists shaped like real bToDo data: dates
+# spread around today, a mix of timed and all-day events (timed ones with
+# end times), zero to two tags, reminders on a fraction of them and optional
+# base64 attachments.
+
+import base64
+import datetime
+import random
+import uuid
+
+DATE_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%I:%M %p"
+DEFAULT_SPREAD_DAYS = 730 # Events fall within +/- this many days of today
+ALL_DAY_RATIO = 0.2
+DURATIONS_MINUTES = (15, 30, 45, 60, 90, 120)
+TAGS = ("work", "family", "health", "travel", "school", "finance", "hobby", "errands")
+
+WORDS = ("standup", "review", "lunch", "dentist", "call", "planning", "gym", "deploy",
+         "retro", "interview", "school", "flight", "dinner", "sync", "demo", "backup")
+
+
+def generate_events(count, seed=0, spread_days=DEFAULT_SPREAD_DAYS, notify_ratio=0.3,
+                    attachment_ratio=0.0, attachment_bytes=0, today=None):
+    """Returns `count` event dicts in the format the event dialog produces.
+
+    Identical arguments always give identical events (ids included).
+    """
+    rng = random.Random(seed)
+    # Separate stream, so adding end times left the other fields unchanged
+    duration_rng = random.Random(seed + 1)
+    tag_rng = random.Random(seed + 2)
+    today = today or datetime.date.today()
+    # One shared payload keeps generation fast; sizes are what matter
+    payload = base64.b64encode(rng.getrandbits(8 * attachment_bytes).to_bytes(attachment_bytes, 'little')).decode('ascii') if attachment_bytes else ""
+    events = []
+    for _ in range(count):
+        event_date = today + datetime.timedelta(days=rng.randint(-spread_days, spread_days))
+        all_day = rng.random() < ALL_DAY_RATIO
+        start = datetime.time(rng.randrange(7, 20), rng.choice((0, 15, 30, 45)))
+        time_str = "" if all_day else start.strftime(TIME_FORMAT)
+        end_dt = datetime.datetime.combine(event_date, start) + datetime.timedelta(minutes=duration_rng.choice(DURATIONS_MINUTES))
+        end_time_str = "" if all_day else end_dt.strftime(TIME_FORMAT)
+        notify = rng.random() < notify_ratio
+        notify_minutes = rng.choice((5, 15, 30, 60))
+        notify_time = None
+        if notify:
+            event_dt = datetime.datetime.combine(event_date, datetime.time(9, 0) if all_day else start)
+            notify_time = (event_dt - datetime.timedelta(minutes=notify_minutes)).isoformat()
+        attachments = []
+        if attachment_bytes and rng.random() < attachment_ratio:
+            attachments.append({"filename": "attachment.bin", "data": payload})
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize()
+        events.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "title": title,
+            "date": event_date.strftime(DATE_FORMAT),
+            "time": time_str,
+            "end_date": "" if all_day else end_dt.strftime(DATE_FORMAT),
+            "end_time": end_time_str,
+            "tags": tag_rng.sample(TAGS, tag_rng.randint(0, 2)),
+            "description": f"Synthetic event {title.lower()}" if rng.random() < 0.5 else "",
+            "attachments": attachments,
+            "notify": notify,
+            "notify_minutes": notify_minutes,
+            "notify_time": notify_time,
+        })
+    return events
+
+
+def busiest_date(events):
+    """Returns the date string with the most events (a worst case for day views)."""
+    counts = {}
+    for ev in events:
+        counts[ev['date']] = counts.get(ev['date'], 0) + 1
+    return max(counts, key=counts.get) if counts else datetime.date.today().strftime(DATE_FORMAT)
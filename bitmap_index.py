@@ -0,0 +1,147 @@
+# File: bitmap_index.py
+# bToDo - Bitmap index of events by tag and by day
+# Date: 2026-10-18
+#
+# Every indexed event gets a slot number that stays fixed while it is in
+# the index (freed slots are reused). For each tag and each day there is a
+# Python int whose bit n is set when the event in slot n has that tag or
+# covers that day, so tag filters and day views are a few big-integer
+# AND/OR operations instead of a scan over every event dict.
+# Qt-free.
+
+# Multi-day events are indexed on at most this many days
+MAX_INDEXED_DAYS = 366
+
+
+def tag_key(tag):
+    """Tags match case-insensitively."""
+    return tag.casefold()
+
+
+def normalize_tags(value):
+    """Returns a list of stripped tags without duplicates, from a list or a comma-separated string."""
+    if isinstance(value, str):
+        value = value.split(",")
+    tags = []
+    seen = set()
+    for tag in value or ():
+        if not isinstance(tag, str):
+            continue
+        tag = " ".join(tag.split())
+        if tag and tag_key(tag) not in seen:
+            seen.add(tag_key(tag))
+            tags.append(tag)
+    return tags
+
+
+def iter_bits(bits):
+    """Yields the positions of the set bits, lowest first."""
+    digits = bin(bits)[:1:-1] # Least significant bit first, without '0b'
+    position = digits.find("1")
+    while position != -1:
+        yield position
+        position = digits.find("1", position + 1)
+
+
+def bit_count(bits):
+    return bin(bits).count("1")
+
+
+def _event_days(event):
+    ordinal = event.get('date_ordinal')
+    if not ordinal:
+        return range(0)
+    last = min(event.get('end_ordinal') or ordinal, ordinal + MAX_INDEXED_DAYS - 1)
+    return range(ordinal, last + 1)
+
+
+class BitmapIndex:
+    """Tag and day bitmaps over slot-numbered events, keyed by event id."""
+
+    def __init__(self, events=()):
+        self._slots = [] # slot -> event, None when free
+        self._slot_of = {} # event id -> slot
+        self._free = []
+        self.tag_bits = {} # tag key -> bitmap
+        self.tag_names = {} # tag key -> tag as first written
+        self.day_bits = {} # date ordinal -> bitmap
+        self.untagged = 0
+        for event in events:
+            self.add(event)
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def add(self, event):
+        if event.get('id') in self._slot_of:
+            self.remove(event)
+        if self._free:
+            slot = self._free.pop()
+            self._slots[slot] = event
+        else:
+            slot = len(self._slots)
+            self._slots.append(event)
+        self._slot_of[event.get('id')] = slot
+        bit = 1 << slot
+        tags = event.get('tags') or ()
+        for tag in tags:
+            key = tag_key(tag)
+            self.tag_bits[key] = self.tag_bits.get(key, 0) | bit
+            self.tag_names.setdefault(key, tag)
+        if not tags:
+            self.untagged |= bit
+        day_bits = self.day_bits
+        for day in _event_days(event):
+            day_bits[day] = day_bits.get(day, 0) | bit
+
+    def remove(self, event):
+        """Removes the indexed event with event's id (using the indexed copy's tags and days)."""
+        slot = self._slot_of.pop(event.get('id'), None)
+        if slot is None:
+            return
+        indexed = self._slots[slot]
+        bit = 1 << slot
+        for tag in indexed.get('tags') or ():
+            key = tag_key(tag)
+            bits = self.tag_bits.get(key, 0) & ~bit
+            if bits:
+                self.tag_bits[key] = bits
+            else:
+                self.tag_bits.pop(key, None)
+                self.tag_names.pop(key, None)
+        self.untagged &= ~bit
+        for day in _event_days(indexed):
+            bits = self.day_bits.get(day, 0) & ~bit
+            if bits:
+                self.day_bits[day] = bits
+            else:
+                self.day_bits.pop(day, None)
+        self._slots[slot] = None
+        self._free.append(slot)
+
+    def tag_mask(self, tags, match_all=False, include_untagged=False):
+        """Returns the bitmap of events with any (or, with match_all, every) of the tags."""
+        bitmaps = [self.tag_bits.get(tag_key(tag), 0) for tag in tags]
+        if match_all:
+            mask = bitmaps[0] if bitmaps else 0
+            for bits in bitmaps[1:]:
+                mask &= bits
+        else:
+            mask = 0
+            for bits in bitmaps:
+                mask |= bits
+        if include_untagged:
+            mask |= self.untagged
+        return mask
+
+    def day_mask(self, ordinal):
+        return self.day_bits.get(ordinal, 0)
+
+    def events(self, bits):
+        """Returns the events in the slots set in bits."""
+        slots = self._slots
+        return [slots[slot] for slot in iter_bits(bits)]
+
+    def tag_counts(self):
+        """Returns {tag as first written: number of events}."""
+        return {self.tag_names[key]: bit_count(bits) for key, bits in self.tag_bits.items()}
@@ -0,0 +1,380 @@
+# File: btodo.py
+# bToDo - Command-line interface
+# Date: 2026-10-18
+#
+# Qt-free access to the calendar for shells, cron and pipelines. Uses only
+# DataManager, so it starts without loading PySide6. Event output is JSON
+# lines (one event object per line).
+#
+# Usage:
+#   python -m btodo list [--from 2025-01-01] [--to 2025-01-31] [--tag work ...] [--all-tags]
+#   python -m btodo today
+#   python -m btodo add --title "Dentist" --date 2025-05-01 [--time 14:30] [--end 15:15] [--end-date 2025-05-01]
+#                       [--notify-minutes 30] [--tag work ...] [--tz Europe/Berlin]
+#   python -m btodo free-slot --from 2025-05-01T09:00 --to 2025-05-07 --minutes 90 [--day-start 09:00 --day-end 17:00]
+#   python -m btodo import events.jsonl          (or '-' for stdin)
+#   python -m btodo export-ics out.ics [--since SEQ]
+#   python -m btodo backup backup.enc
+#   python -m btodo search "dentist" [--no-archive]
+#   python -m btodo archive                      (apply the archival policy now)
+#   python -m btodo serve [--port 8765 | --unix PATH]
+#   python -m btodo passphrase [--backup backup.enc ...]   (change it; finishes an interrupted change)
+#
+# A store with a passphrase takes it from $BTODO_PASSPHRASE, or asks on the
+# terminal. The passphrase command asks for the new one twice (or takes
+# $BTODO_NEW_PASSPHRASE; empty removes the passphrase).
+#
+# Global options: --memory-report prints a memory breakdown by component to
+# stderr after the command; --trace-memory adds a tracemalloc diff of what
+# the command allocated, by source file.
+
+import argparse
+import datetime
+import getpass
+import json
+import os
+import sys
+
+import timezones
+from bitmap_index import normalize_tags, tag_key
+from data_manager import PASSPHRASE_ENV, DataManager, event_sort_key
+
+DATE_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%I:%M %p" # Same 'hh:mm AP' form the GUI stores
+NEW_PASSPHRASE_ENV = "BTODO_NEW_PASSPHRASE"
+DEFAULT_NOTIFY_MINUTES = 30
+ALL_DAY_NOTIFY_HOUR = 9 # The GUI reminds about all-day events relative to 9:00
+
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, DATE_FORMAT).date()
+
+
+def _normalize_time(value):
+    """Accepts '14:30' or '02:30 PM' and returns the stored 'hh:mm AP' form ('' for none)."""
+    if not value:
+        return ""
+    for fmt in ("%H:%M", TIME_FORMAT):
+        try:
+            return datetime.datetime.strptime(value.strip().upper(), fmt).strftime(TIME_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised time '{value}' (use HH:MM or hh:mm AM/PM).")
+
+
+def _parse_datetime(value):
+    """Accepts 'YYYY-MM-DD' (midnight) or 'YYYY-MM-DDTHH:MM'."""
+    for fmt in (DATE_FORMAT + "T%H:%M", DATE_FORMAT):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date/time '{value}' (use YYYY-MM-DD or YYYY-MM-DDTHH:MM).")
+
+
+def build_event(title, date_str, time_str="", description="", notify_minutes=None, end_date=None, end_time=None,
+                tags=None, tz=None):
+    """Builds an event dict the same way the GUI's event dialog does."""
+    event_date = _parse_date(date_str)
+    time_str = _normalize_time(time_str)
+    end_time = _normalize_time(end_time) if time_str else ""
+    if end_time and not end_date:
+        end_date = event_date.strftime(DATE_FORMAT)
+    if end_date and _parse_date(end_date) < event_date:
+        raise ValueError("The event must end after it starts.")
+    if tz and not timezones.is_valid_zone(tz):
+        raise ValueError(f"Unknown time zone '{tz}' (use an IANA name such as Europe/Berlin).")
+    event = {
+        "title": title, "date": event_date.strftime(DATE_FORMAT), "time": time_str,
+        "end_date": end_date or "", "end_time": end_time, "tags": normalize_tags(tags or []), "tz": tz or "",
+        "description": description or "", "attachments": [],
+        "notify": notify_minutes is not None,
+        "notify_minutes": notify_minutes if notify_minutes is not None else DEFAULT_NOTIFY_MINUTES,
+        "notify_time": None,
+    }
+    if notify_minutes is not None:
+        if time_str:
+            start = datetime.datetime.combine(event_date, datetime.datetime.strptime(time_str, TIME_FORMAT).time())
+        else:
+            start = datetime.datetime.combine(event_date, datetime.time(ALL_DAY_NOTIFY_HOUR, 0))
+        event["notify_time"] = (start - datetime.timedelta(minutes=notify_minutes)).isoformat()
+    return event
+
+
+def _write_events(events, out):
+    for ev in events:
+        out.write(json.dumps(ev, ensure_ascii=False) + "\n")
+
+
+# --- Commands ---
+
+def _has_tags(event, keys, match_all):
+    event_keys = {tag_key(tag) for tag in event.get('tags') or ()}
+    return keys <= event_keys if match_all else bool(keys & event_keys)
+
+
+def _range_date(value, option):
+    """Validates a --from/--to date and returns it as zero-padded 'YYYY-MM-DD'."""
+    try:
+        return _parse_date(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid {option} date '{value}' (use YYYY-MM-DD).") from None
+
+
+def cmd_list(dm, args, out):
+    start = _range_date(args.date_from, "--from") if args.date_from else "0000-01-01"
+    end = _range_date(args.date_to, "--to") if args.date_to else "9999-12-31"
+    events = dm.events_in_range(start, end)
+    if args.tag:
+        keys = {tag_key(tag) for tag in normalize_tags(args.tag)}
+        events = [ev for ev in events if _has_tags(ev, keys, args.all_tags)]
+    _write_events(sorted(events, key=event_sort_key), out)
+    return 0
+
+
+def cmd_today(dm, args, out):
+    today = datetime.date.today().strftime(DATE_FORMAT)
+    _write_events(sorted(dm.events_in_range(today, today), key=event_sort_key), out)
+    return 0
+
+
+def cmd_add(dm, args, out):
+    event = build_event(args.title, args.date, args.time, args.description, args.notify_minutes,
+                        end_date=args.end_date, end_time=args.end, tags=args.tag,
+                        tz=args.tz)
+    result = dm.apply_changes(added=[event])
+    out.write(json.dumps({"added": result['added']}) + "\n")
+    return 0
+
+
+def cmd_import(dm, args, out):
+    """Imports JSON lines; lines with an 'id' of an existing event update it."""
+    source = sys.stdin if args.file == "-" else open(args.file, 'r', encoding='utf-8')
+    added, updated, errors = [], [], 0
+    try:
+        for line_no, line in enumerate(source, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+                if not isinstance(event, dict) or not event.get('title') or not event.get('date'):
+                    raise ValueError("event needs at least 'title' and 'date'")
+                _parse_date(event['date'])
+                event['time'] = _normalize_time(event.get('time', ''))
+                if event.get('end_date'):
+                    _parse_date(event['end_date'])
+                event['end_time'] = _normalize_time(event.get('end_time', ''))
+                if event.get('id') is not None and not isinstance(event['id'], str):
+                    raise ValueError("'id' must be a string")
+            except (AttributeError, TypeError, ValueError) as e: # A date or time that is not a string
+                print(f"Warning: Skipping line {line_no}: {e}", file=sys.stderr)
+                errors += 1
+                continue
+            (updated if event.get('id') else added).append(event)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    # Lines whose id is unknown are added rather than reported missing
+    known = {ev['id'] for ev in updated if dm.find_event(ev['id']) is not None}
+    added.extend(ev for ev in updated if ev['id'] not in known)
+    updated = [ev for ev in updated if ev['id'] in known]
+    result = dm.apply_changes(added=added, updated=updated)
+    for event_id in result['duplicate']:
+        print(f"Warning: Skipping event with duplicate id '{event_id}'.", file=sys.stderr)
+    errors += len(result['duplicate'])
+    out.write(json.dumps({"added": len(result['added']), "updated": len(result['updated']), "skipped": errors}) + "\n")
+    return 1 if errors else 0
+
+
+def cmd_export_ics(dm, args, out):
+    change_seq = dm.export_to_ics(args.path, since_seq=args.since)
+    out.write(json.dumps({"path": args.path, "change_seq": change_seq}) + "\n")
+    return 0
+
+
+def cmd_backup(dm, args, out):
+    dm.backup_to_file(args.path)
+    out.write(json.dumps({"path": args.path}) + "\n")
+    return 0
+
+
+def cmd_free_slot(dm, args, out):
+    start = _parse_datetime(args.date_from)
+    end = _parse_datetime(args.date_to)
+    if args.date_to and "T" not in args.date_to:
+        end += datetime.timedelta(days=1) # A bare end date includes that whole day
+    if bool(args.day_start) != bool(args.day_end):
+        raise ValueError("--day-start and --day-end must be given together.")
+    day_start = datetime.datetime.strptime(_normalize_time(args.day_start), TIME_FORMAT).time() if args.day_start else None
+    day_end = datetime.datetime.strptime(_normalize_time(args.day_end), TIME_FORMAT).time() if args.day_end else None
+    slot = dm.find_free_slot(start, end, args.minutes, day_start, day_end)
+    out.write(json.dumps({"start": slot.strftime(DATE_FORMAT + "T%H:%M") if slot else None}) + "\n")
+    return 0 if slot else 1
+
+
+def cmd_search(dm, args, out):
+    _write_events(dm.search_events(args.text, include_archive=not args.no_archive), out)
+    return 0
+
+
+def cmd_archive(dm, args, out):
+    moved = dm.archive_old_events()
+    out.write(json.dumps({"archived": moved, "archive_count": dm.archive_info.get('count', 0)}) + "\n")
+    return 0
+
+
+def cmd_passphrase(dm, args, out):
+    job = dm.resume_passphrase_change()
+    if job:
+        print("Info: Finishing an interrupted passphrase change.", file=sys.stderr)
+    else:
+        new_passphrase = os.environ.get(NEW_PASSPHRASE_ENV)
+        if new_passphrase is None:
+            new_passphrase = getpass.getpass("New passphrase (empty to remove): ")
+            if getpass.getpass("Confirm new passphrase: ") != new_passphrase:
+                raise ValueError("The passphrases do not match.")
+        job = dm.begin_passphrase_change(new_passphrase, args.backup or ())
+    try:
+        finished = job.run(lambda done, total: print(f"Re-encrypted {done} of {total} files", file=sys.stderr))
+    except KeyboardInterrupt:
+        print("Info: Interrupted; run 'btodo passphrase' with the new passphrase to finish.", file=sys.stderr)
+        return 130
+    if not finished:
+        print("Error: The passphrase change is unfinished; fix the problems above and run "
+              "'btodo passphrase' again with the new passphrase.", file=sys.stderr)
+    out.write(json.dumps({"files": job.total(), "problems": len(job.problems), "finished": finished}) + "\n")
+    return 1 if job.problems else 0
+
+
+def cmd_serve(dm, args, out):
+    import asyncio
+    from api_server import ApiServer
+    try:
+        asyncio.run(ApiServer(dm, token=args.token).serve(args.host, args.port, args.unix_path))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="btodo", description="bToDo command-line interface")
+    parser.add_argument("--data-file", default="britton_data.enc", help="Encrypted data file (default: %(default)s)")
+    parser.add_argument("--memory-report", action="store_true", help="Print memory use by component to stderr afterwards")
+    parser.add_argument("--trace-memory", action="store_true", help="Also print a tracemalloc diff of the command")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("list", help="List events in a date range as JSON lines")
+    p.add_argument("--from", dest="date_from", help="First date, YYYY-MM-DD")
+    p.add_argument("--to", dest="date_to", help="Last date, YYYY-MM-DD")
+    p.add_argument("--tag", action="append", help="Only events with this tag (repeatable: any of them)")
+    p.add_argument("--all-tags", action="store_true", help="With several --tag, require all of them")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser("today", help="List today's events as JSON lines")
+    p.set_defaults(func=cmd_today)
+
+    p = sub.add_parser("add", help="Add one event")
+    p.add_argument("--title", required=True)
+    p.add_argument("--date", required=True, help="YYYY-MM-DD")
+    p.add_argument("--time", default="", help="HH:MM or hh:mm AM/PM; omit for all day")
+    p.add_argument("--description", default="")
+    p.add_argument("--notify-minutes", type=int, help="Remind this many minutes before")
+    p.add_argument("--end", help="End time, HH:MM (timed events only)")
+    p.add_argument("--end-date", help="Last day, YYYY-MM-DD, for multi-day events")
+    p.add_argument("--tag", action="append", help="Tag the event (repeatable)")
+    p.add_argument("--tz", help="IANA time zone of the date and times (default: the default time zone)")
+    p.set_defaults(func=cmd_add)
+
+    p = sub.add_parser("free-slot", help="Print the earliest free start time for a duration")
+    p.add_argument("--from", dest="date_from", required=True, help="Search start, YYYY-MM-DD[THH:MM]")
+    p.add_argument("--to", dest="date_to", required=True, help="Search end, YYYY-MM-DD[THH:MM]")
+    p.add_argument("--minutes", type=int, required=True, help="Length of the slot")
+    p.add_argument("--day-start", help="Only slots starting at or after this time of day, HH:MM")
+    p.add_argument("--day-end", help="...and ending by this time of day, HH:MM")
+    p.set_defaults(func=cmd_free_slot)
+
+    p = sub.add_parser("import", help="Add or update events from JSON lines")
+    p.add_argument("file", help="JSON lines file, or '-' for stdin")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("export-ics", help="Export to iCalendar")
+    p.add_argument("path")
+    p.add_argument("--since", type=int, help="Only changes after this change sequence")
+    p.set_defaults(func=cmd_export_ics)
+
+    p = sub.add_parser("backup", help="Write a self-contained encrypted backup")
+    p.add_argument("path")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("search", help="List events whose title or description contains TEXT")
+    p.add_argument("text")
+    p.add_argument("--no-archive", action="store_true", help="Skip archived events")
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser("archive", help="Move past events into the archive file now")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("serve", help="Run the local automation API server")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--unix", dest="unix_path")
+    p.add_argument("--token", default=os.environ.get("BTODO_API_TOKEN"))
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("passphrase", help="Change the passphrase, re-encrypting the store (or finish a change)")
+    p.add_argument("--backup", action="append", help="Also re-encrypt this backup file (repeatable)")
+    p.set_defaults(func=cmd_passphrase)
+    return parser
+
+
+def open_store(data_file):
+    """Opens a DataManager, taking the passphrase from $BTODO_PASSPHRASE or the terminal if the store has one."""
+    passphrase = os.environ.get(PASSPHRASE_ENV)
+    if passphrase is None and os.path.exists(data_file) and DataManager.needs_passphrase(data_file):
+        try:
+            passphrase = getpass.getpass(f"Passphrase for {data_file}: ")
+        except EOFError:
+            raise ValueError(f"'{data_file}' needs a passphrase; set ${PASSPHRASE_ENV}.") from None
+    return DataManager(data_file, passphrase=passphrase)
+
+
+def _print_memory_report(dm, traced):
+    import memory_report
+    for line in memory_report.format_report(memory_report.component_report(dm)):
+        print(line, file=sys.stderr)
+    if traced:
+        for line in memory_report.diff_from_baseline():
+            print(line, file=sys.stderr)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace_memory:
+        import memory_report
+        memory_report.set_baseline()
+    try:
+        dm = open_store(args.data_file)
+    except ValueError as e: # PassphraseError, or an unreadable passphrase change journal
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if dm.rekey_in_progress() and args.command != "passphrase":
+        print("Info: A passphrase change is unfinished; run 'btodo passphrase' to complete it.", file=sys.stderr)
+    status = 2
+    try:
+        status = args.func(dm, args, sys.stdout)
+    except (ValueError, IOError, OSError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+    finally:
+        try:
+            dm.flush() # Changes held back by group commit
+        except Exception as e:
+            print(f"Error: Failed to save pending changes: {e}", file=sys.stderr)
+            status = 2
+        if args.memory_report or args.trace_memory:
+            _print_memory_report(dm, args.trace_memory)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
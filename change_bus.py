@@ -0,0 +1,82 @@
+# File: change_bus.py
+# bToDo - Change notifications from DataManager
+# Date: 2026-10-18
+#
+# DataManager publishes a Change on its ChangeBus after each change has been
+# applied (and saved, or queued under group commit), so views, the reminder
+# scheduler and other consumers can update just the affected entries instead
+# of rebuilding everything after each edit:
+#
+#   added     one event added: new
+#   updated   one event replaced: old, new, and the names of changed fields
+#   deleted   one event removed: old
+#   bulk      several changes at once (apply_changes, restores, undo of
+#             those, changes merged from another process): changes holds
+#             the per-event Changes, or is None when anything may have
+#             changed (e.g. events moved into the archive)
+#   settings  settings saved or reloaded: fields names the changed keys
+#
+# Observers run synchronously on the thread that changed the DataManager;
+# an observer that raises is reported and skipped. Qt-free.
+
+import sys
+from collections import namedtuple
+
+EVENT_ADDED = "added"
+EVENT_UPDATED = "updated"
+EVENT_DELETED = "deleted"
+EVENTS_BULK = "bulk"
+SETTINGS_CHANGED = "settings"
+
+Change = namedtuple("Change", ("kind", "event_id", "old", "new", "fields", "changes"),
+                    defaults=(None, None, None, frozenset(), None))
+
+
+def changed_fields(old, new):
+    """Returns the keys whose values differ between two dicts."""
+    return frozenset(key for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+
+
+def change_for_op(before, after):
+    """Returns the Change for one (before, after) op (see DataManager's mutation ops)."""
+    if before is None:
+        return Change(EVENT_ADDED, after.get('id'), new=after)
+    if after is None:
+        return Change(EVENT_DELETED, before.get('id'), old=before)
+    return Change(EVENT_UPDATED, after.get('id'), before, after, changed_fields(before, after))
+
+
+def bulk_change(changes):
+    """One Change for a list of per-event Changes (the only one if there is just one)."""
+    if changes is not None and len(changes) == 1:
+        return changes[0]
+    return Change(EVENTS_BULK, changes=tuple(changes) if changes is not None else None)
+
+
+class ChangeBus:
+    """Delivers Changes to subscribed callbacks."""
+
+    def __init__(self):
+        self._observers = [] # (callback, set of kinds or None for all)
+
+    def subscribe(self, callback, kinds=None):
+        """Calls callback(change) for every Change, or only those whose kind is in kinds."""
+        self._observers.append((callback, frozenset(kinds) if kinds else None))
+        return callback
+
+    def unsubscribe(self, callback):
+        self._observers = [(cb, kinds) for cb, kinds in self._observers if cb != callback]
+
+    def publish(self, change):
+        for callback, kinds in list(self._observers):
+            if kinds is not None and change.kind not in kinds:
+                continue
+            try:
+                callback(change)
+            except Exception as e:
+                print(f"Warning: Change observer {getattr(callback, '__qualname__', callback)} failed: {e}", file=sys.stderr)
+
+    def publish_ops(self, ops):
+        """Publishes the Change for a list of (before, after) ops."""
+        if ops and self._observers:
+            self.publish(bulk_change([change_for_op(before, after) for before, after in ops]))
@@ -1,39 +1,311 @@
 # File: data_manager.py
 # bToDo - Created by Patrick Britton
 # Date: 2025-04-28
-# Updated: 2025-04-29 (Added style_name to default settings)
+# Updated: 2026-10-18 (User passphrases; passphrase change with resumable re-encryption)
 
+import atexit
 import base64
 import json
 import os
+import struct
 import sys
+import time
+import uuid
+import weakref
+import zlib
+from datetime import date, datetime, timedelta
 
 # PyCryptodome imports
 from Crypto.Cipher import AES
 from Crypto.Hash import SHA256
 from Crypto.Protocol.KDF import PBKDF2
-from Crypto.Random import get_random_bytes # Note: Imported but not used in provided code
+from Crypto.Random import get_random_bytes
+
+import perf_stats
+import timezones
+from bitmap_index import BitmapIndex, normalize_tags
+from change_bus import SETTINGS_CHANGED, Change, ChangeBus, bulk_change, change_for_op, changed_fields
+from file_lock import FileLock
+from interval_index import IntervalIndex
+from settings_store import DEFAULT_SETTINGS, SettingsStore, default_settings
 
 # Constants (Consider moving defaults here if shared across modules)
-DEFAULT_STYLE = "Default Light"
-DEFAULT_ACCENT_COLOR = "#2A82DA"
+DEFAULT_STYLE = DEFAULT_SETTINGS["style_name"]
+DEFAULT_ACCENT_COLOR = DEFAULT_SETTINGS["accent_color"]
+DEFAULT_DATA_FILE = "britton_data.enc"
+# Deletion tombstones kept for delta exports; older ones are dropped and
+# consumers that fall behind them get a full export instead.
+MAX_TOMBSTONES = 5000
+UNDO_LIMIT = 100 # Changes kept for undo
+# Storage layout: format 1 keeps every event in the data file; format 2 keeps
+# settings plus a shard manifest there and events in one file per year.
+STORE_FORMAT = 2
+UNDATED_SHARD = "undated"
+# Shards covering today through this many days ahead are loaded at startup
+STARTUP_LOOKAHEAD_DAYS = 92
+# Encrypted files start with this magic and a small plaintext JSON header
+# (authenticated as associated data) holding the file's version counter and
+# the KDF parameters its key was derived with.
+# Files without it are the original nonce + tag + ciphertext layout.
+FILE_MAGIC = b"BTDO"
+# Key derivation. Files without KDF parameters in their header use the
+# original fixed salt and iteration count.
+KDF_ALGORITHM = "pbkdf2-sha256"
+LEGACY_KDF = {
+    "alg": KDF_ALGORITHM,
+    "salt": base64.b64encode(b"britton_calendar_salt").decode('ascii'),
+    "iterations": 100_000,
+}
+MIN_KDF_ITERATIONS = 100_000 # Never weaker than the original parameters
+MAX_KDF_ITERATIONS = 10_000_000
+DEFAULT_KDF_TARGET_SECONDS = 0.3 # Unlock latency to aim for on this machine
+KDF_PROBE_ITERATIONS = 20_000
+# Stores without a passphrase of the user's own are encrypted with this
+# built-in one. Once the user sets a passphrase, the KDF parameters in every
+# file header carry "passphrase": "user", so the GUI and CLI know to ask for
+# it before opening the store (see needs_passphrase).
+DEFAULT_PASSPHRASE = "BrittonCalendarDefaultKey"
+KDF_USER_PASSPHRASE = "user"
+PASSPHRASE_ENV = "BTODO_PASSPHRASE" # Where the CLI and API server take the passphrase from
+# Event schema. Version 2 stores canonical numeric fields next to the
+# display strings, so sorting and range checks need no parsing:
+#   date_ordinal  date.toordinal() of 'date' ('yyyy-MM-dd'), None if undated
+#   time_minutes  minutes since midnight of 'time' ('hh:mm AP'), None if all day
+#   notify_ts     POSIX timestamp of 'notify_time', None without a reminder
+#   end_ordinal   date.toordinal() of the optional 'end_date', None if not set
+#   end_minutes   minutes since midnight of the optional 'end_time', None if not set
+# The optional 'tags' list is kept stripped and free of duplicates.
+# The optional 'tz' is the IANA zone (e.g. 'Europe/Berlin') that 'date',
+# 'time', the end and 'notify_time' are wall-clock times in; without it they
+# are in the computer's local time. notify_ts is the UTC instant, resolved
+# through the cached offsets in timezones.py.
+# Events from older files are migrated as they are loaded; the end fields
+# are optional, and events without them simply have no explicit end.
+EVENT_SCHEMA = 2
+EVENT_DATE_FORMAT = "%Y-%m-%d"
+EVENT_TIME_FORMAT = "%I:%M %p"
+# Intervals are in minutes since day 1 (date ordinal * MINUTES_PER_DAY).
+# Timed events without an end last DEFAULT_DURATION_MINUTES; all-day events
+# cover whole days but do not block time in conflict and free-slot queries.
+MINUTES_PER_DAY = 1440
+DEFAULT_DURATION_MINUTES = 60
+# Archival: events dated before the first of the month this many months ago
+# are moved out of the year shards into one compressed archive file, read
+# only when the calendar goes back that far or the archive is searched.
+# 0 in the 'archive_after_months' setting turns archival off.
+ARCHIVE_KEY = "archive"
+DEFAULT_ARCHIVE_AFTER_MONTHS = 12
+# Durability ('durability' setting). Files are always written to a .tmp and
+# renamed over the old one, so a crash leaves the old or the new version.
+#   none           no fsync: fastest, but after a power loss the rename may
+#                  survive while the data did not, leaving an empty file
+#   fsync-on-save  every save fsyncs each file before the rename and the
+#                  directory after it (the default)
+#   group-commit   changes are saved (with fsync) at most once per
+#                  'group_commit_ms'; changes made in the meantime share the
+#                  save. Callers flush() when the window ends, and any
+#                  still pending are flushed when the process exits normally.
+DURABILITY_NONE = "none"
+DURABILITY_FSYNC = "fsync-on-save"
+DURABILITY_GROUP_COMMIT = "group-commit"
+DURABILITY_MODES = (DURABILITY_NONE, DURABILITY_FSYNC, DURABILITY_GROUP_COMMIT)
+DEFAULT_DURABILITY = DURABILITY_FSYNC
+DEFAULT_GROUP_COMMIT_MS = 200
+
+def sync_directory(path):
+    """Makes renames in a directory durable. Windows cannot open directories for this; NTFS journals renames."""
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _flush_at_exit(manager_ref):
+    manager = manager_ref()
+    if manager is not None and manager.has_pending_commit():
+        try:
+            manager.flush()
+        except Exception:
+            pass # Already reported by save_to_file
+
+def calibrate_kdf_iterations(target_seconds=DEFAULT_KDF_TARGET_SECONDS):
+    """Returns the PBKDF2 iteration count that takes about target_seconds on this machine."""
+    start = time.perf_counter()
+    PBKDF2(b"calibration", b"\0" * 16, dkLen=32, count=KDF_PROBE_ITERATIONS, hmac_hash_module=SHA256)
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    iterations = int(KDF_PROBE_ITERATIONS * target_seconds / elapsed)
+    return min(MAX_KDF_ITERATIONS, max(MIN_KDF_ITERATIONS, iterations))
+
+def new_kdf_params(iterations, user_passphrase=False):
+    """Returns KDF parameters with a fresh random salt."""
+    kdf = {
+        "alg": KDF_ALGORITHM,
+        "salt": base64.b64encode(get_random_bytes(16)).decode('ascii'),
+        "iterations": int(iterations),
+    }
+    if user_passphrase:
+        kdf['passphrase'] = KDF_USER_PASSPHRASE
+    return kdf
+
+def date_ordinal(date_str):
+    """Returns the ordinal of a 'yyyy-MM-dd' string, or None if it is not a valid date."""
+    try:
+        return datetime.strptime(date_str, EVENT_DATE_FORMAT).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+def time_minutes(time_str):
+    """Returns minutes since midnight of an 'hh:mm AP' string, or None for all-day/invalid."""
+    if not time_str:
+        return None
+    try:
+        parsed = datetime.strptime(time_str, EVENT_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return parsed.hour * 60 + parsed.minute
+
+def normalize_event(event):
+    """Fills an event's canonical fields from its date, time and notify_time. Returns the event."""
+    event['date_ordinal'] = date_ordinal(event.get('date'))
+    event['time_minutes'] = time_minutes(event.get('time'))
+    notify_ts = None
+    if event.get('notify') and event.get('notify_time'):
+        try:
+            notify_dt = datetime.fromisoformat(event['notify_time'])
+            if notify_dt.tzinfo is not None:
+                notify_ts = notify_dt.timestamp()
+            else:
+                notify_ts = timezones.wall_to_timestamp(event.get('tz') or None, notify_dt.toordinal(),
+                                                        notify_dt.hour * 60 + notify_dt.minute) + notify_dt.second
+        except (TypeError, ValueError, OverflowError):
+            pass
+    event['notify_ts'] = notify_ts
+    end_ordinal = date_ordinal(event.get('end_date')) if event.get('end_date') else None
+    if event['date_ordinal'] is None or (end_ordinal is not None and end_ordinal < event['date_ordinal']):
+        end_ordinal = None
+    event['end_ordinal'] = end_ordinal
+    event['end_minutes'] = time_minutes(event.get('end_time'))
+    if 'tags' in event:
+        event['tags'] = normalize_tags(event['tags'])
+    return event
+
+def event_interval(event):
+    """Returns an event's half-open (start, end) in minutes since day 1, or None if undated."""
+    ordinal = event.get('date_ordinal')
+    if not ordinal:
+        return None
+    end_ordinal = event.get('end_ordinal') or ordinal
+    minutes = event.get('time_minutes')
+    if minutes is None:
+        return ordinal * MINUTES_PER_DAY, (end_ordinal + 1) * MINUTES_PER_DAY
+    start = ordinal * MINUTES_PER_DAY + minutes
+    end_minutes = event.get('end_minutes')
+    if end_minutes is not None:
+        end = end_ordinal * MINUTES_PER_DAY + end_minutes
+    elif end_ordinal > ordinal:
+        end = (end_ordinal + 1) * MINUTES_PER_DAY # Through the end of the last day
+    else:
+        end = start + DEFAULT_DURATION_MINUTES
+    return (start, end) if end > start else (start, start + DEFAULT_DURATION_MINUTES)
+
+def datetime_to_minutes(value):
+    """Converts a naive datetime to minutes since day 1."""
+    return value.toordinal() * MINUTES_PER_DAY + value.hour * 60 + value.minute
+
+def minutes_to_datetime(minutes):
+    """Converts minutes since day 1 back to a naive datetime."""
+    return datetime.fromordinal(minutes // MINUTES_PER_DAY) + timedelta(minutes=minutes % MINUTES_PER_DAY)
+
+def event_sort_key(event):
+    """Sorts by date, then time with all-day events first."""
+    minutes = event.get('time_minutes')
+    return (event.get('date_ordinal') or 0, -1 if minutes is None else minutes)
+
+def shard_key_for_date(date_str):
+    """Returns the shard key (the year) for a 'yyyy-MM-dd' date string."""
+    if isinstance(date_str, str) and len(date_str) >= 4 and date_str[:4].isdigit():
+        return date_str[:4]
+    return UNDATED_SHARD
+
+class PassphraseError(ValueError):
+    """A file could not be decrypted: wrong passphrase (or a damaged file)."""
+
 
 class DataManager:
-    def __init__(self, data_file='britton_data.enc'):
+    def __init__(self, data_file=DEFAULT_DATA_FILE, kdf_iterations=None, passphrase=None):
+        """Opens (or prepares) the store at data_file.
+
+        kdf_iterations fixes the iteration count for a new store instead of
+        calibrating it; existing stores always use the count in their header.
+        passphrase is the user's passphrase (None for the built-in one); a new
+        store created with one is marked as needing it. Raises PassphraseError
+        if the store needs a passphrase and this one does not open it.
+        """
         self.data_file = data_file
         self.events = []
-        # Default settings - Added 'style_name'
-        self.settings = {
-            "theme": "light", # Kept for potential fallback/simplicity
-            "accent_color": DEFAULT_ACCENT_COLOR,
-            "style_name": DEFAULT_STYLE
-        }
-        # Hardcoded passphrase and salt - Not recommended for production
-        self._passphrase = "BrittonCalendarDefaultKey"
-        salt = b"britton_calendar_salt"
+        # Change tracking for delta exports: every mutation bumps change_seq,
+        # deletions leave a tombstone carrying the sequence they happened at.
+        self.change_seq = 0
+        self.tombstones = []
+        self._tombstone_floor = 0 # Highest change_seq of any dropped tombstone
+        # Year sharding: only the shards in _loaded_shards are in self.events,
+        # and only shards in _dirty_shards are rewritten on save.
+        self.shards = {} # shard key -> {"count": n, "max_seq": highest change_seq}
+        self._loaded_shards = set()
+        self._dirty_shards = set()
+        # Archive of past events, kept out of self.events. _archive is None
+        # until first needed; archive_info is its manifest entry.
+        self.archive_info = {} # {"count", "max_seq", "version", "before": date ordinal}
+        self._archive = None
+        self._archive_by_date = {} # date_ordinal -> archived events, built when loaded
+        self._archive_dirty = False
+        self._archive_removed = set() # ids moved back out of the archive since the last save
+        # Multi-process safety: saves hold an advisory lock, and the data
+        # file's header version tells whether another process saved since
+        # we last read it. _unsynced maps event id -> 'upsert' / 'delete' for
+        # local changes not yet saved, which are merged over disk changes.
+        self._file_lock = FileLock(self.data_file + ".lock")
+        self._store_version = 0
+        self._file_stamp = None
+        self._unsynced = {}
+        self._synced_change_seq = 0
+        # Indexes derived from self.events, built on first use. The interval
+        # index is rebuilt after any change; the bitmap index (tags, days)
+        # is updated in place by edits and shard loads.
+        self._interval_index = None
+        self._bitmap_index = None
+        # Undo/redo: (label, ops) per change; see _execute for the op format
+        self._undo_log = []
+        self._redo_log = []
+        # Observers of changes (see change_bus.py)
+        self.changes = ChangeBus()
+        # Group commit: monotonic time of the oldest change not saved yet
+        self._commit_pending_since = None
+        atexit.register(_flush_at_exit, weakref.ref(self))
+        # Settings have their own plain JSON file (see settings_store.py),
+        # readable without the key; stores from before it keep them in the
+        # manifest until the next save.
+        self._settings_store = SettingsStore(data_file)
+        self.settings = self._settings_store.load()
+        self._passphrase = passphrase or DEFAULT_PASSPHRASE
+        # The salt and iteration count come from the data file's header; a new
+        # store gets a random salt and iterations calibrated for this machine.
+        self._derived_keys = {} # (salt, iterations) -> key, so each is derived once
+        # Journal of an unfinished passphrase change (see rekey_job.py), or None
+        self._rekey_journal = None
+        from rekey_job import read_journal
+        journal = read_journal(self.data_file)
+        if journal:
+            self._open_rekey_journal(journal) # Raises PassphraseError unless given the new passphrase
+        elif os.path.exists(self.data_file):
+            self._kdf = self.read_file_header(self.data_file).get('kdf') or dict(LEGACY_KDF)
+        else:
+            self._kdf = new_kdf_params(kdf_iterations or calibrate_kdf_iterations(), user_passphrase=bool(passphrase))
         # Derive encryption key using PBKDF2
         try:
-            self._key = PBKDF2(self._passphrase.encode('utf-8'), salt, dkLen=32, count=100_000, hmac_hash_module=SHA256)
+            self._key = self.derive_key(self._kdf)
         except Exception as e:
             print(f"FATAL: Failed to derive encryption key: {e}", file=sys.stderr)
             # Indicate failure; methods using _key should check or will raise errors
@@ -46,241 +318,1553 @@ class DataManager:
             try:
                 self._load_from_file()
             except Exception as e: # Keep broad exception for loading
+                if isinstance(e, PassphraseError) and self.has_user_passphrase():
+                    raise # Never start empty (and overwrite the store) on a wrong passphrase
                 print(f"Warning: Failed to load data file '{self.data_file}': {e}", file=sys.stderr)
                 # Reset to defaults on load failure to ensure consistent state
                 self.events = []
-                self.settings = { # Reset to defaults including style_name
-                     "theme": "light",
-                     "accent_color": DEFAULT_ACCENT_COLOR,
-                     "style_name": DEFAULT_STYLE
-                }
+                self.change_seq = 0
+                self.tombstones = []
+                self._tombstone_floor = 0
+                self.shards = {}
+                self._loaded_shards = set()
+                self._dirty_shards = set()
+                self._unsynced = {}
+                self._reset_archive({})
 
-    def _encrypt_data(self, plaintext_bytes):
-        """Encrypts plaintext bytes using AES-EAX."""
-        if not self._key:
+    def derive_key(self, kdf, passphrase=None):
+        """Derives (or returns the cached) key for a set of KDF parameters.
+
+        Keys are cached by salt and iteration count; every passphrase change
+        uses a fresh salt, so keys of the old passphrase can stay cached.
+        """
+        if kdf.get('alg', KDF_ALGORITHM) != KDF_ALGORITHM:
+            raise ValueError(f"Unsupported key derivation algorithm '{kdf.get('alg')}'.")
+        salt = base64.b64decode(kdf['salt'])
+        iterations = int(kdf['iterations'])
+        key = self._derived_keys.get((salt, iterations))
+        if key is None:
+            with perf_stats.timed("kdf.derive"):
+                key = PBKDF2((passphrase or self._passphrase).encode('utf-8'), salt, dkLen=32, count=iterations,
+                             hmac_hash_module=SHA256)
+            self._derived_keys[(salt, iterations)] = key
+        return key
+
+    @staticmethod
+    def needs_passphrase(data_file):
+        """True if the store at data_file was given a passphrase of the user's own."""
+        from rekey_job import read_journal
+        try:
+            journal = read_journal(data_file)
+        except ValueError:
+            journal = None
+        kdf = journal['kdf'] if journal else DataManager.read_file_header(data_file).get('kdf') or {}
+        return kdf.get('passphrase') == KDF_USER_PASSPHRASE
+
+    def has_user_passphrase(self):
+        return self._passphrase != DEFAULT_PASSPHRASE or self._kdf.get('passphrase') == KDF_USER_PASSPHRASE
+
+    def _encrypt_data(self, plaintext_bytes, associated_data=None, key=None):
+        """Encrypts plaintext bytes using AES-EAX, authenticating optional associated data."""
+        key = key or self._key
+        if not key:
              raise RuntimeError("Encryption key is not available.")
-        cipher = AES.new(self._key, AES.MODE_EAX) # EAX mode creates nonce automatically
+        cipher = AES.new(key, AES.MODE_EAX) # EAX mode creates nonce automatically
+        if associated_data:
+            cipher.update(associated_data)
         ciphertext, tag = cipher.encrypt_and_digest(plaintext_bytes)
         # Return nonce, tag, and ciphertext needed for decryption
         return cipher.nonce, tag, ciphertext
 
-    def _decrypt_data(self, nonce, tag, ciphertext):
+    def _decrypt_data(self, nonce, tag, ciphertext, associated_data=None, key=None):
         """Decrypts ciphertext using AES-EAX."""
-        if not self._key:
+        key = key or self._key
+        if not key:
              raise RuntimeError("Encryption key is not available.")
-        cipher = AES.new(self._key, AES.MODE_EAX, nonce=nonce)
+        cipher = AES.new(key, AES.MODE_EAX, nonce=nonce)
+        if associated_data:
+            cipher.update(associated_data)
         # Decrypt and verify integrity using the tag
         plaintext = cipher.decrypt_and_verify(ciphertext, tag) # Raises ValueError on failure
         return plaintext
 
-    def _load_from_file(self):
-        """Loads and decrypts data from the data file."""
-        if not self._key:
-             print("Warning: Cannot load data, encryption key is not available.", file=sys.stderr)
-             return # Avoid proceeding without a key
+    @staticmethod
+    def _split_header(file_bytes):
+        """Splits file bytes into (header dict, header bytes, body). Legacy files have no header."""
+        if not file_bytes.startswith(FILE_MAGIC):
+            return {}, b"", file_bytes
+        (header_len,) = struct.unpack(">I", file_bytes[4:8])
+        header_bytes = file_bytes[8:8 + header_len]
+        return json.loads(header_bytes.decode('utf-8')), header_bytes, file_bytes[8 + header_len:]
+
+    @staticmethod
+    def read_file_header(path):
+        """Reads only the plaintext header of an encrypted file (no decryption)."""
+        try:
+            with open(path, 'rb') as f:
+                prefix = f.read(8)
+                if not prefix.startswith(FILE_MAGIC):
+                    return {}
+                (header_len,) = struct.unpack(">I", prefix[4:8])
+                return json.loads(f.read(header_len).decode('utf-8'))
+        except (IOError, ValueError, struct.error):
+            return {}
 
+    def _read_encrypted_file_with_header(self, path):
+        """Reads, decrypts and parses one encrypted JSON file. Returns (header, data)."""
         try:
-            with open(self.data_file, 'rb') as f:
-                file_bytes = f.read()
+            with perf_stats.timed("load.read") as timer:
+                with open(path, 'rb') as f:
+                    file_bytes = f.read()
+                timer.add_bytes(len(file_bytes))
         except IOError as e:
-             raise IOError(f"Failed to read data file '{self.data_file}': {e}") from e
+             raise IOError(f"Failed to read data file '{path}': {e}") from e
+
+        try:
+            header, header_bytes, body = self._split_header(file_bytes)
+        except (ValueError, struct.error) as e:
+            raise ValueError(f"Data file '{path}' has a damaged header: {e}") from e
 
         # Basic check for minimum length (nonce + tag)
         # AES-EAX nonce is 16 bytes, tag is 16 bytes
-        if len(file_bytes) < 32:
-            raise ValueError(f"Data file '{self.data_file}' is too short.")
+        if len(body) < 32:
+            raise ValueError(f"Data file '{path}' is too short.")
 
         # Extract nonce, tag, and ciphertext from the file bytes
-        nonce, tag, ciphertext = file_bytes[:16], file_bytes[16:32], file_bytes[32:]
+        nonce, tag, ciphertext = body[:16], body[16:32], body[32:]
 
         try:
+            # Each file names the KDF parameters its key came from
+            key = self.derive_key(header.get('kdf') or LEGACY_KDF)
             # Decrypt the data
-            plaintext = self._decrypt_data(nonce, tag, ciphertext)
+            with perf_stats.timed("load.decrypt") as timer:
+                try:
+                    plaintext = self._decrypt_data(nonce, tag, ciphertext, associated_data=header_bytes, key=key)
+                except ValueError as e: # Authentication failed
+                    raise PassphraseError(f"Could not decrypt '{path}': wrong passphrase or damaged file.") from e
+                timer.add_bytes(len(ciphertext))
+            if header.get('compression') == 'zlib':
+                plaintext = zlib.decompress(plaintext)
             # Decode from UTF-8 and parse JSON
-            data = json.loads(plaintext.decode('utf-8'))
-
-            # Update events and settings, providing defaults if keys are missing
-            # Ensures that if new settings are added later, old files load with defaults
-            loaded_events = data.get('events', [])
-            # Basic validation: ensure events is a list
-            self.events = loaded_events if isinstance(loaded_events, list) else []
-
-            loaded_settings = data.get('settings', {})
-            # Ensure settings is a dict and merge with defaults (loaded values override)
-            default_settings = {
-                "theme": "light",
-                "accent_color": DEFAULT_ACCENT_COLOR,
-                "style_name": DEFAULT_STYLE
-            }
-            if isinstance(loaded_settings, dict):
-                default_settings.update(loaded_settings) # Update defaults with loaded values
-            self.settings = default_settings
-
-        except (ValueError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            with perf_stats.timed("load.parse") as timer:
+                timer.add_bytes(len(plaintext))
+                return header, json.loads(plaintext.decode('utf-8'))
+        except PassphraseError:
+            raise
+        except (ValueError, json.JSONDecodeError, UnicodeDecodeError, zlib.error) as e:
             # Handle specific errors during decryption/parsing
-            raise ValueError(f"Failed to decrypt or parse data file '{self.data_file}': {e}") from e
+            raise ValueError(f"Failed to decrypt or parse data file '{path}': {e}") from e
         except Exception as e: # Catch-all for other potential errors (like Crypto errors)
             raise RuntimeError(f"An unexpected error occurred loading data: {e}") from e
 
+    def _read_encrypted_file(self, path):
+        """Reads, decrypts and parses one encrypted JSON file."""
+        return self._read_encrypted_file_with_header(path)[1]
+
+    def _write_encrypted_file(self, path, data, header=None, compress=False):
+        """Serializes, encrypts and atomically writes one JSON file with a header.
+
+        With compress set the JSON is zlib-compressed before encryption; the
+        header records it, so readers need no flag.
+        """
+        header = dict(header or {}, kdf=self._kdf)
+        if compress:
+            header['compression'] = 'zlib'
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        # Serialize data to JSON string, encode to bytes
+        # Use indent for readability if decrypted manually, but makes file larger
+        with perf_stats.timed("save.serialize") as timer:
+            plaintext = json.dumps(data, ensure_ascii=False, indent=None).encode('utf-8')
+            timer.add_bytes(len(plaintext))
+        if compress:
+            with perf_stats.timed("save.compress") as timer:
+                plaintext = zlib.compress(plaintext)
+                timer.add_bytes(len(plaintext))
+        # Encrypt the plaintext bytes
+        with perf_stats.timed("save.encrypt") as timer:
+            nonce, tag, ciphertext = self._encrypt_data(plaintext, associated_data=header_bytes)
+            timer.add_bytes(len(ciphertext))
+        # Write the header, nonce, tag, and ciphertext concatenated to the file
+        # Use a temporary file and rename for atomic write (safer)
+        temp_file_path = path + ".tmp"
+        durable = self.durability_mode() != DURABILITY_NONE
+        try:
+            with perf_stats.timed("save.write") as timer:
+                with open(temp_file_path, 'wb') as f:
+                    f.write(FILE_MAGIC + struct.pack(">I", len(header_bytes)) + header_bytes)
+                    f.write(nonce + tag + ciphertext)
+                    if durable: # The data must be on disk before the rename can be
+                        f.flush()
+                        with perf_stats.timed("save.fsync"):
+                            os.fsync(f.fileno())
+                os.replace(temp_file_path, path) # Atomic replace if possible
+                timer.add_bytes(8 + len(header_bytes) + 32 + len(ciphertext))
+            if durable:
+                with perf_stats.timed("save.fsync"):
+                    sync_directory(os.path.dirname(os.path.abspath(path)))
+        except (IOError, OSError):
+            # Attempt to clean up temporary file if rename failed
+            if os.path.exists(temp_file_path):
+                 try: os.remove(temp_file_path)
+                 except OSError: pass
+            raise
+
+    @perf_stats.timed_function("store.load")
+    def _load_from_file(self):
+        """Loads and decrypts data from the data file."""
+        if not self._key:
+             print("Warning: Cannot load data, encryption key is not available.", file=sys.stderr)
+             return # Avoid proceeding without a key
+
+        with self._file_lock:
+            self._file_stamp = self._stat_data_file()
+            header, data = self._read_encrypted_file_with_header(self.data_file)
+            self._apply_loaded_data(header, data)
+
+    def _apply_loaded_data(self, header, data):
+        """Replaces in-memory state with the contents of a freshly read data file."""
+        self._store_version = int(header.get('version', 0))
+        self._unsynced = {}
+        loaded_archive = data.get('archive')
+        self._reset_archive(loaded_archive if isinstance(loaded_archive, dict) else {})
+
+        # Change tracking state (absent in files written before delta export)
+        self.change_seq = int(data.get('change_seq', 0))
+        loaded_tombstones = data.get('tombstones', [])
+        self.tombstones = loaded_tombstones if isinstance(loaded_tombstones, list) else []
+        self._tombstone_floor = int(data.get('tombstone_floor', 0))
+        if data.get('event_schema', 1) < EVENT_SCHEMA:
+            for tomb in self.tombstones:
+                normalize_event(tomb)
+
+        # Older stores keep settings in the manifest; they move to the
+        # settings file on the next save
+        loaded_settings = data.get('settings')
+        if isinstance(loaded_settings, dict) and not self._settings_store.exists():
+            self.settings = default_settings()
+            self.settings.update(loaded_settings)
+
+        self.events = []
+        self._drop_indexes()
+        self._loaded_shards = set()
+        self._dirty_shards = set()
+        if data.get('format', 1) >= STORE_FORMAT:
+            loaded_shards = data.get('shards', {})
+            self.shards = loaded_shards if isinstance(loaded_shards, dict) else {}
+            self._synced_change_seq = self.change_seq
+            for key in self._startup_shard_keys():
+                self.load_shard(key)
+            return
+
+        # Single-file store from before sharding: everything is in memory, and
+        # the next save splits it into shard files.
+        loaded_events = data.get('events', [])
+        # Basic validation: ensure events is a list
+        self.events = [ev for ev in loaded_events if isinstance(ev, dict)] if isinstance(loaded_events, list) else []
+        # Events from older files have no change_seq yet; number them so a
+        # delta export from sequence 0 still covers everything.
+        for ev in self.events:
+            if 'change_seq' not in ev:
+                self.change_seq += 1
+                ev['change_seq'] = self.change_seq
+                ev.setdefault('sequence', 0)
+        if data.get('event_schema', 1) < EVENT_SCHEMA:
+            for ev in self.events:
+                normalize_event(ev)
+        keys = {shard_key_for_date(ev.get('date')) for ev in self.events}
+        self.shards = {key: {"count": 0, "max_seq": 0} for key in keys}
+        self._loaded_shards = set(keys)
+        self._dirty_shards = set(keys)
+        self._synced_change_seq = self.change_seq
+
+    # --- Shards ---
+
+    def _shard_path(self, key, data_file=None):
+        """Returns the file path of a shard, e.g. britton_data.2025.enc."""
+        root, ext = os.path.splitext(data_file or self.data_file)
+        return f"{root}.{key}{ext}"
+
+    def _startup_shard_keys(self):
+        """Returns the stored shards covering today through the startup lookahead."""
+        today = date.today()
+        keys = {str(today.year), str((today + timedelta(days=STARTUP_LOOKAHEAD_DAYS)).year), UNDATED_SHARD}
+        return sorted(key for key in keys if key in self.shards)
 
+    @perf_stats.timed_function("store.load_shard")
+    def read_shard(self, key, data_file=None):
+        """Reads and decrypts a shard's events without changing any state.
+
+        Safe to call from a worker thread; hand the result to merge_shard
+        on the thread that owns this DataManager. data_file reads the shard
+        of another store instead (see read_calendar_file).
+        """
+        path = self._shard_path(key, data_file)
+        if not os.path.exists(path):
+            return []
+        data = self._read_encrypted_file(path)
+        loaded_events = data.get('events', [])
+        shard_events = [ev for ev in loaded_events if isinstance(ev, dict)] if isinstance(loaded_events, list) else []
+        if data.get('event_schema', 1) < EVENT_SCHEMA:
+            for ev in shard_events:
+                normalize_event(ev)
+        return shard_events
+
+    def read_calendar_file(self, path):
+        """Reads every event of another calendar file (a backup or a data file) without changing any state.
+
+        A sharded store is read with its shard and archive files. No lock is
+        taken and nothing is written, so the file may be on read-only media.
+        Files with the same key parameters as this store reuse its derived key.
+        Safe to call from a worker thread.
+        """
+        data = self._read_encrypted_file(path)
+        if data.get('format', 1) < STORE_FORMAT:
+            loaded_events = data.get('events', [])
+            events = [ev for ev in loaded_events if isinstance(ev, dict)] if isinstance(loaded_events, list) else []
+            if data.get('event_schema', 1) < EVENT_SCHEMA:
+                for ev in events:
+                    normalize_event(ev)
+            return events
+        events = []
+        for key in sorted(data.get('shards') or {}):
+            events.extend(self.read_shard(key, path))
+        hot_ids = {ev.get('id') for ev in events}
+        events.extend(ev for ev in self.read_archive(path) if ev.get('id') not in hot_ids)
+        return events
+
+    def merge_shard(self, key, shard_events):
+        """Adds a shard's events read by read_shard. Returns False if it was already loaded."""
+        if key in self._loaded_shards:
+            return False
+        self.events.extend(shard_events)
+        self._interval_index = None
+        if self._bitmap_index is not None:
+            for ev in shard_events:
+                self._bitmap_index.add(ev)
+        self._loaded_shards.add(key)
+        if self.shards.get(key, {}).get('schema', 1) < EVENT_SCHEMA:
+            self._dirty_shards.add(key) # read_shard migrated it; persist on the next save
+        return True
+
+    def load_shard(self, key):
+        """Loads a shard synchronously if it is not loaded yet."""
+        if key in self._loaded_shards:
+            return
+        self.merge_shard(key, self.read_shard(key))
+
+    def load_all_shards(self):
+        """Loads every shard; needed by operations that cover the whole calendar."""
+        for key in sorted(self.shards):
+            self.load_shard(key)
+
+    def is_shard_loaded(self, key):
+        return key in self._loaded_shards or key not in self.shards
+
+    def shards_for_range(self, start_date, end_date):
+        """Returns keys of stored but unloaded shards overlapping a date range."""
+        keys = (str(year) for year in range(start_date.year, end_date.year + 1))
+        return [key for key in keys if key in self.shards and key not in self._loaded_shards]
+
+    def _mark_dirty(self, key):
+        """Flags a shard for rewriting on the next save, loading it first if needed.
+
+        Writing a shard that was never loaded would drop the events stored
+        in it, so it is loaded synchronously here.
+        """
+        if key in self.shards and key not in self._loaded_shards:
+            self.load_shard(key)
+        self._loaded_shards.add(key)
+        self._dirty_shards.add(key)
+
+    # --- Archive ---
+    # Past events live in one compressed, encrypted file next to the shards
+    # (britton_data.archive.enc). Archiving is housekeeping, not an edit:
+    # change sequences are kept, no tombstones are written and it is not
+    # undoable. Editing or deleting an archived event moves it back first.
+
+    def _reset_archive(self, info):
+        self.archive_info = info
+        self._archive = None
+        self._archive_by_date = {}
+        self._archive_dirty = False
+        self._archive_removed = set()
+
+    def archive_cutoff(self):
+        """Returns the date ordinal events are archived before, or None if archival is off."""
+        try:
+            months = int(self.settings.get('archive_after_months', DEFAULT_ARCHIVE_AFTER_MONTHS) or 0)
+        except (TypeError, ValueError):
+            months = DEFAULT_ARCHIVE_AFTER_MONTHS
+        if months <= 0:
+            return None
+        today = date.today()
+        month_index = today.year * 12 + today.month - 1 - months
+        return date(month_index // 12, month_index % 12 + 1, 1).toordinal()
+
+    def has_archive(self):
+        return bool(self.archive_info.get('count') or self._archive)
+
+    def archived_before(self):
+        """Returns the date ordinal before which events may be archived (0 without an archive)."""
+        return self.archive_info.get('before', 0) if self.has_archive() else 0
+
+    def is_archive_loaded(self):
+        return self._archive is not None or not self.has_archive()
+
+    @perf_stats.timed_function("store.load_archive")
+    def read_archive(self, data_file=None):
+        """Reads and decrypts the archive without changing any state.
+
+        Like read_shard, safe to call from a worker thread; hand the result
+        to merge_archive on the thread that owns this DataManager.
+        """
+        path = self._shard_path(ARCHIVE_KEY, data_file)
+        if not os.path.exists(path):
+            return []
+        data = self._read_encrypted_file(path)
+        loaded_events = data.get('events', [])
+        return [ev for ev in loaded_events if isinstance(ev, dict)] if isinstance(loaded_events, list) else []
+
+    def merge_archive(self, archived_events):
+        """Installs events read by read_archive. Returns False if the archive was already loaded."""
+        if self._archive is not None:
+            return False
+        self._archive = archived_events
+        self._index_archive()
+        return True
+
+    def load_archive(self):
+        """Loads the archive synchronously if needed and returns its events."""
+        if self._archive is None:
+            self.merge_archive(self.read_archive())
+        return self._archive
+
+    def _index_archive(self):
+        self._archive_by_date = {}
+        for ev in self._archive:
+            self._archive_by_date.setdefault(ev.get('date_ordinal'), []).append(ev)
+
+    def archived_events_on(self, ordinal):
+        """Returns the archived events on one date; empty while the archive is not loaded."""
+        return self._archive_by_date.get(ordinal, [])
+
+    def _shard_min_ordinal(self, key):
+        """Returns the earliest date ordinal in a stored shard (the year's start for older manifests)."""
+        info = self.shards.get(key, {})
+        if 'min_ordinal' in info:
+            return info['min_ordinal']
+        try:
+            return date(int(key), 1, 1).toordinal()
+        except ValueError:
+            return None
+
+    def archive_old_events(self):
+        """Moves events dated before archive_cutoff() into the archive and saves.
+
+        Only shards whose earliest date is before the cutoff are read.
+        Returns the number of events moved.
+        """
+        cutoff = self.archive_cutoff()
+        if cutoff is None:
+            return 0
+        keys = [key for key in self.shards if key != UNDATED_SHARD
+                and (self._shard_min_ordinal(key) or cutoff) < cutoff]
+        if not keys:
+            return 0
+        for key in keys:
+            self.load_shard(key)
+        moving = [ev for ev in self.events if ev.get('date_ordinal') is not None and ev['date_ordinal'] < cutoff]
+        for key in keys:
+            self._mark_dirty(key) # Rewritten without the moved events (or to record min_ordinal)
+        if moving:
+            moved = {id(ev) for ev in moving}
+            self.events[:] = [ev for ev in self.events if id(ev) not in moved]
+            self._drop_indexes()
+            archive = self.load_archive()
+            positions = {ev.get('id'): i for i, ev in enumerate(archive)}
+            for ev in moving:
+                event_id = ev.get('id')
+                if event_id in positions:
+                    archive[positions[event_id]] = ev # Left in both places by an interrupted save
+                else:
+                    archive.append(ev)
+                self._unsynced[event_id] = 'delete' # Gone from its shard
+                self._archive_removed.discard(event_id)
+            self._index_archive()
+            self._archive_dirty = True
+            self.archive_info['before'] = max(self.archive_info.get('before', 0), cutoff)
+        self.save_to_file()
+        if moving:
+            self.changes.publish(bulk_change(None))
+        return len(moving)
+
+    def _unarchive(self, event_ids):
+        """Moves archived events back into the shards, e.g. before editing them. Returns the ids moved."""
+        archive = self.load_archive()
+        moving = [ev for ev in archive if ev.get('id') in event_ids]
+        if not moving:
+            return set()
+        moved = {id(ev) for ev in moving}
+        archive[:] = [ev for ev in archive if id(ev) not in moved]
+        for ev in moving:
+            self._mark_dirty(shard_key_for_date(ev.get('date')))
+            self._unsynced[ev.get('id')] = 'upsert'
+            self._archive_removed.add(ev.get('id'))
+        self.events.extend(moving)
+        self._drop_indexes()
+        self._index_archive()
+        self._archive_dirty = True
+        return {ev.get('id') for ev in moving}
+
+    def _all_events(self):
+        """Loads every shard and the archive; returns all events (shards first, no duplicates)."""
+        self.load_all_shards()
+        if not self.has_archive():
+            return self.events
+        hot_ids = {ev.get('id') for ev in self.events}
+        return self.events + [ev for ev in self.load_archive() if ev.get('id') not in hot_ids]
+
+    def _write_archive(self):
+        """Writes the archive file, or removes it once empty. Caller holds the lock."""
+        archive = self._archive or []
+        path = self._shard_path(ARCHIVE_KEY)
+        if archive:
+            version = self.archive_info.get('version', 0) + 1
+            self._write_encrypted_file(path, {"format": STORE_FORMAT, "event_schema": EVENT_SCHEMA, "events": archive},
+                                       header={"version": version}, compress=True)
+            self.archive_info.update(count=len(archive),
+                                     max_seq=max(ev.get('change_seq', 0) for ev in archive),
+                                     version=version)
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            self.archive_info = {}
+        self._archive_dirty = False
+        self._archive_removed = set()
+
+    def search_events(self, text, include_archive=True):
+        """Returns events whose title or description contains text (case-insensitive), by date.
+
+        Reads every shard and, with include_archive, the archive.
+        """
+        needle = text.casefold()
+        if include_archive:
+            events = self._all_events()
+        else:
+            self.load_all_shards()
+            events = self.events
+        matches = [ev for ev in events
+                   if needle in ev.get('title', '').casefold() or needle in ev.get('description', '').casefold()]
+        matches.sort(key=event_sort_key)
+        return matches
+
+
+    @perf_stats.timed_function("store.save")
     def save_to_file(self):
-        """Encrypts and saves the current events and settings to the data file."""
+        """Encrypts and saves changed shards and the settings/manifest file.
+
+        Runs under the store's file lock. If another process saved since this
+        one last read the store, its changes are merged in at the event level
+        first, so neither side's edits are lost. Re-raises write errors
+        (e.g. a full disk) and TimeoutError if the lock stays busy (e.g.
+        while a passphrase change converts a large file), so callers can
+        revert the change they tried to save.
+        """
+        if not self._settings_store.is_saved(self.settings):
+            self.save_settings()
         if not self._key:
              print("Error: Cannot save data, encryption key is not available.", file=sys.stderr)
              # Consider raising an exception to make the failure explicit
              raise RuntimeError("Cannot save data: Encryption key unavailable.")
 
-        # Prepare data dictionary using current state
-        data = {"events": self.events, "settings": self.settings}
-
+        merged = None
         try:
-            # Serialize data to JSON string, encode to bytes
-            # Use indent for readability if decrypted manually, but makes file larger
-            plaintext = json.dumps(data, ensure_ascii=False, indent=None).encode('utf-8')
-            # Encrypt the plaintext bytes
-            nonce, tag, ciphertext = self._encrypt_data(plaintext)
-            # Write the nonce, tag, and ciphertext concatenated to the file
-            # Use a temporary file and rename for atomic write (safer)
-            temp_file_path = self.data_file + ".tmp"
-            with open(temp_file_path, 'wb') as f:
-                f.write(nonce + tag + ciphertext)
-            os.replace(temp_file_path, self.data_file) # Atomic replace if possible
-
+            with self._file_lock:
+                if self.read_file_header(self.data_file).get('version', 0) != self._store_version:
+                    print("Info: Data file was changed by another process; merging before save.", file=sys.stderr)
+                    merged = self._merge_from_disk(adopt_settings=False)
+                self._write_store()
+            self._commit_pending_since = None
+        except TimeoutError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            raise # Nothing was written
         except TypeError as e:
             print(f"Error: Failed to serialize data to JSON before saving: {e}", file=sys.stderr)
-            # Potentially inspect self.events or self.settings for non-serializable data
+            raise
         except (IOError, OSError) as e:
-            print(f"Error: Failed to write data file '{self.data_file}': {e}", file=sys.stderr)
-            # Attempt to clean up temporary file if rename failed
-            if os.path.exists(temp_file_path):
-                 try: os.remove(temp_file_path)
-                 except OSError: pass
-        except Exception as e: # Catch other errors (e.g., encryption)
+            print(f"Error: Failed to write data file: {e}", file=sys.stderr)
+            raise
+        except Exception as e: # Other errors (e.g., encryption)
             print(f"Error: An unexpected error occurred during save: {e}", file=sys.stderr)
+            raise
+        finally:
+            if merged is not None: # Merged into memory even if the write then failed
+                self.changes.publish(merged)
+
+    # --- Durability ---
 
+    def durability_mode(self):
+        mode = self.settings.get('durability', DEFAULT_DURABILITY)
+        return mode if mode in DURABILITY_MODES else DEFAULT_DURABILITY
+
+    def _commit(self):
+        """Saves a change now, or under group commit once the window since the oldest unsaved change has passed."""
+        if self.durability_mode() != DURABILITY_GROUP_COMMIT:
+            self.save_to_file()
+            return
+        now = time.monotonic()
+        if self._commit_pending_since is None:
+            self._commit_pending_since = now
+        if now - self._commit_pending_since >= self.settings.get('group_commit_ms', DEFAULT_GROUP_COMMIT_MS) / 1000:
+            self.save_to_file()
+
+    def has_pending_commit(self):
+        return self._commit_pending_since is not None
+
+    def commit_due_in(self):
+        """Seconds until group-committed changes should be flushed (0 if overdue), or None if none are pending."""
+        if self._commit_pending_since is None:
+            return None
+        window = self.settings.get('group_commit_ms', DEFAULT_GROUP_COMMIT_MS) / 1000
+        return max(0.0, self._commit_pending_since + window - time.monotonic())
+
+    def flush(self):
+        """Saves changes held back by group commit. Returns True if there were any."""
+        if self._commit_pending_since is None:
+            return False
+        self.save_to_file()
+        return True
+
+    @perf_stats.timed_function("settings.save")
+    def save_settings(self):
+        """Writes only the settings file; events and the manifest are left alone."""
+        fields = self._settings_store.unsaved_keys(self.settings)
+        try:
+            self._settings_store.save(self.settings)
+        except (TypeError, ValueError) as e:
+            print(f"Error: Failed to serialize settings: {e}", file=sys.stderr)
+            return
+        except OSError as e:
+            print(f"Error: Failed to write settings file '{self._settings_store.path}': {e}", file=sys.stderr)
+            return
+        if fields:
+            self.changes.publish(Change(SETTINGS_CHANGED, fields=fields))
+
+    def _write_store(self):
+        """Writes dirty shards and the manifest, bumping version counters. Caller holds the lock."""
+        # The archive goes first: a crash before the shards are rewritten
+        # then leaves archived events in both places rather than in neither.
+        if self._archive_dirty:
+            self._write_archive()
+        # Group events of the changed shards in one pass
+        dirty = {key: [] for key in self._dirty_shards}
+        for ev in self.events:
+            key = shard_key_for_date(ev.get('date'))
+            if key in dirty:
+                dirty[key].append(ev)
+        for key in sorted(dirty):
+            shard_events = dirty[key]
+            shard_path = self._shard_path(key)
+            if shard_events:
+                version = self.shards.get(key, {}).get('version', 0) + 1
+                self._write_encrypted_file(shard_path, {"format": STORE_FORMAT, "event_schema": EVENT_SCHEMA,
+                                                        "events": shard_events},
+                                           header={"version": version})
+                ordinals = [ev['date_ordinal'] for ev in shard_events if ev.get('date_ordinal') is not None]
+                self.shards[key] = {
+                    "count": len(shard_events),
+                    "max_seq": max(ev.get('change_seq', 0) for ev in shard_events),
+                    "version": version,
+                    "schema": EVENT_SCHEMA,
+                    "min_ordinal": min(ordinals) if ordinals else None,
+                }
+            else:
+                if os.path.exists(shard_path):
+                    os.remove(shard_path)
+                self.shards.pop(key, None)
+            self._dirty_shards.discard(key)
+
+        tombstones, tombstone_floor = self.tombstones, self._tombstone_floor
+        if len(tombstones) > MAX_TOMBSTONES:
+            tombstone_floor = max(tombstone_floor, max(t.get('change_seq', 0) for t in tombstones[:-MAX_TOMBSTONES]))
+            tombstones = tombstones[-MAX_TOMBSTONES:]
+
+        # Prepare manifest dictionary using current state
+        data = {
+            "format": STORE_FORMAT,
+            "event_schema": EVENT_SCHEMA,
+            "change_seq": self.change_seq,
+            "tombstones": tombstones,
+            "tombstone_floor": tombstone_floor,
+            "shards": self.shards,
+            "archive": self.archive_info,
+        }
+        version = self._store_version + 1
+        self._write_encrypted_file(self.data_file, data, header={"version": version})
+        self.tombstones, self._tombstone_floor = tombstones, tombstone_floor
+        self._store_version = version
+        self._file_stamp = self._stat_data_file()
+        self._unsynced = {}
+        self._synced_change_seq = self.change_seq
+
+    # --- Key derivation parameters ---
+
+    def recommended_kdf_iterations(self, target_seconds=DEFAULT_KDF_TARGET_SECONDS):
+        """Returns an iteration count to re-key with, or None if the current parameters are fine.
+
+        Re-keying is recommended for stores still on the original fixed salt,
+        and when the calibrated count is more than twice (or less than half)
+        the current one, e.g. after moving the data to a faster machine.
+        """
+        recommended = calibrate_kdf_iterations(target_seconds)
+        if self._kdf.get('salt') == LEGACY_KDF['salt']:
+            return recommended
+        current = int(self._kdf.get('iterations', 0))
+        if recommended / 2 <= current <= recommended * 2:
+            return None
+        return recommended
+
+    def rekey(self, iterations=None):
+        """Re-encrypts every file of the store under a fresh random salt.
+
+        Each file records its own KDF parameters, so an interrupted re-key
+        leaves a readable store (the remaining files keep the old key).
+        """
+        if not self._key:
+            raise RuntimeError("Cannot re-key data: Encryption key unavailable.")
+        if self.rekey_in_progress():
+            raise RuntimeError("Cannot re-key data while a passphrase change is in progress.")
+        new_kdf = self.rekey_kdf(iterations or calibrate_kdf_iterations())
+        new_key = self.derive_key(new_kdf)
+        with self._file_lock:
+            if self.has_external_changes():
+                self._merge_from_disk(adopt_settings=True)
+            self.load_all_shards()
+            old_kdf, old_key = self._kdf, self._key
+            self._kdf, self._key = new_kdf, new_key
+            self._dirty_shards.update(self._loaded_shards)
+            try:
+                self._write_store()
+            except Exception:
+                self._kdf, self._key = old_kdf, old_key
+                raise
+
+    # --- Passphrase change (see rekey_job.py) ---
+
+    def rekey_in_progress(self):
+        return self._rekey_journal is not None
+
+    def _open_rekey_journal(self, journal):
+        """Adopts the new key of an unfinished passphrase change and the old keys it wraps."""
+        from rekey_job import open_journal
+        new_key = self.derive_key(journal['kdf'])
+        try:
+            old_keys = open_journal(journal, new_key)
+        except PassphraseError:
+            self._derived_keys.clear() # Derived from the wrong passphrase
+            raise
+        for kdf, key in old_keys:
+            self._derived_keys[(base64.b64decode(kdf['salt']), int(kdf['iterations']))] = key
+        self._kdf = journal['kdf']
+        self._rekey_journal = journal
+
+    def begin_passphrase_change(self, new_passphrase, backup_paths=()):
+        """Switches the store to a new passphrase and returns the RekeyJob that re-encrypts its files.
+
+        An empty new_passphrase goes back to the built-in one. The new key is
+        used for everything saved from now on; run the job (on a worker
+        thread if wanted) to convert the data file, shards, archive and the
+        given backup files, and to re-wrap the snapshot repository's key.
+        """
+        passphrase = new_passphrase or DEFAULT_PASSPHRASE
+        new_kdf = new_kdf_params(max(int(self._kdf.get('iterations', 0)), MIN_KDF_ITERATIONS),
+                                 user_passphrase=bool(new_passphrase))
+        return self._begin_rekey_job(passphrase, new_kdf, backup_paths)
+
+    def rekey_kdf(self, iterations):
+        """Fresh KDF parameters for re-keying under the current passphrase."""
+        return new_kdf_params(iterations, user_passphrase=self.has_user_passphrase())
+
+    def begin_rekey(self, new_kdf):
+        """Like rekey(), but returns a RekeyJob that re-encrypts the files instead of doing it now.
+
+        new_kdf comes from rekey_kdf(); deriving its key first (derive_key,
+        e.g. on a worker thread) makes this call quick.
+        """
+        return self._begin_rekey_job(self._passphrase, new_kdf)
+
+    def _begin_rekey_job(self, passphrase, new_kdf, backup_paths=()):
+        """Writes the journal, switches to the new key and returns the RekeyJob (see rekey_job.py)."""
+        from backup_repository import read_repository_kdf, repository_data_key
+        from rekey_job import RekeyJob, create_journal, wrap_key
+        if not self._key:
+            raise RuntimeError("Cannot re-key data: Encryption key unavailable.")
+        if self.rekey_in_progress():
+            raise RuntimeError("A passphrase change is already in progress.")
+        self.reload_if_changed()
+        with self._file_lock:
+            paths = [self.data_file] + [self._shard_path(key) for key in sorted(self.shards)]
+            paths.append(self._shard_path(ARCHIVE_KEY))
+            files = [path for path in dict.fromkeys(os.path.abspath(path) for path in paths) if os.path.exists(path)]
+            backups = [path for path in dict.fromkeys(os.path.abspath(path) for path in backup_paths)
+                       if path not in files and os.path.exists(path)]
+            old_kdfs = {}
+            for path in files + backups:
+                kdf = self.read_file_header(path).get('kdf') or dict(LEGACY_KDF)
+                old_kdfs[(kdf['salt'], int(kdf['iterations']))] = kdf
+            old_keys = [(kdf, self.derive_key(kdf)) for kdf in old_kdfs.values()]
+            new_key = self.derive_key(new_kdf, passphrase)
+            repository = None
+            repo_path = self.settings.get('snapshot_repo')
+            repo_kdf = read_repository_kdf(repo_path) if repo_path else None
+            if repo_kdf:
+                data_key = repository_data_key(repo_kdf, self.derive_key(repo_kdf))
+                repository = {"path": os.path.abspath(repo_path), "kdf": new_kdf_params(new_kdf['iterations']),
+                              "data_key": wrap_key(data_key, new_key)}
+            journal = create_journal(self.data_file, new_kdf, new_key, old_keys, files, repository, backups)
+            self._passphrase, self._kdf, self._key = passphrase, new_kdf, new_key
+            self._rekey_journal = journal
+        return RekeyJob(self, journal)
+
+    def resume_passphrase_change(self):
+        """Returns the RekeyJob of an interrupted passphrase change, or None if there is none."""
+        if self._rekey_journal is None:
+            return None
+        from rekey_job import RekeyJob
+        return RekeyJob(self, self._rekey_journal)
+
+    def finish_passphrase_change(self, journal):
+        """Called by RekeyJob once every file is converted and the journal is gone."""
+        if self._rekey_journal is journal:
+            self._rekey_journal = None
+
+    # --- Multi-process change detection ---
+
+    def _stat_data_file(self):
+        """Returns a cheap fingerprint (mtime, size) of the data file, or None."""
+        try:
+            st = os.stat(self.data_file)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def has_external_changes(self):
+        """Checks whether another process saved the store since we last read or wrote it.
+
+        Only stats the file; the header is read when the fingerprint changed.
+        """
+        stamp = self._stat_data_file()
+        if stamp is None or stamp == self._file_stamp:
+            return False
+        if self.read_file_header(self.data_file).get('version', 0) == self._store_version:
+            self._file_stamp = stamp
+            return False
+        return True
+
+    def _reload_settings(self):
+        """Re-reads the settings file and publishes the keys that changed."""
+        previous = self.settings
+        self.settings = self._settings_store.load()
+        fields = changed_fields(previous, self.settings)
+        if fields:
+            self.changes.publish(Change(SETTINGS_CHANGED, fields=fields))
+
+    def reload_if_changed(self):
+        """Merges changes saved by other processes into memory. Returns True if anything was reloaded."""
+        settings_changed = self._settings_store.changed_on_disk()
+        if settings_changed:
+            self._reload_settings()
+        if not self._key or not self.has_external_changes():
+            return settings_changed
+        try:
+            with self._file_lock:
+                merged = self._merge_from_disk(adopt_settings=True)
+        except Exception as e:
+            print(f"Warning: Failed to reload changed data file '{self.data_file}': {e}", file=sys.stderr)
+            return False
+        if merged is not None:
+            self.changes.publish(merged)
+        return True
+
+    def _merge_from_disk(self, adopt_settings):
+        """Folds the on-disk store into memory, keeping local unsaved changes. Caller holds the lock.
+
+        Loaded shards whose version changed are re-read; for each, the disk
+        events win except those with a pending local update or delete.
+        Returns the Change to publish once the lock is released, or None if
+        no loaded event changed.
+        """
+        self._file_stamp = self._stat_data_file()
+        header, data = self._read_encrypted_file_with_header(self.data_file)
+        if data.get('format', 1) < STORE_FORMAT:
+            print(f"Warning: '{self.data_file}' was rewritten in the single-file layout; local changes take precedence.", file=sys.stderr)
+            self._store_version = int(header.get('version', 0))
+            return None
+        disk_shards = data.get('shards', {})
+        if not isinstance(disk_shards, dict):
+            disk_shards = {}
+
+        changes = []
+        for key in set(disk_shards) | set(self.shards):
+            disk_version = disk_shards.get(key, {}).get('version')
+            if disk_version is not None and disk_version == self.shards.get(key, {}).get('version'):
+                continue
+            if key in self._loaded_shards:
+                changes += self._merge_shard_events(key, self.read_shard(key) if key in disk_shards else [])
+        # Shards only we have are new local shards waiting for their first save
+        self.shards = dict(disk_shards, **{key: info for key, info in self.shards.items()
+                                           if key not in disk_shards and key in self._dirty_shards})
+
+        disk_archive = data.get('archive') if isinstance(data.get('archive'), dict) else {}
+        if disk_archive.get('version') != self.archive_info.get('version'):
+            if self._archive is not None:
+                changes = None # Archived events shown in views may have changed too
+            self._merge_archive_from_disk(disk_archive)
+
+        # Move local change numbers above those the other process used
+        disk_seq = int(data.get('change_seq', 0))
+        offset = max(0, disk_seq - self._synced_change_seq)
+        local_tombstones = [t for t in self.tombstones if t.get('change_seq', 0) > self._synced_change_seq]
+        if offset:
+            for event_id, state in self._unsynced.items():
+                ev = self.get_event_by_id(event_id) if state == 'upsert' else None
+                if ev is not None:
+                    ev['change_seq'] = ev.get('change_seq', 0) + offset
+            for tomb in local_tombstones:
+                tomb['change_seq'] = tomb.get('change_seq', 0) + offset
+        disk_tombstones = data.get('tombstones', [])
+        disk_tombstones = disk_tombstones if isinstance(disk_tombstones, list) else []
+        if data.get('event_schema', 1) < EVENT_SCHEMA:
+            for tomb in disk_tombstones:
+                normalize_event(tomb)
+        self.tombstones = disk_tombstones + local_tombstones
+        self._tombstone_floor = max(self._tombstone_floor, int(data.get('tombstone_floor', 0)))
+        self.change_seq = max(self.change_seq + offset, disk_seq)
+        self._synced_change_seq = disk_seq
+        if adopt_settings and self._settings_store.changed_on_disk():
+            self._reload_settings()
+        self._store_version = int(header.get('version', 0))
+        # Another process may have re-keyed the store; write with its parameters
+        if header.get('kdf') and header['kdf'] != self._kdf:
+            self._kdf = header['kdf']
+            self._key = self.derive_key(self._kdf)
+        if changes is None or changes:
+            return bulk_change(changes)
+        return None
+
+    def _merge_archive_from_disk(self, disk_archive):
+        """Adopts another process's archive, keeping local archive moves not saved yet."""
+        if not self._archive_dirty:
+            self._reset_archive(dict(disk_archive))
+            return
+        archived_ids = {ev.get('id') for ev in self._archive}
+        for ev in (self.read_archive() if disk_archive else []):
+            if ev.get('id') not in archived_ids and ev.get('id') not in self._archive_removed:
+                self._archive.append(ev)
+        self._index_archive()
+        before = max(self.archive_info.get('before', 0), disk_archive.get('before', 0))
+        self.archive_info = dict(disk_archive, before=before)
+
+    def _merge_shard_events(self, key, disk_events):
+        """Replaces a loaded shard's events with disk_events plus pending local changes.
+
+        Returns the per-event Changes this makes to the loaded events.
+        """
+        local_upserts = {}
+        previous = {}
+        for ev in self.events:
+            if shard_key_for_date(ev.get('date')) == key:
+                previous[ev.get('id')] = ev
+                if self._unsynced.get(ev.get('id')) == 'upsert':
+                    local_upserts[ev.get('id')] = ev
+        merged = []
+        for ev in disk_events:
+            event_id = ev.get('id')
+            if event_id not in self._unsynced:
+                merged.append(ev)
+            elif event_id in local_upserts:
+                merged.append(local_upserts.pop(event_id))
+            # Otherwise deleted locally, or moved to another shard locally
+        merged.extend(local_upserts.values())
+        self.events = [ev for ev in self.events if shard_key_for_date(ev.get('date')) != key] + merged
+        self._drop_indexes()
+        changes = []
+        for ev in merged:
+            before = previous.pop(ev.get('id'), None)
+            if before is not ev and (before is None or changed_fields(before, ev)):
+                changes.append(change_for_op(before, ev))
+        changes.extend(change_for_op(before, None) for before in previous.values())
+        return changes
+
+
+    # --- Mutations ---
+    # Every change is a list of (before, after) ops: before=None adds `after`,
+    # after=None deletes `before`, otherwise `after` replaces `before`. The
+    # inverse of an op is (after, before), which gives undo/redo and save
+    # failure rollback without copying the event list.
+
+    def _place_ops(self, ops):
+        """Edits self.events for a list of ops in at most one pass. Returns ids not found."""
+        self._interval_index = None
+        if self._bitmap_index is not None:
+            for before, after in ops:
+                if before is not None:
+                    self._bitmap_index.remove(before)
+                if after is not None:
+                    self._bitmap_index.add(after)
+        targets = {} # id -> replacement event, or None to remove
+        for before, after in ops:
+            if before is None:
+                self.events.append(after)
+            else:
+                targets[before.get('id')] = after
+        if not targets:
+            return set()
+        remaining = len(targets)
+        removed = []
+        for i, ev in enumerate(self.events):
+            event_id = ev.get('id')
+            if event_id in targets:
+                replacement = targets.pop(event_id)
+                if replacement is None:
+                    removed.append(i)
+                else:
+                    self.events[i] = replacement
+                remaining -= 1
+                if not remaining:
+                    break
+        if len(removed) == 1:
+            del self.events[removed[0]]
+        elif removed:
+            removed_ids = {id(self.events[i]) for i in removed}
+            self.events[:] = [ev for ev in self.events if id(ev) not in removed_ids]
+        return set(targets)
+
+    def _execute(self, ops):
+        """Applies ops with change tracking, saves and publishes them. Reverts them in place if the save raises."""
+        saved_seq = self.change_seq
+        saved_tombstones = len(self.tombstones)
+        saved_unsynced = {}
+        for before, after in ops:
+            event = after if after is not None else before
+            event_id = event.get('id')
+            saved_unsynced.setdefault(event_id, self._unsynced.get(event_id))
+            if before is not None:
+                self._mark_dirty(shard_key_for_date(before.get('date')))
+            if after is None:
+                self._add_tombstone(before)
+                self._unsynced[event_id] = 'delete'
+                continue
+            self._mark_dirty(shard_key_for_date(after.get('date')))
+            previous = before
+            if previous is None and 'sequence' in after:
+                # Re-added (undo of a delete): rank above the cancellation's SEQUENCE
+                previous = {"sequence": after['sequence'] + 1}
+            self._stamp_event(after, previous=previous)
+            self._unsynced[event_id] = 'upsert'
+        self._place_ops(ops)
+        try:
+            self._commit()
+        except Exception:
+            self._place_ops([(after, before) for before, after in reversed(ops)])
+            # Some shards may already hold the change on disk; rewrite them on the next save
+            for before, after in ops:
+                for event in (before, after):
+                    if event is not None:
+                        self._mark_dirty(shard_key_for_date(event.get('date')))
+            self.change_seq = saved_seq
+            del self.tombstones[saved_tombstones:]
+            for event_id, state in saved_unsynced.items():
+                if state is None:
+                    self._unsynced.pop(event_id, None)
+                else:
+                    self._unsynced[event_id] = state
+            raise
+        self.changes.publish_ops(ops)
+
+    def _record(self, label, ops):
+        """Pushes a completed change onto the undo log."""
+        self._undo_log.append((label, ops))
+        if len(self._undo_log) > UNDO_LIMIT:
+            del self._undo_log[0]
+        self._redo_log.clear()
+
+    def undo_label(self):
+        """Returns the description of the change undo() would revert, or None."""
+        return self._undo_log[-1][0] if self._undo_log else None
+
+    def redo_label(self):
+        return self._redo_log[-1][0] if self._redo_log else None
+
+    def undo(self):
+        """Reverts the most recent change and saves. Returns its label, or None if there is none."""
+        if not self._undo_log:
+            return None
+        label, ops = self._undo_log.pop()
+        try:
+            self._execute(self._applicable([(after, before) for before, after in reversed(ops)]))
+        except Exception:
+            self._undo_log.append((label, ops))
+            raise
+        self._redo_log.append((label, ops))
+        return label
+
+    def redo(self):
+        """Re-applies the most recently undone change and saves. Returns its label, or None."""
+        if not self._redo_log:
+            return None
+        label, ops = self._redo_log.pop()
+        try:
+            self._execute(self._applicable(ops))
+        except Exception:
+            self._redo_log.append((label, ops))
+            raise
+        self._undo_log.append((label, ops))
+        return label
+
+    def _applicable(self, ops):
+        """Drops ops whose target event is gone (e.g. deleted by another process since)."""
+        self._ensure_events_loaded([before.get('id') for before, _ in ops if before is not None])
+        present = {ev.get('id') for ev in self.events}
+        applicable = [(before, after) for before, after in ops if before is None or before.get('id') in present]
+        if len(applicable) < len(ops):
+            print(f"Warning: {len(ops) - len(applicable)} event(s) changed elsewhere were skipped.", file=sys.stderr)
+        return applicable
 
     def add_event(self, event):
         """Adds an event to the list and saves."""
         if not isinstance(event, dict):
              print("Error: Attempted to add non-dictionary event.", file=sys.stderr)
              return
-        self.events.append(event)
+        ops = [(None, event)]
         try:
-            self.save_to_file()
+            self._execute(ops)
         except Exception as e:
-            # If save fails, consider rolling back the add?
             print(f"Error saving after adding event: {e}", file=sys.stderr)
-            self.events.pop() # Basic rollback: remove the just-added event
             raise # Re-raise the exception from save_to_file
+        self._record(f"Add '{event.get('title', '')}'", ops)
 
     def update_event(self, event_id, updated_event):
         """Updates an existing event identified by event_id and saves."""
         if not isinstance(updated_event, dict):
              print("Error: Attempted to update with non-dictionary event data.", file=sys.stderr)
              return
-        original_event = None
-        found_index = -1
-        for i, ev in enumerate(self.events):
-            if ev.get('id') == event_id:
-                original_event = ev.copy() # Store copy for potential rollback
-                found_index = i
-                self.events[i] = updated_event
-                break
-        if found_index == -1:
+        self._ensure_event_loaded(event_id)
+        original_event = self.get_event_by_id(event_id)
+        if original_event is None:
             print(f"Warning: Event ID '{event_id}' not found for update.", file=sys.stderr)
             # Don't save if nothing was updated
             return
+        ops = [(original_event, updated_event)]
         try:
-            self.save_to_file()
+            self._execute(ops)
         except Exception as e:
             print(f"Error saving after updating event {event_id}: {e}", file=sys.stderr)
-            # Rollback the update if save fails
-            if found_index != -1 and original_event is not None:
-                self.events[found_index] = original_event
             raise
+        self._record(f"Edit '{updated_event.get('title', '')}'", ops)
 
 
     def delete_event(self, event_id):
         """Deletes an event identified by event_id and saves."""
-        original_length = len(self.events)
-        # Filter list, preserving original order
-        original_events = self.events[:] # Create shallow copy for potential rollback
-        self.events = [ev for ev in self.events if ev.get('id') != event_id]
-        deleted = len(self.events) < original_length
-
-        if not deleted:
+        self._ensure_event_loaded(event_id)
+        removed = self.get_event_by_id(event_id)
+        if removed is None:
             print(f"Warning: Event ID '{event_id}' not found for deletion.", file=sys.stderr)
             # Don't save if nothing changed
             return False # Indicate event not found/deleted
-
+        ops = [(removed, None)]
         try:
-            self.save_to_file()
-            return True # Indicate successful deletion and save
+            self._execute(ops)
         except Exception as e:
             print(f"Error saving after deleting event {event_id}: {e}", file=sys.stderr)
-            # Rollback the deletion if save fails
-            self.events = original_events
             raise # Re-raise the exception from save_to_file
+        self._record(f"Delete '{removed.get('title', '')}'", ops)
+        return True # Indicate successful deletion and save
+
+    def apply_changes(self, added=(), updated=(), deleted_ids=()):
+        """Applies many adds, updates and deletes with a single save.
+
+        Events in `added` without an 'id' get a new one; events in `updated`
+        must carry the 'id' of an existing event. Returns a dict with the
+        'added', 'updated' and 'deleted' ids, the 'missing' ids that were
+        not found for update or delete, and the 'duplicate' ids of added
+        events whose id is already taken (those are not added). The batch
+        is undone as one step.
+        """
+        added = [ev for ev in added if isinstance(ev, dict)]
+        updated = [ev for ev in updated if isinstance(ev, dict) and ev.get('id')]
+        deleted_ids = set(deleted_ids)
+        added_ids = {ev['id'] for ev in added if ev.get('id')}
+        wanted_ids = {ev['id'] for ev in updated} | deleted_ids | added_ids
+        self._ensure_events_loaded(wanted_ids)
+
+        current_by_id = {ev.get('id'): ev for ev in self.events} if wanted_ids else {}
+        result = {"added": [], "updated": [], "deleted": [], "missing": [], "duplicate": []}
+        ops = []
+        for ev in updated:
+            previous = current_by_id.get(ev['id'])
+            if previous is None or ev['id'] in deleted_ids:
+                result['missing'].append(ev['id'])
+                continue
+            ops.append((previous, ev))
+            result['updated'].append(ev['id'])
+        for event_id in sorted(deleted_ids):
+            previous = current_by_id.get(event_id)
+            if previous is None:
+                result['missing'].append(event_id)
+                continue
+            ops.append((previous, None))
+            result['deleted'].append(event_id)
+        taken_ids = set(current_by_id)
+        for ev in added:
+            if not ev.get('id'):
+                ev['id'] = str(uuid.uuid4())
+            elif ev['id'] in taken_ids: # Exists already, or earlier in this batch
+                result['duplicate'].append(ev['id'])
+                continue
+            taken_ids.add(ev['id'])
+            ops.append((None, ev))
+            result['added'].append(ev['id'])
+
+        if not ops:
+            return result
+        try:
+            self._execute(ops)
+        except Exception as e:
+            print(f"Error saving after applying {len(added)} adds, {len(updated)} updates, {len(deleted_ids)} deletes: {e}", file=sys.stderr)
+            raise
+        self._record(f"Change {len(ops)} events", ops)
+        return result
+
+    def _load_years(self, first_year, last_year):
+        """Loads the stored year shards in a range of years."""
+        for year in range(first_year, last_year + 1):
+            if str(year) in self.shards: # Open-ended ranges span thousands of years
+                self.load_shard(str(year))
+
+    def events_in_range(self, start_date, end_date):
+        """Yields events on dates between two 'yyyy-MM-dd' strings (inclusive), loading shards as needed.
+
+        Multi-day events are included if any of their days is in the range.
+        """
+        self._load_years(int(start_date[:4]), int(end_date[:4]))
+        first = date_ordinal(start_date) or date.min.toordinal()
+        last = date_ordinal(end_date) or date.max.toordinal()
+        yielded = set()
+        for ev in self.events:
+            ordinal = ev.get('date_ordinal')
+            if ordinal is not None and ordinal <= last and (ev.get('end_ordinal') or ordinal) >= first:
+                yielded.add(ev.get('id'))
+                yield ev
+        if first < self.archived_before():
+            for ev in self.load_archive():
+                ordinal = ev.get('date_ordinal')
+                if (ordinal is not None and ordinal <= last and (ev.get('end_ordinal') or ordinal) >= first
+                        and ev.get('id') not in yielded):
+                    yield ev
+
+    def _drop_indexes(self):
+        """Forgets the derived indexes after self.events was replaced wholesale."""
+        self._interval_index = None
+        self._bitmap_index = None
+
+    # --- Tag and day filters ---
+
+    def _event_bitmaps(self):
+        """Returns the bitmap index over loaded events, building it if needed."""
+        if self._bitmap_index is None:
+            with perf_stats.timed("index.build_bitmaps"):
+                self._bitmap_index = BitmapIndex(self.events)
+        return self._bitmap_index
+
+    def tag_counts(self):
+        """Returns {tag: number of loaded events with it}."""
+        return self._event_bitmaps().tag_counts()
+
+    def events_on_day(self, ordinal, tags=None, include_untagged=True):
+        """Returns loaded events covering a date ordinal (multi-day events included).
+
+        With tags set, only events with any of them are returned, plus
+        untagged events if include_untagged.
+        """
+        index = self._event_bitmaps()
+        bits = index.day_mask(ordinal)
+        if tags is not None and bits:
+            bits &= index.tag_mask(tags, include_untagged=include_untagged)
+        return index.events(bits)
+
+    def events_with_tags(self, tags, match_all=False):
+        """Returns every event with any (or, with match_all, all) of the tags. Loads all shards."""
+        self.load_all_shards()
+        index = self._event_bitmaps()
+        return index.events(index.tag_mask(tags, match_all=match_all))
+
+    # --- Interval queries ---
+
+    def _interval_tree(self):
+        """Returns the interval index over loaded timed events, building it if needed."""
+        if self._interval_index is None:
+            with perf_stats.timed("index.build_intervals"):
+                items = []
+                for ev in self.events:
+                    if ev.get('time_minutes') is not None:
+                        span = event_interval(ev)
+                        if span:
+                            items.append((span[0], span[1], ev))
+                self._interval_index = IntervalIndex(items)
+        return self._interval_index
+
+    def overlapping_events(self, start, end, exclude_id=None):
+        """Returns timed events overlapping [start, end) (naive datetimes), ordered by start.
+
+        All-day events do not block time and are not returned. exclude_id
+        leaves out the event being edited.
+        """
+        self._load_years(start.year, end.year)
+        found = self._interval_tree().overlapping(datetime_to_minutes(start), datetime_to_minutes(end))
+        return [ev for ev in found if ev.get('id') != exclude_id]
+
+    def find_free_slot(self, start, end, duration_minutes, day_start=None, day_end=None):
+        """Returns the earliest datetime in [start, end) with duration_minutes free of timed events, or None.
+
+        With day_start/day_end (times of day) the slot must also fall inside
+        that window on a single day; each day is one O(log n) lookup.
+        """
+        self._load_years(start.year, end.year)
+        tree = self._interval_tree()
+        first, last = datetime_to_minutes(start), datetime_to_minutes(end)
+        if day_start is None or day_end is None:
+            slot = tree.free_slot(first, last, duration_minutes)
+            return minutes_to_datetime(slot) if slot is not None else None
+        window_start = day_start.hour * 60 + day_start.minute
+        window_end = day_end.hour * 60 + day_end.minute
+        for ordinal in range(start.toordinal(), end.toordinal() + 1):
+            day = ordinal * MINUTES_PER_DAY
+            slot = tree.free_slot(max(first, day + window_start), min(last, day + window_end), duration_minutes)
+            if slot is not None:
+                return minutes_to_datetime(slot)
+        return None
+
+    def _ensure_event_loaded(self, event_id):
+        self._ensure_events_loaded([event_id])
+
+    def _ensure_events_loaded(self, event_ids):
+        """Brings events into self.events: loads the remaining shards, then unarchives."""
+        if not event_ids:
+            return
+        missing = set(event_ids) - {ev.get('id') for ev in self.events}
+        if missing and any(key not in self._loaded_shards for key in self.shards):
+            self.load_all_shards()
+            missing -= {ev.get('id') for ev in self.events}
+        if missing and self.has_archive():
+            self._unarchive(missing)
+
+    def find_event(self, event_id):
+        """Like get_event_by_id, but also looks in unloaded shards and the archive.
+
+        Archived events are returned where they are; editing one through
+        update_event moves it back out of the archive.
+        """
+        ev = self.get_event_by_id(event_id)
+        if ev is None and any(key not in self._loaded_shards for key in self.shards):
+            self.load_all_shards()
+            ev = self.get_event_by_id(event_id)
+        if ev is None and self.has_archive():
+            ev = next((archived for archived in self.load_archive() if archived.get('id') == event_id), None)
+        return ev
 
+    def _stamp_event(self, event, previous=None):
+        """Assigns the next change sequence, revision and modification time to an event.
 
+        Also refreshes its canonical date/time fields from the display strings,
+        and gives events without a time zone the default one.
+        """
+        if not event.get('tz'):
+            zone = self.default_time_zone()
+            if zone:
+                event['tz'] = zone
+        normalize_event(event)
+        self.change_seq += 1
+        event['change_seq'] = self.change_seq
+        # iCal SEQUENCE: revision counter, starts at 0 and grows with each update
+        event['sequence'] = (previous.get('sequence', 0) + 1) if previous else 0
+        event['last_modified'] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def default_time_zone(self):
+        """Zone for new events: the 'time_zone' setting, else the computer's zone (None if unknown)."""
+        zone = self.settings.get('time_zone')
+        if zone and timezones.is_valid_zone(zone):
+            return zone
+        return timezones.local_zone_name()
+
+    def _add_tombstone(self, event):
+        """Records a deletion so delta exports can emit a cancellation for it."""
+        self.change_seq += 1
+        self.tombstones.append({
+            "id": event.get('id'),
+            "title": event.get('title', ''),
+            "date": event.get('date', ''),
+            "time": event.get('time', ''),
+            "date_ordinal": event.get('date_ordinal'),
+            "time_minutes": event.get('time_minutes'),
+            "end_ordinal": event.get('end_ordinal'),
+            "end_minutes": event.get('end_minutes'),
+            "tz": event.get('tz'),
+            "sequence": event.get('sequence', 0) + 1,
+            "change_seq": self.change_seq,
+            "last_modified": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        })
+        # Trimmed to MAX_TOMBSTONES when saved, so a failed save can simply truncate
+
+
+    @perf_stats.timed_function("export.backup")
     def backup_to_file(self, backup_path):
-        """Saves the current state and copies the data file to a backup location."""
+        """Saves pending changes and writes every event into one self-contained backup file.
+
+        The backup uses the single-file layout, so it can be opened on its own
+        (e.g. copied over the data file) without the shard files.
+        """
         try:
-            # Ensure the main file is up-to-date before copying
+            # Ensure the shard files are up-to-date before reading them
             self.save_to_file()
+            events = self._all_events()
         except Exception as e:
              # If saving fails, maybe we shouldn't proceed with backup?
              print(f"Error: Failed to save current state before backup: {e}", file=sys.stderr)
              raise RuntimeError(f"Backup cancelled because saving current state failed: {e}") from e
 
+        data = {
+            "event_schema": EVENT_SCHEMA,
+            "events": events,
+            "settings": self.settings,
+            "change_seq": self.change_seq,
+            "tombstones": self.tombstones,
+            "tombstone_floor": self._tombstone_floor,
+        }
         try:
-            # Copy the encrypted data file
-            with open(self.data_file, 'rb') as original, open(backup_path, 'wb') as backup:
-                # Read in chunks for potentially large files
-                chunk_size = 65536 # 64k
-                while True:
-                    chunk = original.read(chunk_size)
-                    if not chunk:
-                        break
-                    backup.write(chunk)
-        except FileNotFoundError:
-             # This shouldn't happen if save_to_file succeeded, but handle defensively
-             print(f"Error: Main data file '{self.data_file}' not found for backup.", file=sys.stderr)
-             raise
+            self._write_encrypted_file(backup_path, data)
         except IOError as e:
-             print(f"Error: Failed to read/write during backup to '{backup_path}': {e}", file=sys.stderr)
+             print(f"Error: Failed to write backup to '{backup_path}': {e}", file=sys.stderr)
              raise
         except Exception as e: # Catch other unexpected errors
-             print(f"Error: An unexpected error occurred during backup file copy: {e}", file=sys.stderr)
+             print(f"Error: An unexpected error occurred during backup: {e}", file=sys.stderr)
              raise
 
 
-    def export_to_ics(self, ics_path):
-        """Exports calendar events to an iCalendar (.ics) file."""
-        # Import datetime locally as in original
-        from datetime import datetime, time, timedelta
+    @perf_stats.timed_function("export.snapshot")
+    def snapshot_backup(self, repo_path, keep_last=None, keep_daily=None, keep_weekly=None):
+        """Stores an incremental snapshot in a backup repository and applies retention.
+
+        Only events and attachments not already in the repository are written.
+        Returns the new snapshot id.
+        """
+        from backup_repository import (BackupRepository, DEFAULT_KEEP_DAILY,
+                                       DEFAULT_KEEP_LAST, DEFAULT_KEEP_WEEKLY)
+        if self.rekey_in_progress():
+            raise RuntimeError("Snapshots are unavailable until the passphrase change finishes.")
+        repo = BackupRepository(repo_path, self)
+        snapshot_id = repo.create_snapshot(self._all_events(), self.settings)
+        repo.apply_retention(
+            keep_last=DEFAULT_KEEP_LAST if keep_last is None else keep_last,
+            keep_daily=DEFAULT_KEEP_DAILY if keep_daily is None else keep_daily,
+            keep_weekly=DEFAULT_KEEP_WEEKLY if keep_weekly is None else keep_weekly,
+        )
+        return snapshot_id
+
+    def restore_snapshot(self, repo_path, snapshot_id=None, at=None):
+        """Replaces the current events with those of a snapshot and saves.
 
-        # Inner function for formatting date/time strings
-        def format_dt_for_ics(date_str, time_str):
-            """Formats date and optional time for iCal DTSTART/DTEND.
-               Returns tuple: (formatted_string, is_date_only)
-            """
+        Restores `snapshot_id`, or the latest snapshot taken at or before
+        `at` (a UTC datetime), or the latest snapshot. Settings are kept.
+        The restore is recorded as ordinary changes so delta exports see it.
+        """
+        from backup_repository import BackupRepository
+        if self.rekey_in_progress():
+            raise RuntimeError("Snapshots are unavailable until the passphrase change finishes.")
+        repo = BackupRepository(repo_path, self)
+        if snapshot_id is None:
+            snapshot_id = repo.find_snapshot(at)
+            if snapshot_id is None:
+                raise ValueError(f"No snapshot found in '{repo_path}' for the requested time.")
+        restored_events, _ = repo.restore(snapshot_id)
+
+        self.load_all_shards()
+        if self.has_archive():
+            # Restored events start out in the shards; the next archival pass sorts them again
+            self._unarchive({ev.get('id') for ev in self.load_archive()})
+        current_by_id = {ev.get('id'): ev for ev in self.events}
+        restored_ids = {ev.get('id') for ev in restored_events}
+        ops = [(ev, None) for ev in self.events if ev.get('id') not in restored_ids]
+        ops += [(current_by_id.get(ev.get('id')), ev) for ev in restored_events]
+        self._execute(ops)
+        self._record("Restore snapshot", ops)
+        return snapshot_id
+
+    @perf_stats.timed_function("export.ics")
+    def export_to_ics(self, ics_path, since_seq=None):
+        """Exports calendar events to an iCalendar (.ics) file.
+
+        With since_seq set, only events changed after that change sequence are
+        written (a delta export), and events deleted since then are written as
+        STATUS:CANCELLED. Returns the change sequence the export is current to,
+        to be passed as since_seq next time.
+        """
+        # Inner function for building start/end from the canonical fields
+        def event_span(ev):
+            """Returns (start, end, is_date_only) as dates or datetimes, or (None, None, True) if undated."""
+            span = event_interval(ev)
+            if span is None:
+                return None, None, True
+            start, end = minutes_to_datetime(span[0]), minutes_to_datetime(span[1])
+            if ev.get('time_minutes') is None:
+                return start.date(), end.date(), True # DTEND of all-day events is exclusive
+            return start, end, False
+
+        def escape_text(value):
+            """Escapes characters that are special in iCal text fields."""
+            return value.replace("\\", "\\\\").replace("\n", "\\n").replace(",", "\\,").replace(";", "\\;")
+
+        def format_modified(iso_str):
+            """Converts a stored ISO UTC timestamp to iCal form, or None."""
             try:
-                base_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                if time_str:
-                    # Parse 'hh:mm AP' format
-                    ev_time = datetime.strptime(time_str, "%I:%M %p").time()
-                    dt = datetime.combine(base_date, ev_time)
-                    # Format as UTC (naive conversion, assumes local time = UTC)
-                    # TODO: Implement proper timezone handling if needed
-                    return dt.strftime("%Y%m%dT%H%M%SZ"), False
-                else:
-                    # Format as YYYYMMDD for date-only events
-                    return base_date.strftime("%Y%m%d"), True
-            except ValueError as e:
-                print(f"Warning: Could not format date/time for iCal: {date_str} {time_str} ({e})", file=sys.stderr)
-                return "INVALID_DATE_FORMAT", True
+                return datetime.strptime(iso_str, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y%m%dT%H%M%SZ")
+            except (TypeError, ValueError):
+                return None
 
+        local_zone = timezones.local_zone_name()
+        zone_years = {} # TZID -> years used, for the VTIMEZONE blocks
+
+        def dt_lines(ev, start, end, is_date_only):
+            """Builds DTSTART/DTEND lines for start and end dates or datetimes."""
+            if is_date_only:
+                # For all-day events, use VALUE=DATE property
+                # DTEND for all-day is the day after the last day
+                return [f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}",
+                        f"DTEND;VALUE=DATE:{end.strftime('%Y%m%d')}"]
+            # Events without an end time last DEFAULT_DURATION_MINUTES (see event_interval)
+            zone = ev.get('tz') if timezones.is_valid_zone(ev.get('tz')) else local_zone
+            if zone:
+                zone_years.setdefault(zone, set()).update((start.year, end.year))
+                return [f"DTSTART;TZID={zone}:{start.strftime('%Y%m%dT%H%M%S')}",
+                        f"DTEND;TZID={zone}:{end.strftime('%Y%m%dT%H%M%S')}"]
+            # Local time in a zone without a known name: convert to UTC
+            return [f"DTSTART:{timezones.wall_to_utc(None, start).strftime('%Y%m%dT%H%M%SZ')}",
+                    f"DTEND:{timezones.wall_to_utc(None, end).strftime('%Y%m%dT%H%M%SZ')}"]
+
+        # A consumer older than the oldest retained tombstone could miss
+        # deletions, so it gets a full export instead.
+        if since_seq is not None and since_seq < self._tombstone_floor:
+            print(f"Info: Delta export from sequence {since_seq} predates retained deletions; exporting everything.", file=sys.stderr)
+            since_seq = None
+        is_delta = since_seq is not None
+        # Only shards holding changes newer than since_seq need to be read
+        for key, info in list(self.shards.items()):
+            if not is_delta or info.get('max_seq', 0) > since_seq:
+                self.load_shard(key)
+        events = self.events
+        if self.has_archive() and (not is_delta or self.archive_info.get('max_seq', 0) > since_seq):
+            hot_ids = {ev.get('id') for ev in self.events}
+            events = self.events + [ev for ev in self.load_archive() if ev.get('id') not in hot_ids]
 
         # iCalendar header lines
         ics_lines = [
@@ -288,79 +1872,82 @@ class DataManager:
             "VERSION:2.0",
             "PRODID:-//bToDo//EN", # Keep original PRODID
             "CALSCALE:GREGORIAN",
-            # Optionally add timezone information here if times are not UTC
-            # "BEGIN:VTIMEZONE", ... "END:VTIMEZONE"
         ]
+        header_length = len(ics_lines) # VTIMEZONE blocks go here once the zones in use are known
+        dtstamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
 
         # Process each event
         events_exported = 0
-        for ev in self.events:
-            ev_date = ev.get('date')
-            ev_time = ev.get('time') # hh:mm AP format or empty
-
-            if not ev_date:
-                print(f"Warning: Skipping event for iCal export due to missing date: {ev.get('title')}", file=sys.stderr)
+        for ev in events:
+            if is_delta and ev.get('change_seq', 0) <= since_seq:
+                continue
+            start, end, is_date_only = event_span(ev)
+            if start is None:
+                print(f"Warning: Skipping event for iCal export due to missing or invalid date: {ev.get('title')}", file=sys.stderr)
                 continue
 
-            dtstart_str, is_date_only = format_dt_for_ics(ev_date, ev_time)
-
-            if dtstart_str == "INVALID_DATE_FORMAT":
-                 print(f"Warning: Skipping event for iCal export due to invalid date/time format: {ev.get('title')}", file=sys.stderr)
-                 continue
-
-            # Generate unique ID and timestamp
-            uid_base = ev.get('id', str(hash(ev.get('title', '') + ev_date)))
+            # Generate unique ID
+            uid_base = ev.get('id', str(hash(ev.get('title', '') + ev.get('date', ''))))
             uid = f"{uid_base}@brittoncalendar.local" # Make UID more unique
-            dtstamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
 
-            summary = ev.get('title', 'No Title')
-            description = ev.get('description', '')
-            # Escape necessary characters in text fields for iCal format
-            summary = summary.replace("\\", "\\\\").replace("\n", "\\n").replace(",", "\\,").replace(";", "\\;")
-            description = description.replace("\\", "\\\\").replace("\n", "\\n").replace(",", "\\,").replace(";", "\\;")
+            summary = escape_text(ev.get('title', 'No Title'))
+            description = escape_text(ev.get('description', ''))
 
             # Build VEVENT lines
             ics_lines.append("BEGIN:VEVENT")
             ics_lines.append(f"UID:{uid}")
             ics_lines.append(f"DTSTAMP:{dtstamp}")
-
-            if is_date_only:
-                # For all-day events, use VALUE=DATE property
-                ics_lines.append(f"DTSTART;VALUE=DATE:{dtstart_str}")
-                # DTEND for all-day is typically the start of the *next* day
-                try:
-                    end_date = datetime.strptime(dtstart_str, "%Y%m%d").date() + timedelta(days=1)
-                    ics_lines.append(f"DTEND;VALUE=DATE:{end_date.strftime('%Y%m%d')}")
-                except ValueError:
-                     # Fallback if date parsing failed somehow
-                     print(f"Warning: Could not calculate DTEND for all-day event {summary}", file=sys.stderr)
-                     ics_lines.append(f"DTEND;VALUE=DATE:{dtstart_str}") # Use start date
-            else:
-                # For events with specific times (assuming UTC as formatted)
-                ics_lines.append(f"DTSTART:{dtstart_str}")
-                # DTEND: iCal requires duration or end time. Assume 1 hour duration for now.
-                try:
-                    start_dt_obj = datetime.strptime(dtstart_str, "%Y%m%dT%H%M%SZ")
-                    end_dt_obj = start_dt_obj + timedelta(hours=1)
-                    ics_lines.append(f"DTEND:{end_dt_obj.strftime('%Y%m%dT%H%M%SZ')}")
-                except ValueError:
-                     print(f"Warning: Could not calculate DTEND for timed event {summary}", file=sys.stderr)
-                     ics_lines.append(f"DTEND:{dtstart_str}") # Use start time as fallback
-
+            ics_lines.append(f"SEQUENCE:{ev.get('sequence', 0)}")
+            last_modified = format_modified(ev.get('last_modified'))
+            if last_modified:
+                ics_lines.append(f"LAST-MODIFIED:{last_modified}")
+            ics_lines.extend(dt_lines(ev, start, end, is_date_only))
 
             ics_lines.append(f"SUMMARY:{summary}")
             if description: # Only add description if it's not empty
                 ics_lines.append(f"DESCRIPTION:{description}")
+            if ev.get('tags'):
+                ics_lines.append("CATEGORIES:" + ",".join(escape_text(tag) for tag in ev['tags']))
             # TODO: Add ALARM component if ev.get('notify') is True?
 
             ics_lines.append("END:VEVENT")
             events_exported += 1
 
+        # Deletions since the given sequence become cancellations, unless the
+        # event was re-added since (undo), which the VEVENT above covers
+        cancellations_exported = 0
+        if is_delta:
+            present_ids = {ev.get('id') for ev in events}
+            for tomb in self.tombstones:
+                if tomb.get('change_seq', 0) <= since_seq or not tomb.get('id') or tomb['id'] in present_ids:
+                    continue
+                start, end, is_date_only = event_span(tomb)
+                if start is None:
+                    continue
+                summary = escape_text(tomb.get('title', ''))
+                ics_lines.append("BEGIN:VEVENT")
+                ics_lines.append(f"UID:{tomb['id']}@brittoncalendar.local")
+                ics_lines.append(f"DTSTAMP:{dtstamp}")
+                ics_lines.append(f"SEQUENCE:{tomb.get('sequence', 0)}")
+                last_modified = format_modified(tomb.get('last_modified'))
+                if last_modified:
+                    ics_lines.append(f"LAST-MODIFIED:{last_modified}")
+                ics_lines.extend(dt_lines(tomb, start, end, is_date_only))
+                ics_lines.append(f"SUMMARY:{summary}")
+                ics_lines.append("STATUS:CANCELLED")
+                ics_lines.append("END:VEVENT")
+                cancellations_exported += 1
+
+        timezone_lines = []
+        for zone in sorted(zone_years):
+            timezone_lines.extend(timezones.vtimezone_lines(zone, zone_years[zone]))
+        ics_lines[header_length:header_length] = timezone_lines
+
         # iCalendar footer
         ics_lines.append("END:VCALENDAR")
 
         # Check if any events were actually added before writing
-        if events_exported == 0:
+        if events_exported == 0 and cancellations_exported == 0:
              print("Info: No valid events found to export.", file=sys.stderr)
              # Maybe raise an error or return False instead of writing an empty calendar?
              # For now, we write the empty structure.
@@ -368,14 +1955,16 @@ class DataManager:
         try:
             # Write the combined lines to the specified file
             # Use UTF-8 encoding and standard CRLF line endings for iCal
+            # (newline='\r\n' translates each '\n' on write)
             with open(ics_path, 'w', encoding='utf-8', newline='\r\n') as f:
-                f.write("\r\n".join(ics_lines))
+                f.write("\n".join(ics_lines))
         except IOError as e:
              print(f"Error: Failed to write iCal file to '{ics_path}': {e}", file=sys.stderr)
              raise # Re-raise IO error
         except Exception as e: # Catch other unexpected errors
              print(f"Error: An unexpected error occurred during iCal export: {e}", file=sys.stderr)
              raise # Re-raise other errors
+        return self.change_seq
 
 
     def get_event_by_id(self, event_id):
@@ -0,0 +1,90 @@
+# File: file_lock.py
+# bToDo - Advisory inter-process file lock
+# Date: 2026-10-18
+#
+# Used by DataManager so the GUI, a reminder daemon and scripts can share
+# one data store. The lock is advisory: it only coordinates processes that
+# also take it.
+
+import sys
+import time
+
+if sys.platform == "win32":
+    import msvcrt
+    fcntl = None
+else:
+    import fcntl
+    msvcrt = None
+
+DEFAULT_LOCK_TIMEOUT = 10.0 # Seconds to wait for another process to finish
+LOCK_POLL_INTERVAL = 0.05
+
+
+class FileLock:
+    """An exclusive lock on a separate lock file, re-entrant within one process.
+
+    Usage:
+        with FileLock("britton_data.enc.lock"):
+            ...
+    """
+
+    def __init__(self, lock_path, timeout=DEFAULT_LOCK_TIMEOUT):
+        self.lock_path = lock_path
+        self.timeout = timeout
+        self._file = None
+        self._depth = 0
+
+    def acquire(self):
+        """Blocks until the lock is held. Raises TimeoutError after `timeout` seconds."""
+        if self._depth:
+            self._depth += 1
+            return
+        lock_file = open(self.lock_path, 'a+b')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                self._lock(lock_file)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    raise TimeoutError(f"Timed out waiting for lock '{self.lock_path}' held by another process.")
+                time.sleep(LOCK_POLL_INTERVAL)
+        self._file = lock_file
+        self._depth = 1
+
+    def release(self):
+        if not self._depth:
+            return
+        self._depth -= 1
+        if self._depth:
+            return
+        try:
+            self._unlock(self._file)
+        finally:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def _lock(lock_file):
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+
+    @staticmethod
+    def _unlock(lock_file):
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
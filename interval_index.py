@@ -0,0 +1,106 @@
+# File: interval_index.py
+# bToDo - Interval index for overlap and free-slot queries
+# Date: 2026-10-18
+#
+# A static interval tree over half-open [start, end) integer intervals
+# (DataManager uses minutes since day 1). It is built in O(n log n) and
+# rebuilt lazily by DataManager after events change:
+#   - intervals sorted by start, with an implicit segment tree of the
+#     largest end below each node, so overlapping() only descends into
+#     subtrees that can overlap the query: O(log n + k)
+#   - the union of all intervals as disjoint busy blocks, with a segment
+#     tree of the largest gap below each node, so free_slot() finds the
+#     earliest gap of a given length in O(log n)
+# Qt-free.
+
+import bisect
+
+NEG_INF = float('-inf')
+
+
+def _max_tree(values):
+    """Returns (leaf count, array segment tree of maxima) over values."""
+    size = 1
+    while size < len(values):
+        size *= 2
+    tree = [NEG_INF] * (2 * size)
+    tree[size:size + len(values)] = values
+    for i in range(size - 1, 0, -1):
+        left, right = tree[2 * i], tree[2 * i + 1]
+        tree[i] = left if left >= right else right
+    return size, tree
+
+
+class IntervalIndex:
+    """Overlap and free-slot queries over (start, end, value) intervals."""
+
+    def __init__(self, items):
+        """items: iterable of (start, end, value) with start < end."""
+        items = sorted(items, key=lambda item: item[0])
+        self._starts = [start for start, _, _ in items]
+        self._ends = [end for _, end, _ in items]
+        self._values = [value for _, _, value in items]
+        self._size, self._max_end = _max_tree(self._ends)
+
+        # Busy blocks: the union of all intervals, sorted and disjoint
+        block_starts, block_ends = [], []
+        for start, end in zip(self._starts, self._ends):
+            if block_ends and start <= block_ends[-1]:
+                if end > block_ends[-1]:
+                    block_ends[-1] = end
+            else:
+                block_starts.append(start)
+                block_ends.append(end)
+        self._block_starts = block_starts
+        self._block_ends = block_ends
+        # gaps[i] is the free time between block i and block i + 1
+        gaps = [block_starts[i + 1] - block_ends[i] for i in range(len(block_starts) - 1)]
+        self._gap_size, self._max_gap = _max_tree(gaps)
+
+    def __len__(self):
+        return len(self._values)
+
+    def overlapping(self, start, end):
+        """Returns the values of intervals overlapping [start, end), in order of start."""
+        limit = bisect.bisect_left(self._starts, end) # Only these start before `end`
+        found = []
+        stack = [(1, 0, self._size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if lo >= limit or self._max_end[node] <= start:
+                continue
+            if hi - lo == 1:
+                found.append(self._values[lo])
+                continue
+            mid = (lo + hi) // 2
+            stack.append((2 * node + 1, mid, hi))
+            stack.append((2 * node, lo, mid))
+        return found
+
+    def free_slot(self, start, end, length):
+        """Returns the earliest t >= start with [t, t + length) free and t + length <= end, or None."""
+        block_ends = self._block_ends
+        first = bisect.bisect_right(block_ends, start) # First block still busy at or after `start`
+        slot = start
+        if first < len(block_ends):
+            if self._block_starts[first] - start >= length:
+                slot = start # Fits before that block
+            else:
+                gap = self._first_gap(first, length)
+                slot = block_ends[gap] if gap is not None else block_ends[-1]
+        return slot if slot + length <= end else None
+
+    def _first_gap(self, first, length):
+        """Returns the lowest gap index >= first that is at least length long, or None."""
+        tree = self._max_gap
+        stack = [(1, 0, self._gap_size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi <= first or tree[node] < length:
+                continue
+            if hi - lo == 1:
+                return lo
+            mid = (lo + hi) // 2
+            stack.append((2 * node + 1, mid, hi))
+            stack.append((2 * node, lo, mid))
+        return None
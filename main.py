@@ -5,16 +5,39 @@
 # bToDo - Created by Patrick Britton
 # Original Date: 2025-04-28
 # Cleaned up on: 2025-04-29
+# Updated: 2026-10-18 (Ask for the passphrase when the store has one)
 
+import os
 import sys
-from typing import List  # For type hinting sys.argv
+from typing import List, Optional  # For type hinting sys.argv
 
-from PySide6.QtWidgets import QApplication
+from PySide6.QtWidgets import QApplication, QInputDialog, QLineEdit, QMessageBox
 
 # Assuming these are in the same directory or project structure
-from data_manager import DataManager
+from data_manager import DEFAULT_ACCENT_COLOR, DEFAULT_DATA_FILE, DEFAULT_STYLE, DataManager, PassphraseError
 from notification_manager import NotificationManager
-from main_window import MainWindow
+from main_window import THEMES, MainWindow, apply_app_theme
+from settings_store import SettingsStore
+from theme_registry import user_themes_dir
+from stall_watchdog import DEFAULT_STALL_THRESHOLD_MS, STALL_LOG_FILENAME, StallWatchdog
+
+PASSPHRASE_ATTEMPTS = 3
+
+def open_data_manager() -> Optional[DataManager]:
+    """Opens the store, asking for its passphrase if it has one; None if the user gives up."""
+    if not DataManager.needs_passphrase(DEFAULT_DATA_FILE):
+        return DataManager(DEFAULT_DATA_FILE)
+    prompt = "Passphrase:"
+    for _ in range(PASSPHRASE_ATTEMPTS):
+        passphrase, ok = QInputDialog.getText(None, "Unlock bToDo", prompt, QLineEdit.EchoMode.Password)
+        if not ok:
+            return None
+        try:
+            return DataManager(DEFAULT_DATA_FILE, passphrase=passphrase)
+        except PassphraseError as e:
+            prompt = f"{e}\n\nPassphrase:"
+    QMessageBox.critical(None, "Unlock bToDo", "Wrong passphrase.")
+    return None
 
 def main() -> None:
     """
@@ -27,8 +50,17 @@ def main() -> None:
     # Pass command line arguments (sys.argv) to the application
     app: QApplication = QApplication(sys.argv)
 
+    # The settings file is plain JSON, so the theme is in place before the
+    # key is derived and the events are decrypted
+    startup_settings = SettingsStore(DEFAULT_DATA_FILE).load()
+    THEMES.add_directory(user_themes_dir(DEFAULT_DATA_FILE))
+    apply_app_theme(app, startup_settings.get('style_name', DEFAULT_STYLE),
+                    startup_settings.get('accent_color', DEFAULT_ACCENT_COLOR))
+
     # Set up the data manager (handles settings, events, encryption)
-    data_manager: DataManager = DataManager()
+    data_manager: Optional[DataManager] = open_data_manager()
+    if data_manager is None:
+        sys.exit(1)
 
     # Set up the notification manager (handles event notifications)
     notification_manager: NotificationManager = NotificationManager(data_manager)
@@ -38,6 +70,15 @@ def main() -> None:
     window: MainWindow = MainWindow(data_manager, notification_manager)
     window.show()
 
+    # Log event-loop freezes (with the GUI thread's stack) next to the data file.
+    # A threshold of 0 in the settings turns the watchdog off.
+    stall_threshold_ms = data_manager.settings.get('stall_threshold_ms', DEFAULT_STALL_THRESHOLD_MS)
+    if stall_threshold_ms:
+        log_path = os.path.join(os.path.dirname(os.path.abspath(data_manager.data_file)), STALL_LOG_FILENAME)
+        watchdog = StallWatchdog(log_path, stall_threshold_ms, parent=app)
+        watchdog.start()
+        app.aboutToQuit.connect(watchdog.stop)
+
     # Start the Qt event loop and exit the application when it finishes
     # sys.exit ensures the application's exit code is returned
     sys.exit(app.exec())
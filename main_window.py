@@ -2,7 +2,7 @@ from __future__ import annotations
 # File: main_window.py
 # Description: Defines the main window, event dialog, and settings dialog for the bToDo.
 # Original Date: 2025-04-28
-# Updated: 2025-05-09 (Added Help menu with About dialog)
+# Updated: 2026-10-18 (Change the passphrase; files are re-encrypted in the background)
 
 # --- Imports ---
 import base64
@@ -12,26 +12,50 @@ import os
 import sys
 import tempfile
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 # --- PySide6 Imports ---
-from PySide6.QtCore import QDate, QDateTime, QSize, Qt, QTime, QUrl
+from PySide6.QtCore import QDate, QDateTime, QSize, Qt, QTime, QTimer, QUrl, Signal
 from PySide6.QtGui import (
-    QAction, QColor, QDesktopServices, QIcon, QPalette, QPixmap, QCloseEvent
+    QAction, QColor, QDesktopServices, QIcon, QKeySequence, QPixmap, QCloseEvent
 )
 from PySide6.QtWidgets import (
     QApplication, QCalendarWidget, QCheckBox, QColorDialog, QComboBox,
-    QDialog, QDateEdit, QFileDialog, QFormLayout, QHBoxLayout, QLabel,
+    QDialog, QDateEdit, QFileDialog, QFormLayout, QHBoxLayout, QInputDialog, QLabel,
     QLineEdit, QListView, QListWidget, QListWidgetItem, QMainWindow, QMenu,
-    QMenuBar, QMessageBox, QPushButton, QTextEdit, QTimeEdit, QVBoxLayout,
-    QWidget
+    QMenuBar, QMessageBox, QPushButton, QSpinBox, QTableWidget, QTableWidgetItem, QTabWidget,
+    QTextEdit, QTimeEdit, QVBoxLayout, QWidget, QDockWidget, QSystemTrayIcon
 )
 
+import memory_report
+import perf_stats
+import timezones
+from bitmap_index import normalize_tags, tag_key
+from change_bus import EVENTS_BULK, SETTINGS_CHANGED, ChangeBus
+from overlay_calendars import OverlaySet, OverlaySource, merge_sorted
+from upcoming_events import DEFAULT_UPCOMING_COUNT, DEFAULT_UPCOMING_DAYS, UpcomingWindow, describe
+from theme_registry import STYLE_DEFAULT_LIGHT, ThemeRegistry, user_themes_dir
+from data_manager import (ARCHIVE_KEY, DEFAULT_ARCHIVE_AFTER_MONTHS, DEFAULT_DURABILITY, DEFAULT_DURATION_MINUTES,
+                          DURABILITY_MODES, event_interval, event_sort_key, minutes_to_datetime, normalize_event)
+
 # --- Type Hinting ---
 if TYPE_CHECKING:
     from data_manager import DataManager
     from notification_manager import NotificationManager
 
+# --- Helper for time zone pickers ---
+def make_zone_combo(current, placeholder=""):
+    """Editable combo box of IANA zone names with current ('' for none) selected."""
+    combo = QComboBox()
+    combo.setEditable(True)
+    combo.setInsertPolicy(QComboBox.InsertPolicy.NoInsert)
+    combo.addItems(timezones.available_zones())
+    combo.setCurrentText(current or "")
+    if placeholder:
+        combo.lineEdit().setPlaceholderText(placeholder)
+    return combo
+
 # --- Helper function for resource paths ---
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -49,237 +73,33 @@ BANNER_PATH = resource_path("banner.png") # <-- Define path for banner
 DATE_FORMAT = "yyyy-MM-dd"
 TIME_FORMAT = "hh:mm AP"
 DATETIME_PARSE_FORMAT = "%I:%M %p"
+JULIAN_DAY_OF_ORDINAL_0 = 1721425 # QDate.toJulianDay() minus this is Python's date.toordinal()
 DEFAULT_NOTIFY_MINUTES = 30
+EXTERNAL_CHANGE_POLL_MS = 5000 # How often to check whether another process saved the data file
+KDF_CHECK_DELAY_MS = 3000 # Key-derivation calibration runs shortly after startup, not during it
+DEFAULT_KDF_TARGET_MS = 300
+CONFLICT_CHECK_DELAY_MS = 150 # Overlap check after the last keystroke in the event dialog
+MAX_CONFLICTS_SHOWN = 3
+FREE_SLOT_SEARCH_DAYS = 30
+FREE_SLOT_DAY_START = datetime.time(8, 0) # Free-slot search only proposes times inside this window
+FREE_SLOT_DAY_END = datetime.time(18, 0)
+ARCHIVE_CHECK_DELAY_MS = 5000 # Past events are archived shortly after startup, not during it
+MAX_ARCHIVE_MONTHS = 240
 ATTACHMENT_ICON_SIZE = QSize(64, 64)
 IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
 USER_ROLE = Qt.ItemDataRole.UserRole
-# Style Names - Must match keys in apply_theme and items in SettingsDialog
-STYLE_DEFAULT_LIGHT = "Default Light"
-STYLE_DEFAULT_DARK = "Default Dark"
-STYLE_GRAPHITE_DARK = "Graphite Dark (QSS)"
-STYLE_OCEAN_BREEZE = "Ocean Breeze (QSS)"
-STYLE_MINTY_LIGHT = "Minty Light (QSS)"
+OVERLAY_ROLE = Qt.ItemDataRole.UserRole + 1 # Path of the overlay an event list item comes from
+SORT_ROLE = Qt.ItemDataRole.UserRole + 2 # event_sort_key of an event list item, for in-place inserts
+MAX_INCREMENTAL_CHANGES = 50 # Larger batches of changes rebuild the day view instead
+UPCOMING_TICK_MS = 60 * 1000 # The upcoming-events window moves on this often
+OVERLAY_SWATCH_SIZE = 12
+QT_ITEM_OVERHEAD_BYTES = 200 # Rough C++ size of a QListWidgetItem before its strings
 # Define the default style and accent color for fallback
 DEFAULT_STYLE = STYLE_DEFAULT_LIGHT
 DEFAULT_ACCENT_COLOR = "#2A82DA"
-
-# --- QSS Definitions ---
-GRAPHITE_DARK_QSS = """
-    QWidget {{
-        background-color: #2d2d2d; /* Dark background */
-        color: #cccccc; /* Light grey text */
-        border: 0px; /* No borders by default */
-        font-size: 10pt; /* Base font size */
-    }}
-    QMainWindow, QDialog {{
-        background-color: #2d2d2d;
-    }}
-    QMenuBar, QMenu {{
-        background-color: #3c3c3c;
-        color: #cccccc;
-        border-bottom: 1px solid #4a4a4a; /* Subtle separator */
-    }}
-    QMenuBar::item:selected, QMenu::item:selected {{
-        background-color: {accent_color};
-        color: white;
-    }}
-    QPushButton {{
-        background-color: #4a4a4a;
-        color: #cccccc;
-        border: 1px solid #5a5a5a;
-        padding: 5px 10px;
-        min-height: 16px; /* Ensure minimum height */
-        border-radius: 3px;
-    }}
-    QPushButton:hover {{
-        background-color: #5a5a5a;
-        border-color: #6a6a6a;
-    }}
-    QPushButton:pressed {{
-        background-color: {accent_color};
-        color: white;
-        border-color: {accent_color};
-    }}
-    QLineEdit, QTextEdit, QDateEdit, QTimeEdit, QComboBox {{
-        background-color: #252525;
-        color: #cccccc;
-        border: 1px solid #4a4a4a;
-        border-radius: 3px;
-        padding: 3px;
-    }}
-    QLineEdit:focus, QTextEdit:focus, QDateEdit:focus, QTimeEdit:focus, QComboBox:focus {{
-        border: 1px solid {accent_color};
-    }}
-    QListWidget, QCalendarWidget {{
-        background-color: #353535;
-        border: 1px solid #4a4a4a;
-    }}
-    QListWidget::item {{
-        padding: 3px 0px; /* Add some vertical spacing */
-    }}
-    QListWidget::item:selected, QCalendarWidget QAbstractItemView:enabled:selected {{
-        background-color: {accent_color};
-        color: white;
-        border: none; /* Remove border on selected */
-    }}
-    QCalendarWidget QToolButton {{ /* Style calendar navigation buttons */
-        color: #cccccc;
-        background-color: #4a4a4a;
-        border: 1px solid #5a5a5a;
-        border-radius: 3px;
-        padding: 2px; /* Added padding */
-    }}
-    QCalendarWidget QToolButton:hover {{ background-color: #5a5a5a; }}
-    QCalendarWidget QToolButton:pressed {{ background-color: {accent_color}; }}
-    QCalendarWidget QMenu {{ background-color: #2d2d2d; }} /* Month/Year menu */
-    QCalendarWidget QSpinBox {{ background-color: #252525; color: #cccccc; border: 1px solid #4a4a4a; }} /* Year input */
-    QCalendarWidget QTableView {{ alternate-background-color: #353535; }} /* Ensure cells match background */
-
-    QLabel {{ background-color: transparent; }}
-    QCheckBox::indicator {{ width: 13px; height: 13px; border-radius: 3px; }}
-    QCheckBox::indicator:unchecked {{ border: 1px solid #5a5a5a; background-color: #3c3c3c; }}
-    QCheckBox::indicator:checked {{ background-color: {accent_color}; border: 1px solid {accent_color}; }}
-    /* Basic check mark image (often needs adjustment or SVG for better quality) */
-    /* QCheckBox::indicator:checked {{ image: url(path/to/check-dark.png); }} */
-"""
-
-OCEAN_BREEZE_QSS = """
-    QWidget {{
-        background-color: #e8f1f2; /* Very light blue/grey */
-        color: #2a363b; /* Dark grey/blue text */
-        border: 0px;
-        font-size: 10pt;
-    }}
-    QMainWindow, QDialog {{ background-color: #e8f1f2; }}
-    QMenuBar, QMenu {{
-        background-color: #d1dadd; /* Slightly darker blue/grey */
-        color: #2a363b;
-        border-bottom: 1px solid #c1c5c8;
-    }}
-    QMenuBar::item:selected, QMenu::item:selected {{
-        background-color: {accent_color};
-        color: white;
-    }}
-    QPushButton {{
-        background-color: #99d8d0; /* Teal/aqua */
-        color: #2a363b;
-        border: 1px solid #87c1b9;
-        padding: 6px 12px;
-        min-height: 18px;
-        border-radius: 4px;
-        font-weight: bold;
-    }}
-    QPushButton:hover {{ background-color: #87c1b9; }}
-    QPushButton:pressed {{ background-color: {accent_color}; color: white; border-color: {accent_color}; }}
-    QLineEdit, QTextEdit, QDateEdit, QTimeEdit, QComboBox {{
-        background-color: #ffffff; /* White inputs */
-        color: #2a363b;
-        border: 1px solid #c1c5c8;
-        border-radius: 4px;
-        padding: 4px;
-    }}
-    QLineEdit:focus, QTextEdit:focus, QDateEdit:focus, QTimeEdit:focus, QComboBox:focus {{
-        border: 2px solid {accent_color}; /* Thicker focus border */
-         padding: 3px; /* Adjust padding for thicker border */
-    }}
-    QListWidget, QCalendarWidget {{
-        background-color: #ffffff;
-        border: 1px solid #d1dadd;
-    }}
-     QListWidget::item {{ padding: 4px 2px; }}
-    QListWidget::item:selected, QCalendarWidget QAbstractItemView:enabled:selected {{
-        background-color: {accent_color};
-        color: white;
-        border: none;
-    }}
-    QCalendarWidget QToolButton {{
-        color: #2a363b;
-        background-color: #d1dadd;
-        border: 1px solid #c1c5c8;
-        border-radius: 4px;
-        padding: 3px;
-    }}
-    QCalendarWidget QToolButton:hover {{ background-color: #c1c5c8; }}
-    QCalendarWidget QToolButton:pressed {{ background-color: {accent_color}; }}
-    QCalendarWidget QMenu {{ background-color: #e8f1f2; }}
-    QCalendarWidget QSpinBox {{ background-color: #ffffff; color: #2a363b; border: 1px solid #c1c5c8; }}
-    QCalendarWidget QTableView {{ alternate-background-color: #f0f5f6; }} /* Subtle alternate row */
-
-    QLabel {{ background-color: transparent; }}
-    QCheckBox::indicator {{ width: 14px; height: 14px; border-radius: 4px; }}
-    QCheckBox::indicator:unchecked {{ border: 1px solid #a7b0b4; background-color: #dde4e5; }}
-    QCheckBox::indicator:checked {{ background-color: {accent_color}; border: 1px solid {accent_color}; }}
-    /* QCheckBox::indicator:checked {{ image: url(path/to/check-light.png); }} */
-"""
-
-MINTY_LIGHT_QSS = """
-    QWidget {{
-        background-color: #f5fcf7; /* Very light green tint */
-        color: #3d4c42; /* Dark green/grey text */
-        border: 0px;
-        font-size: 10pt;
-    }}
-    QMainWindow, QDialog {{ background-color: #f5fcf7; }}
-    QMenuBar, QMenu {{
-        background-color: #eaf7ed; /* Light minty green */
-        color: #3d4c42;
-        border-bottom: 1px solid #d8e9dd;
-    }}
-    QMenuBar::item:selected, QMenu::item:selected {{
-        background-color: {accent_color};
-        color: white;
-    }}
-    QPushButton {{
-        background-color: #a3d9b8; /* Mint green */
-        color: #2f3a32;
-        border: 1px solid #90c2a5;
-        padding: 5px 10px;
-        min-height: 17px;
-        border-radius: 10px; /* Rounded buttons */
-    }}
-    QPushButton:hover {{ background-color: #90c2a5; }}
-    QPushButton:pressed {{ background-color: {accent_color}; color: white; border-color: {accent_color}; }}
-    QLineEdit, QTextEdit, QDateEdit, QTimeEdit, QComboBox {{
-        background-color: #ffffff;
-        color: #3d4c42;
-        border: 1px solid #d8e9dd;
-        border-radius: 4px;
-        padding: 4px;
-    }}
-    QLineEdit:focus, QTextEdit:focus, QDateEdit:focus, QTimeEdit:focus, QComboBox:focus {{
-        border: 1px solid {accent_color};
-        background-color: #fafffc; /* Slightly different background on focus */
-    }}
-    QListWidget, QCalendarWidget {{
-        background-color: #ffffff;
-        border: 1px solid #eaf7ed;
-    }}
-    QListWidget::item {{ padding: 3px 1px; }}
-    QListWidget::item:selected, QCalendarWidget QAbstractItemView:enabled:selected {{
-        background-color: {accent_color};
-        color: white;
-        border: none;
-    }}
-    QCalendarWidget QToolButton {{
-        color: #3d4c42;
-        background-color: #eaf7ed;
-        border: 1px solid #d8e9dd;
-        border-radius: 4px;
-        padding: 3px;
-    }}
-    QCalendarWidget QToolButton:hover {{ background-color: #d8e9dd; }}
-    QCalendarWidget QToolButton:pressed {{ background-color: {accent_color}; }}
-    QCalendarWidget QMenu {{ background-color: #f5fcf7; }}
-    QCalendarWidget QSpinBox {{ background-color: #ffffff; color: #3d4c42; border: 1px solid #d8e9dd; }}
-    QCalendarWidget QTableView {{ alternate-background-color: #f8fdfa; }}
-
-    QLabel {{ background-color: transparent; }}
-    QCheckBox::indicator {{ width: 13px; height: 13px; border-radius: 3px; }}
-    QCheckBox::indicator:unchecked {{ border: 1px solid #b4c7bb; background-color: #e0ebe4; }}
-    QCheckBox::indicator:checked {{ background-color: {accent_color}; border: 1px solid {accent_color}; }}
-    /* QCheckBox::indicator:checked {{ image: url(path/to/check-light.png); }} */
-"""
-
+# Built-in themes ship in themes/ beside this module (inside the bundle when frozen),
+# found regardless of the working directory; user themes come from the data file's folder
+THEMES = ThemeRegistry(os.path.join(os.path.dirname(os.path.abspath(__file__)), "themes"))
 
 # --- Helper Functions ---
 def create_temporary_file(filename: str, content: bytes) -> Optional[str]:
@@ -293,11 +113,36 @@ def create_temporary_file(filename: str, content: bytes) -> Optional[str]:
         print(f"Error creating temporary file '{filename}': {e}", file=sys.stderr)
         return None
 
+def decoded_size(data_b64: str) -> int:
+    """Byte size of base64 data, computed from its length without decoding it."""
+    padding = 2 if data_b64.endswith("==") else 1 if data_b64.endswith("=") else 0
+    return len(data_b64) * 3 // 4 - padding
+
+def format_size(nbytes: int) -> str:
+    for unit in ("bytes", "KB", "MB"):
+        if nbytes < 1024 or unit == "MB":
+            return f"{nbytes} {unit}" if unit == "bytes" else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+
+def apply_app_theme(app: QApplication, style_name: str, accent_color: str) -> None:
+    """Styles the whole application. Needs no DataManager, so main() can call it before events load."""
+    THEMES.apply(app, style_name, accent_color)
+
+
 # --- Dialog Classes ---
 class EventDialog(QDialog):
-    """Dialog for creating or editing event details."""
-    def __init__(self, parent=None, event_data=None):
+    """Dialog for creating or editing event details.
+
+    With a data_manager it warns about overlapping events while the times
+    are edited and can look up the next free slot. The main window keeps one
+    instance and calls reset() for each event instead of building a new form.
+    Attachments start collapsed to a count and size; their items and image
+    previews are only built when the section is expanded.
+    """
+    def __init__(self, parent=None, event_data=None, data_manager=None):
         super().__init__(parent)
+        self.data_manager = data_manager
+        self._event_id = None
         self.setWindowTitle("Event Details")
         self.setModal(True)
         if parent and parent.windowIcon():
@@ -307,9 +152,13 @@ class EventDialog(QDialog):
                  self.setWindowIcon(QIcon(ICON_PATH))
 
         self.attachments: List[Tuple[str, str]] = []
+        self._attachments_loaded = False # attach_list holds an item per attachment
+        self._conflict_timer = QTimer(self)
+        self._conflict_timer.setSingleShot(True)
+        self._conflict_timer.setInterval(CONFLICT_CHECK_DELAY_MS)
+        self._conflict_timer.timeout.connect(self._check_conflicts)
         self._setup_ui()
-        if event_data:
-            self._populate_fields(event_data)
+        self.reset(event_data)
 
     def _setup_ui(self):
         form_layout = QFormLayout(self)
@@ -321,6 +170,27 @@ class EventDialog(QDialog):
         self.time_edit = QTimeEdit()
         self.time_edit.setDisplayFormat(TIME_FORMAT)
         self.time_edit.setTime(QTime(0, 0))
+        self.end_checkbox = QCheckBox("Ends")
+        self.end_date_edit = QDateEdit()
+        self.end_date_edit.setDisplayFormat(DATE_FORMAT)
+        self.end_date_edit.setCalendarPopup(True)
+        self.end_date_edit.setDate(QDate.currentDate())
+        self.end_time_edit = QTimeEdit()
+        self.end_time_edit.setDisplayFormat(TIME_FORMAT)
+        self.end_time_edit.setTime(QTime(1, 0))
+        self.end_date_edit.setEnabled(False)
+        self.end_time_edit.setEnabled(False)
+        self.free_slot_btn = QPushButton(QIcon.fromTheme("appointment-new"), " Find Free Slot")
+        self.free_slot_btn.setToolTip("Move this event to the next time it fits without overlapping others.")
+        self.free_slot_btn.setVisible(self.data_manager is not None)
+        self.conflict_label = QLabel()
+        self.conflict_label.setWordWrap(True)
+        self.conflict_label.setStyleSheet("color: #C0392B;")
+        self.conflict_label.hide()
+        default_zone = self.data_manager.default_time_zone() if self.data_manager is not None else timezones.local_zone_name()
+        self.tz_combo = make_zone_combo(default_zone, "Default time zone")
+        self.tags_edit = QLineEdit()
+        self.tags_edit.setPlaceholderText("e.g. work, family")
         self.desc_edit = QTextEdit()
         self.notify_checkbox = QCheckBox("Remind me about this event")
         self.notify_minutes_edit = QLineEdit(str(DEFAULT_NOTIFY_MINUTES))
@@ -330,17 +200,33 @@ class EventDialog(QDialog):
         self.attach_list.setIconSize(ATTACHMENT_ICON_SIZE)
         self.attach_list.setSpacing(10)
         self.attach_list.setWordWrap(True)
+        self.attach_list.hide()
+        self.attach_toggle = QPushButton()
+        self.attach_toggle.setCheckable(True)
+        self.attach_summary = QLabel()
         attach_btn = QPushButton(QIcon.fromTheme("list-add"), " Add Attachment...")
-        remove_attach_btn = QPushButton(QIcon.fromTheme("list-remove"), " Remove Selected")
+        self.remove_attach_btn = QPushButton(QIcon.fromTheme("list-remove"), " Remove Selected")
+        self.remove_attach_btn.hide()
         form_layout.addRow("Title:", self.title_edit)
         form_layout.addRow("Date:", self.date_edit)
         form_layout.addRow("Time:", self.time_edit)
+        end_layout = QHBoxLayout()
+        end_layout.addWidget(self.end_checkbox)
+        end_layout.addWidget(self.end_date_edit)
+        end_layout.addWidget(self.end_time_edit)
+        form_layout.addRow("End:", end_layout)
+        form_layout.addRow("Time Zone:", self.tz_combo)
+        form_layout.addRow("", self.free_slot_btn)
+        form_layout.addRow(self.conflict_label)
+        form_layout.addRow("Tags:", self.tags_edit)
         form_layout.addRow("Description:", self.desc_edit)
         form_layout.addRow(self.notify_checkbox)
         form_layout.addRow("Notify Minutes Before:", self.notify_minutes_edit)
         attach_layout = QHBoxLayout()
+        attach_layout.addWidget(self.attach_toggle)
+        attach_layout.addWidget(self.attach_summary, 1)
         attach_layout.addWidget(attach_btn)
-        attach_layout.addWidget(remove_attach_btn)
+        attach_layout.addWidget(self.remove_attach_btn)
         form_layout.addRow(QLabel("Attachments:"), attach_layout)
         form_layout.addRow(self.attach_list)
         btn_layout = QHBoxLayout()
@@ -351,43 +237,174 @@ class EventDialog(QDialog):
         btn_layout.addWidget(cancel_btn)
         form_layout.addRow(btn_layout)
         self.notify_checkbox.toggled.connect(self.notify_minutes_edit.setEnabled)
+        self.end_checkbox.toggled.connect(self.end_date_edit.setEnabled)
+        self.end_checkbox.toggled.connect(self.end_time_edit.setEnabled)
+        if self.data_manager is not None:
+            for signal in (self.date_edit.dateChanged, self.time_edit.timeChanged, self.end_checkbox.toggled,
+                           self.end_date_edit.dateChanged, self.end_time_edit.timeChanged):
+                signal.connect(self._conflict_timer.start)
+            self.free_slot_btn.clicked.connect(self._on_find_free_slot)
+        self.attach_toggle.toggled.connect(self._set_attachments_expanded)
         attach_btn.clicked.connect(self._on_add_attachment)
-        remove_attach_btn.clicked.connect(self._on_remove_attachment)
+        self.remove_attach_btn.clicked.connect(self._on_remove_attachment)
         self.attach_list.itemDoubleClicked.connect(self._on_open_attachment)
-        ok_btn.clicked.connect(self.accept)
+        ok_btn.clicked.connect(self._on_ok)
         cancel_btn.clicked.connect(self.reject)
 
+    def reset(self, event_data=None, default_date: Optional[QDate] = None):
+        """Clears the form and fills it from event_data, or for a new event on default_date."""
+        self._conflict_timer.stop()
+        self.conflict_label.hide()
+        self._event_id = event_data.get('id') if event_data else None
+        day = default_date or QDate.currentDate()
+        self.title_edit.clear()
+        self.tags_edit.clear()
+        self.desc_edit.clear()
+        self.date_edit.setDate(day)
+        self.time_edit.setTime(QTime(0, 0))
+        self.end_checkbox.setChecked(False)
+        self.end_date_edit.setDate(day)
+        self.end_time_edit.setTime(QTime(1, 0))
+        default_zone = self.data_manager.default_time_zone() if self.data_manager is not None else timezones.local_zone_name()
+        self.tz_combo.setCurrentText(default_zone or "")
+        self.notify_checkbox.setChecked(False)
+        self.notify_minutes_edit.setText(str(DEFAULT_NOTIFY_MINUTES))
+        self.attachments = []
+        if event_data:
+            self._populate_fields(event_data)
+        self.attach_toggle.setChecked(False)
+        self._unload_attachments()
+        self._conflict_timer.stop() # Setting the fields restarted it; nothing was edited yet
+        self.title_edit.setFocus()
+
     def _populate_fields(self, event_data):
         self.title_edit.setText(event_data.get('title', ''))
+        self.tags_edit.setText(", ".join(event_data.get('tags') or []))
+        self.tz_combo.setCurrentText(event_data.get('tz') or "")
         self.desc_edit.setText(event_data.get('description', ''))
-        date_str = event_data.get('date')
-        if date_str:
-            qdate = QDate.fromString(date_str, DATE_FORMAT)
-            if qdate.isValid():
-                self.date_edit.setDate(qdate)
-        time_str = event_data.get('time')
-        if time_str:
-            qtime = QTime.fromString(time_str, TIME_FORMAT)
-            if qtime.isValid():
-               self.time_edit.setTime(qtime)
-            else:
-                try:
-                    dt_time = datetime.datetime.strptime(time_str, DATETIME_PARSE_FORMAT).time()
-                    self.time_edit.setTime(QTime(dt_time.hour, dt_time.minute))
-                except ValueError: pass
+        ordinal = event_data.get('date_ordinal')
+        if ordinal:
+            self.date_edit.setDate(QDate.fromJulianDay(ordinal + JULIAN_DAY_OF_ORDINAL_0))
+        minutes = event_data.get('time_minutes')
+        if minutes is not None:
+            self.time_edit.setTime(QTime(minutes // 60, minutes % 60))
+        end_ordinal = event_data.get('end_ordinal')
+        end_minutes = event_data.get('end_minutes')
+        if end_ordinal or end_minutes is not None:
+            self.end_checkbox.setChecked(True)
+            self.end_date_edit.setDate(QDate.fromJulianDay((end_ordinal or ordinal) + JULIAN_DAY_OF_ORDINAL_0))
+            if end_minutes is not None:
+                self.end_time_edit.setTime(QTime(end_minutes // 60, end_minutes % 60))
+        else:
+            self.end_date_edit.setDate(self.date_edit.date())
         notify = event_data.get('notify', False)
         self.notify_checkbox.setChecked(notify)
         notify_minutes = event_data.get('notify_minutes', DEFAULT_NOTIFY_MINUTES)
         self.notify_minutes_edit.setText(str(notify_minutes))
         self.notify_minutes_edit.setEnabled(notify)
-        self.attachments = []
+        # Only the references are kept; nothing is decoded until the section is expanded
+        self.attachments = [(attach_data.get('filename'), attach_data.get('data'))
+                            for attach_data in event_data.get('attachments', [])
+                            if attach_data.get('filename') and attach_data.get('data')]
+
+    def done(self, result):
+        super().done(result)
+        # get_event_data() only needs self.attachments, so the previews can go right away
+        self.attach_toggle.setChecked(False)
+        self._unload_attachments()
+
+    def _update_attachment_summary(self):
+        count = len(self.attachments)
+        total = sum(decoded_size(data_b64) for _, data_b64 in self.attachments)
+        if count:
+            self.attach_summary.setText(f"{count} attachment{'s' if count != 1 else ''}, {format_size(total)}")
+        else:
+            self.attach_summary.setText("None")
+        self.attach_toggle.setText("Hide" if self.attach_toggle.isChecked() else "Show")
+        self.attach_toggle.setEnabled(count > 0 or self.attach_toggle.isChecked())
+
+    def _set_attachments_expanded(self, expanded):
+        if expanded and not self._attachments_loaded:
+            QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+            try:
+                for filename, data_b64 in self.attachments:
+                    self._add_attachment_item(filename, data_b64)
+            finally:
+                QApplication.restoreOverrideCursor()
+            self._attachments_loaded = True
+        self.attach_list.setVisible(expanded)
+        self.remove_attach_btn.setVisible(expanded)
+        self._update_attachment_summary()
+
+    def _unload_attachments(self):
+        """Drops the attachment items and previews; they are rebuilt when the section is expanded again."""
         self.attach_list.clear()
-        for attach_data in event_data.get('attachments', []):
-            filename = attach_data.get('filename')
-            data_b64 = attach_data.get('data')
-            if filename and data_b64:
-                self.attachments.append((filename, data_b64))
-                self._add_attachment_item(filename, data_b64)
+        self._attachments_loaded = False
+        self._set_attachments_expanded(self.attach_toggle.isChecked())
+
+    def _candidate_interval(self) -> Optional[Tuple[int, int]]:
+        """Returns the (start, end) minutes of the event as currently entered, or None if all day."""
+        candidate = normalize_event(self.get_event_data())
+        if candidate.get('time_minutes') is None:
+            return None
+        return event_interval(candidate)
+
+    def _check_conflicts(self):
+        """Shows the timed events the entered time overlaps, if any."""
+        span = self._candidate_interval()
+        clashes = []
+        if span is not None:
+            try:
+                clashes = self.data_manager.overlapping_events(minutes_to_datetime(span[0]), minutes_to_datetime(span[1]),
+                                                               exclude_id=self._event_id)
+            except Exception as e:
+                print(f"Warning: Could not check for overlapping events: {e}", file=sys.stderr)
+        if not clashes:
+            self.conflict_label.hide()
+            return
+        names = [f"{ev.get('date', '')} {ev.get('time', '')} {ev.get('title', 'No Title')}" for ev in clashes[:MAX_CONFLICTS_SHOWN]]
+        more = len(clashes) - len(names)
+        self.conflict_label.setText("Overlaps: " + "; ".join(names) + (f" and {more} more" if more > 0 else ""))
+        self.conflict_label.show()
+
+    def _on_find_free_slot(self):
+        """Moves the event to the next free slot of the same length, starting from its current time."""
+        span = self._candidate_interval()
+        if span is not None:
+            start, duration = minutes_to_datetime(span[0]), span[1] - span[0]
+        else:
+            start = datetime.datetime.combine(self.date_edit.date().toPython(), FREE_SLOT_DAY_START)
+            duration = DEFAULT_DURATION_MINUTES
+        start = max(start, datetime.datetime.now().replace(second=0, microsecond=0))
+        end = start + datetime.timedelta(days=FREE_SLOT_SEARCH_DAYS)
+        try:
+            slot = self.data_manager.find_free_slot(start, end, duration, FREE_SLOT_DAY_START, FREE_SLOT_DAY_END)
+        except Exception as e:
+            QMessageBox.warning(self, "Find Free Slot", f"Could not search for a free slot:\n{e}")
+            return
+        if slot is None:
+            QMessageBox.information(self, "Find Free Slot",
+                                    f"No free {duration}-minute slot in the next {FREE_SLOT_SEARCH_DAYS} days.")
+            return
+        slot_end = slot + datetime.timedelta(minutes=duration)
+        self.date_edit.setDate(QDate(slot.year, slot.month, slot.day))
+        self.time_edit.setTime(QTime(slot.hour, slot.minute))
+        self.end_checkbox.setChecked(True)
+        self.end_date_edit.setDate(QDate(slot_end.year, slot_end.month, slot_end.day))
+        self.end_time_edit.setTime(QTime(slot_end.hour, slot_end.minute))
+
+    def _on_ok(self):
+        zone = self.tz_combo.currentText().strip()
+        if zone and not timezones.is_valid_zone(zone):
+            QMessageBox.warning(self, "Invalid Time Zone", f"Unknown time zone '{zone}'. Use a name like Europe/Berlin, or leave it empty for the default zone.")
+            return
+        if self.end_checkbox.isChecked():
+            start_date, end_date = self.date_edit.date(), self.end_date_edit.date()
+            timed = self.time_edit.time() != QTime(0, 0)
+            if end_date < start_date or (timed and end_date == start_date and self.end_time_edit.time() <= self.time_edit.time()):
+                QMessageBox.warning(self, "Invalid End", "The event must end after it starts.")
+                return
+        self.accept()
 
     def _on_add_attachment(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select Attachment")
@@ -397,7 +414,9 @@ class EventDialog(QDialog):
             with open(file_path, 'rb') as f: data_bytes = f.read()
             data_b64 = base64.b64encode(data_bytes).decode('utf-8')
             self.attachments.append((filename, data_b64))
-            self._add_attachment_item(filename, data_b64)
+            if self._attachments_loaded:
+                self._add_attachment_item(filename, data_b64)
+            self._update_attachment_summary()
         except Exception as e: QMessageBox.warning(self, "Error", f"Failed to add attachment:\n{e}")
 
     def _add_attachment_item(self, filename, data_b64):
@@ -408,11 +427,19 @@ class EventDialog(QDialog):
             try:
                 img_data = base64.b64decode(data_b64)
                 pixmap = QPixmap()
-                if pixmap.loadFromData(img_data): icon = QIcon(pixmap)
+                if pixmap.loadFromData(img_data):
+                    icon = QIcon(pixmap)
+                    item.setData(USER_ROLE, pixmap.width() * pixmap.height() * pixmap.depth() // 8)
             except Exception as e: print(f"Warning: Could not load preview for {filename}: {e}", file=sys.stderr)
         item.setIcon(icon)
         self.attach_list.addItem(item)
 
+    def preview_memory(self) -> Tuple[int, int]:
+        """Returns (bytes, count) of the decoded image previews this dialog holds."""
+        sizes = [self.attach_list.item(i).data(USER_ROLE) for i in range(self.attach_list.count())]
+        sizes = [size for size in sizes if size]
+        return sum(sizes), len(sizes)
+
     def _on_remove_attachment(self):
         selected_items = self.attach_list.selectedItems()
         if not selected_items: return
@@ -420,6 +447,7 @@ class EventDialog(QDialog):
         if 0 <= current_row < len(self.attachments):
             self.attach_list.takeItem(current_row)
             del self.attachments[current_row]
+            self._update_attachment_summary()
 
     def _on_open_attachment(self, item):
         index = self.attach_list.row(item)
@@ -456,9 +484,15 @@ class EventDialog(QDialog):
                 notify_dt = event_dt - datetime.timedelta(minutes=notify_minutes)
                 notify_time_iso = notify_dt.isoformat()
             except ValueError as e: print(f"Error calculating notify time: {e}", file=sys.stderr)
+        end_date_str = end_time_str = ""
+        if self.end_checkbox.isChecked():
+            end_date_str = self.end_date_edit.date().toString(DATE_FORMAT)
+            if time_str: end_time_str = self.end_time_edit.time().toString(TIME_FORMAT)
         attachment_dicts = [{"filename": name, "data": data} for name, data in self.attachments]
         return {
             "title": title, "date": date_str, "time": time_str, "description": description,
+            "end_date": end_date_str, "end_time": end_time_str, "tags": normalize_tags(self.tags_edit.text()),
+            "tz": self.tz_combo.currentText().strip(),
             "attachments": attachment_dicts, "notify": notify,
             "notify_minutes": notify_minutes, "notify_time": notify_time_iso, "id": None
         }
@@ -466,7 +500,9 @@ class EventDialog(QDialog):
 
 class SettingsDialog(QDialog):
     """Dialog for configuring application settings including style."""
-    def __init__(self, parent=None, current_style=DEFAULT_STYLE, current_accent=DEFAULT_ACCENT_COLOR):
+    def __init__(self, parent=None, current_style=DEFAULT_STYLE, current_accent=DEFAULT_ACCENT_COLOR,
+                 current_archive_months=DEFAULT_ARCHIVE_AFTER_MONTHS, current_time_zone="",
+                 current_durability=DEFAULT_DURABILITY):
         super().__init__(parent)
         self.setWindowTitle("Settings")
         self.setModal(True)
@@ -477,18 +513,12 @@ class SettingsDialog(QDialog):
                 self.setWindowIcon(QIcon(ICON_PATH))
 
         self._current_accent = QColor(current_accent)
-        self._setup_ui(current_style, current_accent)
+        self._setup_ui(current_style, current_accent, current_archive_months, current_time_zone, current_durability)
 
-    def _setup_ui(self, current_style, current_accent):
+    def _setup_ui(self, current_style, current_accent, current_archive_months, current_time_zone, current_durability):
         layout = QFormLayout(self)
         self.style_combo = QComboBox()
-        self.style_combo.addItems([
-            STYLE_DEFAULT_LIGHT,
-            STYLE_DEFAULT_DARK,
-            STYLE_GRAPHITE_DARK,
-            STYLE_OCEAN_BREEZE,
-            STYLE_MINTY_LIGHT
-        ])
+        self.style_combo.addItems(THEMES.names())
         self.style_combo.setCurrentText(current_style)
         self.accent_color_btn = QPushButton("Select Accent Color")
         self.accent_color_lbl = QLabel(current_accent)
@@ -496,6 +526,24 @@ class SettingsDialog(QDialog):
         layout.addRow("Style:", self.style_combo)
         layout.addRow("Accent Color:", self.accent_color_btn)
         layout.addRow("", self.accent_color_lbl)
+        self.archive_spin = QSpinBox()
+        self.archive_spin.setRange(0, MAX_ARCHIVE_MONTHS)
+        self.archive_spin.setSuffix(" months")
+        self.archive_spin.setSpecialValueText("Never")
+        self.archive_spin.setValue(current_archive_months)
+        self.archive_spin.setToolTip("Events older than this move to the archive file; they stay browsable and searchable.")
+        layout.addRow("Archive Events After:", self.archive_spin)
+        local_zone = timezones.local_zone_name()
+        self.tz_combo = make_zone_combo(current_time_zone, f"This computer's ({local_zone})" if local_zone else "This computer's")
+        self.tz_combo.setToolTip("Time zone given to new events.")
+        layout.addRow("Default Time Zone:", self.tz_combo)
+        self.durability_combo = QComboBox()
+        self.durability_combo.addItems(DURABILITY_MODES)
+        self.durability_combo.setCurrentText(current_durability)
+        self.durability_combo.setToolTip("none: fastest, a power loss can lose the data file.\n"
+                                         "fsync-on-save: every change is flushed to disk.\n"
+                                         "group-commit: changes made close together share one flush.")
+        layout.addRow("Durability:", self.durability_combo)
         btn_layout = QHBoxLayout()
         ok_btn = QPushButton("OK")
         cancel_btn = QPushButton("Cancel")
@@ -504,9 +552,16 @@ class SettingsDialog(QDialog):
         btn_layout.addWidget(cancel_btn)
         layout.addRow(btn_layout)
         self.accent_color_btn.clicked.connect(self._select_accent_color)
-        ok_btn.clicked.connect(self.accept)
+        ok_btn.clicked.connect(self._on_ok)
         cancel_btn.clicked.connect(self.reject)
 
+    def _on_ok(self):
+        zone = self.tz_combo.currentText().strip()
+        if zone and not timezones.is_valid_zone(zone):
+            QMessageBox.warning(self, "Invalid Time Zone", f"Unknown time zone '{zone}'.")
+            return
+        self.accept()
+
     def _select_accent_color(self):
         color = QColorDialog.getColor(self._current_accent, self, "Select Accent Color")
         if color.isValid():
@@ -534,21 +589,280 @@ class SettingsDialog(QDialog):
     def get_settings(self):
         return {
             "style_name": self.style_combo.currentText(),
-            "accent_color": self._current_accent.name()
+            "accent_color": self._current_accent.name(),
+            "archive_after_months": self.archive_spin.value(),
+            "time_zone": self.tz_combo.currentText().strip(),
+            "durability": self.durability_combo.currentText()
         }
 
+class PassphraseDialog(QDialog):
+    """Asks for a new passphrase (twice) and the backup files to re-encrypt with it."""
+    def __init__(self, parent=None, has_passphrase=False):
+        super().__init__(parent)
+        self.setWindowTitle("Change Passphrase")
+        self.setModal(True)
+        if parent and parent.windowIcon():
+            self.setWindowIcon(parent.windowIcon())
+        layout = QFormLayout(self)
+        self.passphrase_edit = QLineEdit()
+        self.passphrase_edit.setEchoMode(QLineEdit.EchoMode.Password)
+        self.confirm_edit = QLineEdit()
+        self.confirm_edit.setEchoMode(QLineEdit.EchoMode.Password)
+        if has_passphrase:
+            self.passphrase_edit.setPlaceholderText("Leave empty to remove the passphrase")
+        layout.addRow("New passphrase:", self.passphrase_edit)
+        layout.addRow("Confirm:", self.confirm_edit)
+        self.backup_list = QListWidget()
+        self.backup_list.setToolTip("Backups made with File > Backup Data keep the old passphrase unless listed here.")
+        add_backups_btn = QPushButton("Add Backup Files...")
+        layout.addRow("Backups:", self.backup_list)
+        layout.addRow("", add_backups_btn)
+        btn_layout = QHBoxLayout()
+        ok_btn = QPushButton("OK")
+        cancel_btn = QPushButton("Cancel")
+        btn_layout.addStretch()
+        btn_layout.addWidget(ok_btn)
+        btn_layout.addWidget(cancel_btn)
+        layout.addRow(btn_layout)
+        add_backups_btn.clicked.connect(self._add_backups)
+        ok_btn.clicked.connect(self._on_ok)
+        cancel_btn.clicked.connect(self.reject)
+
+    def _add_backups(self):
+        paths, _ = QFileDialog.getOpenFileNames(self, "Backup Files to Re-encrypt", "",
+                                                "Encrypted Data Files (*.dat *.enc);;All Files (*)")
+        for path in paths:
+            if not self.backup_list.findItems(path, Qt.MatchFlag.MatchExactly):
+                self.backup_list.addItem(path)
+
+    def _on_ok(self):
+        if self.passphrase_edit.text() != self.confirm_edit.text():
+            QMessageBox.warning(self, "Change Passphrase", "The passphrases do not match.")
+            return
+        self.accept()
+
+    def get_passphrase(self):
+        return self.passphrase_edit.text()
+
+    def get_backup_paths(self):
+        return [self.backup_list.item(i).text() for i in range(self.backup_list.count())]
+
+class DiagnosticsDialog(QDialog):
+    """Shows recorded operation timings (Help > Diagnostics)."""
+    TIMING_COLUMNS = ("Operation", "Count", "Mean ms", "p50 ms", "p90 ms", "p99 ms", "Max ms", "Bytes")
+
+    def __init__(self, parent=None, data_manager=None):
+        super().__init__(parent)
+        self.data_manager = data_manager
+        self.setWindowTitle("Diagnostics")
+        self.resize(760, 420)
+        if parent and parent.windowIcon():
+            self.setWindowIcon(parent.windowIcon())
+        self._setup_ui()
+        self.refresh()
+
+    def _setup_ui(self):
+        layout = QVBoxLayout(self)
+        self.tabs = QTabWidget()
+        layout.addWidget(self.tabs)
+
+        timings_tab = QWidget()
+        timings_layout = QVBoxLayout(timings_tab)
+        self.record_check = QCheckBox("Record timings (also enabled by the BTODO_PERF=1 environment variable)")
+        self.record_check.setChecked(perf_stats.is_enabled())
+        timings_layout.addWidget(self.record_check)
+        self.timings_table = QTableWidget(0, len(self.TIMING_COLUMNS))
+        self.timings_table.setHorizontalHeaderLabels(self.TIMING_COLUMNS)
+        self.timings_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.timings_table.verticalHeader().setVisible(False)
+        timings_layout.addWidget(self.timings_table)
+        self.tabs.addTab(timings_tab, "Timings")
+
+        self.memory_tab = QWidget()
+        memory_layout = QVBoxLayout(self.memory_tab)
+        self.memory_table = QTableWidget(0, 3)
+        self.memory_table.setHorizontalHeaderLabels(("Component", "MB", "Items"))
+        self.memory_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.memory_table.verticalHeader().setVisible(False)
+        memory_layout.addWidget(self.memory_table)
+        trace_layout = QHBoxLayout()
+        self.trace_btn = QPushButton()
+        self.baseline_btn = QPushButton("New Baseline")
+        self.diff_btn = QPushButton("Diff Since Baseline")
+        trace_layout.addWidget(self.trace_btn)
+        trace_layout.addWidget(self.baseline_btn)
+        trace_layout.addWidget(self.diff_btn)
+        trace_layout.addStretch()
+        memory_layout.addLayout(trace_layout)
+        self.trace_output = QTextEdit()
+        self.trace_output.setReadOnly(True)
+        self.trace_output.setPlaceholderText("Start tracing, use bToDo for a while, then diff to see which modules grew.")
+        memory_layout.addWidget(self.trace_output)
+        self.tabs.addTab(self.memory_tab, "Memory")
+        self._update_trace_buttons()
+
+        btn_layout = QHBoxLayout()
+        refresh_btn = QPushButton("Refresh")
+        reset_btn = QPushButton("Reset")
+        export_btn = QPushButton("Export JSON...")
+        close_btn = QPushButton("Close")
+        btn_layout.addWidget(refresh_btn)
+        btn_layout.addWidget(reset_btn)
+        btn_layout.addWidget(export_btn)
+        btn_layout.addStretch()
+        btn_layout.addWidget(close_btn)
+        layout.addLayout(btn_layout)
+
+        self.record_check.toggled.connect(self._on_record_toggled)
+        self.tabs.currentChanged.connect(self.refresh)
+        self.trace_btn.clicked.connect(self._toggle_tracing)
+        self.baseline_btn.clicked.connect(self._new_baseline)
+        self.diff_btn.clicked.connect(self._diff_since_baseline)
+        refresh_btn.clicked.connect(self.refresh)
+        reset_btn.clicked.connect(self._reset)
+        export_btn.clicked.connect(self._export)
+        close_btn.clicked.connect(self.accept)
+
+    def refresh(self):
+        stats = perf_stats.summary()
+        self.timings_table.setRowCount(len(stats))
+        for row, (name, op) in enumerate(stats.items()):
+            values = [name, str(op['count'])]
+            values += [f"{op[k]:.2f}" for k in ('mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms')]
+            values.append(str(op['bytes']) if op['bytes'] else "")
+            for col, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if col:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.timings_table.setItem(row, col, item)
+        self.timings_table.resizeColumnsToContents()
+        if self.tabs.currentWidget() is self.memory_tab:
+            self._refresh_memory() # Walks every event, so only when the tab is shown
+
+    def _refresh_memory(self):
+        if self.data_manager is None:
+            return
+        extra = self.parent().memory_components() if hasattr(self.parent(), 'memory_components') else None
+        report = memory_report.component_report(self.data_manager, extra)
+        rows = [(name, entry['bytes'], entry['count']) for name, entry in report.items() if name != "process"]
+        peak = report['process'].get('peak_rss_bytes')
+        if peak:
+            rows.append(("process peak RSS", peak, report['process']['gc_objects']))
+        self.memory_table.setRowCount(len(rows))
+        for row, (name, nbytes, count) in enumerate(rows):
+            for col, value in enumerate((name, f"{nbytes / 1048576:.2f}", str(count))):
+                item = QTableWidgetItem(value)
+                if col:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.memory_table.setItem(row, col, item)
+        self.memory_table.resizeColumnsToContents()
+
+    def _update_trace_buttons(self):
+        tracing = memory_report.is_tracing()
+        self.trace_btn.setText("Stop Tracing" if tracing else "Start Tracing")
+        self.baseline_btn.setEnabled(tracing)
+        self.diff_btn.setEnabled(tracing)
+
+    def _toggle_tracing(self):
+        if memory_report.is_tracing():
+            memory_report.stop_tracing()
+            self.trace_output.clear()
+        else:
+            memory_report.set_baseline()
+            self.trace_output.setPlainText("Tracing started; baseline recorded.")
+        self._update_trace_buttons()
+
+    def _new_baseline(self):
+        memory_report.set_baseline()
+        self.trace_output.setPlainText("New baseline recorded.")
+
+    def _diff_since_baseline(self):
+        try:
+            self.trace_output.setPlainText("\n".join(memory_report.diff_from_baseline()))
+        except RuntimeError as e:
+            self.trace_output.setPlainText(str(e))
+
+    def _on_record_toggled(self, checked):
+        perf_stats.set_enabled(checked)
+        if self.data_manager is not None:
+            self.data_manager.settings['perf_timing'] = checked
+            try:
+                self.data_manager.save_settings()
+            except Exception as e:
+                print(f"Warning: Could not save diagnostics setting: {e}", file=sys.stderr)
+
+    def _reset(self):
+        perf_stats.reset()
+        self.refresh()
+
+    def _export(self):
+        default_filename = f"btodo_diagnostics_{datetime.date.today().strftime('%Y%m%d')}.json"
+        file_path, _ = QFileDialog.getSaveFileName(self, "Export Diagnostics", default_filename,
+                                                   "JSON Files (*.json);;All Files (*)")
+        if file_path:
+            try:
+                perf_stats.export_json(file_path)
+            except (IOError, OSError) as e:
+                QMessageBox.critical(self, "Export Failed", f"Could not write diagnostics:\n{e}")
+
+
 class MainWindow(QMainWindow):
     """The main application window."""
+    # Emitted from the shard loader thread: (shard key, events or None on failure)
+    shard_loaded = Signal(str, object)
+    overlay_loaded = Signal(str, object)
+    # Emitted from the passphrase change thread: (files done, total), then the finished RekeyJob
+    rekey_progress = Signal(int, int)
+    rekey_finished = Signal(object)
+    # Emitted from the same thread with new KDF parameters (their key already derived) when a re-key is due
+    kdf_prepared = Signal(object)
+
     def __init__(self, data_manager: DataManager, notification_manager: NotificationManager):
         super().__init__()
         self.data_manager = data_manager
         self.notification_manager = notification_manager
+        # Year shards are decrypted on a worker thread as the calendar navigates
+        self._shard_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_shards = set()
+        # Cheap stat-based check for saves made by other bToDo processes or scripts
+        self._external_change_timer = QTimer(self)
+        self._external_change_timer.setInterval(EXTERNAL_CHANGE_POLL_MS)
+        # Under group commit, saves changes once the window after the first unsaved one ends
+        self._group_commit_timer = QTimer(self)
+        self._group_commit_timer.setSingleShot(True)
+        # Day-view tag filter for this session: tag keys switched off in the Tags menu
+        self._hidden_tags = set()
+        self._hide_untagged = False
+        self._event_dialog: Optional[EventDialog] = None # Built on first use, then reset for each event
+        # Read-only calendar files shown beside this one; loaded on the shard loader thread
+        self.overlays = OverlaySet()
+        self._pending_overlays: Dict[str, Dict[str, Any]] = {} # path -> overlay setting, while loading
+        # Next events for the tray menu and the Upcoming panel, kept current by a timer and Changes
+        self.upcoming = UpcomingWindow(self.data_manager, self.data_manager.settings.get('upcoming_days', DEFAULT_UPCOMING_DAYS))
+        self._upcoming_timer = QTimer(self)
+        self._upcoming_timer.setInterval(UPCOMING_TICK_MS)
+        self.tray: Optional[QSystemTrayIcon] = None
+        # Passphrase changes re-encrypt the files on a thread of their own, leaving the shard loader free
+        self._rekey_executor = ThreadPoolExecutor(max_workers=1)
+        self._rekey_job = None
+        self._rekey_action_text = "Re-encrypting data with the new passphrase"
+        self._rekey_done_text = "Passphrase changed."
+        self._closing = False
+
+        if self.data_manager.settings.get('perf_timing'):
+            perf_stats.set_enabled(True)
 
         self._setup_ui()
         self._connect_signals()
 
         self.refresh_event_list()
+        self._restore_overlays()
+        self.upcoming.rebuild()
+        self._refresh_upcoming()
+        # Edits made here, by undo, by the API server or by other processes all arrive as Changes
+        self.data_manager.changes.subscribe(self._on_data_changed)
 
+        THEMES.add_directory(user_themes_dir(self.data_manager.data_file))
         initial_style = self.data_manager.settings.get('style_name', DEFAULT_STYLE)
         initial_accent = self.data_manager.settings.get('accent_color', DEFAULT_ACCENT_COLOR)
         self.apply_theme(initial_style, initial_accent, save_settings=False)
@@ -605,26 +919,76 @@ class MainWindow(QMainWindow):
         btn_layout.addWidget(self.edit_btn)
         btn_layout.addWidget(self.del_btn)
         btn_layout.addStretch()
+        self.tags_btn = QPushButton(QIcon.fromTheme("view-filter"), " Tags")
+        self.tags_btn.setToolTip("Show only events with the checked tags.")
+        self.tags_menu = QMenu(self.tags_btn)
+        self.tags_btn.setMenu(self.tags_menu)
+        btn_layout.addWidget(self.tags_btn)
+        self.calendars_btn = QPushButton(QIcon.fromTheme("x-office-calendar"), " Calendars")
+        self.calendars_btn.setToolTip("Show other calendar files (backups, archives) beside this one, read-only.")
+        self.calendars_menu = QMenu(self.calendars_btn)
+        self.calendars_btn.setMenu(self.calendars_menu)
+        btn_layout.addWidget(self.calendars_btn)
         main_layout.addLayout(btn_layout)
 
+        self.upcoming_list = QListWidget()
+        self.upcoming_list.setToolTip("Double-click an event to show its day.")
+        self.upcoming_dock = QDockWidget("Upcoming", self)
+        self.upcoming_dock.setObjectName("upcoming_dock")
+        self.upcoming_dock.setWidget(self.upcoming_list)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.upcoming_dock)
+        self.upcoming_dock.setVisible(bool(self.data_manager.settings.get('upcoming_panel', False)))
+
         self._create_menu_bar()
+        self._create_tray_icon()
 
     def _create_menu_bar(self):
         menubar = self.menuBar()
         file_menu = menubar.addMenu("&File")
         self.backup_action = file_menu.addAction(QIcon.fromTheme("document-save-as"), "&Backup Data...")
+        self.snapshot_action = file_menu.addAction(QIcon.fromTheme("document-save"), "&Snapshot Backup...")
+        self.restore_snapshot_action = file_menu.addAction(QIcon.fromTheme("document-revert"), "&Restore Snapshot...")
+        self.verify_snapshots_action = file_menu.addAction("&Verify Snapshots...")
         self.export_action = file_menu.addAction(QIcon.fromTheme("document-export"), "&Export to iCal...")
+        self.export_delta_action = file_menu.addAction(QIcon.fromTheme("document-export"), "Export &Changes to iCal...")
+        file_menu.addSeparator()
+        self.open_overlay_action = file_menu.addAction(QIcon.fromTheme("document-open"), "&Open Overlay Calendar...")
         file_menu.addSeparator()
         self.exit_action = file_menu.addAction(QIcon.fromTheme("application-exit"), "E&xit")
         
+        edit_menu = menubar.addMenu("&Edit")
+        self.undo_action = edit_menu.addAction(QIcon.fromTheme("edit-undo"), "&Undo")
+        self.undo_action.setShortcut(QKeySequence("Ctrl+Z"))
+        self.redo_action = edit_menu.addAction(QIcon.fromTheme("edit-redo"), "&Redo")
+        self.redo_action.setShortcuts([QKeySequence("Ctrl+Y"), QKeySequence("Ctrl+Shift+Z")])
+        edit_menu.addSeparator()
+        self.find_action = edit_menu.addAction(QIcon.fromTheme("edit-find"), "&Find Events...")
+        self.find_action.setShortcut(QKeySequence.StandardKey.Find)
+
+        view_menu = menubar.addMenu("&View")
+        self.upcoming_panel_action = self.upcoming_dock.toggleViewAction()
+        self.upcoming_panel_action.setText("&Upcoming Events")
+        view_menu.addAction(self.upcoming_panel_action)
+
         settings_menu = menubar.addMenu("&Settings")
         self.pref_action = settings_menu.addAction(QIcon.fromTheme("preferences-system"), "&Preferences...")
+        self.passphrase_action = settings_menu.addAction(QIcon.fromTheme("dialog-password"), "Change &Passphrase...")
 
         # --- Add Help Menu ---
         help_menu = menubar.addMenu("&Help")
+        self.diagnostics_action = help_menu.addAction("&Diagnostics...")
         self.about_action = help_menu.addAction(QIcon.fromTheme("help-about"), "&About bToDo...")
         # --- End Add Help Menu ---
 
+    def _create_tray_icon(self):
+        """Tray icon whose menu lists the upcoming events (skipped where there is no tray)."""
+        if not QSystemTrayIcon.isSystemTrayAvailable():
+            return
+        self.tray = QSystemTrayIcon(self.windowIcon(), self)
+        self.tray_menu = QMenu(self)
+        self.tray.setContextMenu(self.tray_menu)
+        self.tray.show()
+
     def _show_about_dialog(self):
         """Displays the About dialog with application information and credits."""
         appName = "bToDo"
@@ -674,99 +1038,506 @@ class MainWindow(QMainWindow):
 
     def _connect_signals(self):
         self.calendar.selectionChanged.connect(self.refresh_event_list)
+        self.calendar.currentPageChanged.connect(self._on_calendar_page_changed)
+        self.shard_loaded.connect(self._on_shard_loaded)
+        self.overlay_loaded.connect(self._on_overlay_loaded)
+        self._external_change_timer.timeout.connect(self._check_external_changes)
+        self._group_commit_timer.timeout.connect(self._flush_changes)
+        self._external_change_timer.start()
+        self._upcoming_timer.timeout.connect(self._advance_upcoming)
+        self._upcoming_timer.start()
+        self.upcoming_list.itemActivated.connect(lambda item: self._show_day(item.data(USER_ROLE)))
+        self.upcoming_panel_action.triggered.connect(self._on_upcoming_panel_toggled) # Not toggled: closing the window hides the dock too
+        if self.tray:
+            self.tray_menu.aboutToShow.connect(self._populate_tray_menu)
+            self.tray.activated.connect(self._on_tray_activated)
+        QTimer.singleShot(KDF_CHECK_DELAY_MS, self._check_kdf_parameters)
+        QTimer.singleShot(ARCHIVE_CHECK_DELAY_MS, self._archive_old_events)
         self.event_list.itemDoubleClicked.connect(self.edit_event)
         self.add_btn.clicked.connect(self.add_event)
         self.edit_btn.clicked.connect(self.edit_event)
         self.del_btn.clicked.connect(self.delete_event)
+        self.tags_menu.aboutToShow.connect(self._populate_tags_menu)
+        self.calendars_menu.aboutToShow.connect(self._populate_calendars_menu)
+        self.open_overlay_action.triggered.connect(self.open_overlay)
         
         self.backup_action.triggered.connect(self.backup_data)
+        self.snapshot_action.triggered.connect(self.snapshot_backup)
+        self.restore_snapshot_action.triggered.connect(self.restore_snapshot)
+        self.verify_snapshots_action.triggered.connect(self.verify_snapshots)
         self.export_action.triggered.connect(self.export_to_ics)
+        self.export_delta_action.triggered.connect(self.export_changes_to_ics)
         self.exit_action.triggered.connect(self.close)
+        self.undo_action.triggered.connect(self.undo)
+        self.redo_action.triggered.connect(self.redo)
+        self._update_undo_actions()
+        self.find_action.triggered.connect(self.find_events)
         self.pref_action.triggered.connect(self.open_settings)
+        self.passphrase_action.triggered.connect(self.change_passphrase)
+        self.rekey_progress.connect(self._on_rekey_progress)
+        self.rekey_finished.connect(self._on_rekey_finished)
+        self.kdf_prepared.connect(self._on_kdf_prepared)
+        if self.data_manager.rekey_in_progress():
+            QTimer.singleShot(0, self._resume_passphrase_change)
         
+        self.diagnostics_action.triggered.connect(self.show_diagnostics)
         # --- Connect About Action ---
         self.about_action.triggered.connect(self._show_about_dialog)
         # --- End Connect About Action ---
 
+    def memory_components(self) -> Dict[str, Tuple[int, int]]:
+        """Estimates memory held by Qt objects, which Python's accounting cannot see."""
+        items = [self.event_list.item(i) for i in range(self.event_list.count())]
+        item_bytes = sum(QT_ITEM_OVERHEAD_BYTES + 2 * (len(item.text()) + len(item.toolTip())) for item in items)
+        # The one event dialog drops its previews when closed, so this is non-zero only while it is open
+        preview_bytes = preview_count = 0
+        for dialog in self.findChildren(EventDialog):
+            nbytes, count = dialog.preview_memory()
+            preview_bytes += nbytes
+            preview_count += count
+        overlays = list(self.overlays)
+        overlay_bytes = memory_report.deep_sizeof(overlays) if overlays else 0
+        return {"qt_items": (item_bytes, len(items)), "qt_pixmaps": (preview_bytes, preview_count),
+                "overlays": (overlay_bytes, sum(len(source) for source in overlays))}
+
+    def show_diagnostics(self) -> None:
+        DiagnosticsDialog(self, self.data_manager).exec()
+
+    @perf_stats.timed_function("ui.apply_theme")
     def apply_theme(self, style_name: str, accent_color: str, save_settings: bool = True) -> None:
         app = QApplication.instance()
         if not app: return
-        app.setStyle("Fusion")
-        if style_name == STYLE_DEFAULT_DARK:
-            app.setStyleSheet("")
-            palette = QPalette()
-            palette.setColor(QPalette.ColorRole.Window, QColor(45, 45, 45))
-            palette.setColor(QPalette.ColorRole.WindowText, QColor(220, 220, 220))
-            palette.setColor(QPalette.ColorRole.Base, QColor(35, 35, 35))
-            palette.setColor(QPalette.ColorRole.AlternateBase, QColor(55, 55, 55))
-            palette.setColor(QPalette.ColorRole.ToolTipBase, QColor(50, 50, 50))
-            palette.setColor(QPalette.ColorRole.ToolTipText, QColor(220, 220, 220))
-            palette.setColor(QPalette.ColorRole.Text, QColor(220, 220, 220))
-            palette.setColor(QPalette.ColorRole.Button, QColor(60, 60, 60))
-            palette.setColor(QPalette.ColorRole.ButtonText, QColor(220, 220, 220))
-            palette.setColor(QPalette.ColorRole.BrightText, QColor(255, 80, 80))
-            palette.setColor(QPalette.ColorRole.Link, QColor(42, 130, 218))
-            accent = QColor(accent_color)
-            palette.setColor(QPalette.ColorRole.Highlight, accent)
-            palette.setColor(QPalette.ColorRole.HighlightedText, QColor(255, 255, 255))
-            disabled_text = QColor(120, 120, 120)
-            palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Text, disabled_text)
-            palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.ButtonText, disabled_text)
-            app.setPalette(palette)
-        elif style_name == STYLE_GRAPHITE_DARK:
-            app.setStyleSheet(GRAPHITE_DARK_QSS.format(accent_color=accent_color))
-        elif style_name == STYLE_OCEAN_BREEZE:
-            app.setStyleSheet(OCEAN_BREEZE_QSS.format(accent_color=accent_color))
-        elif style_name == STYLE_MINTY_LIGHT:
-            app.setStyleSheet(MINTY_LIGHT_QSS.format(accent_color=accent_color))
-        else: # Default Light
-            app.setStyleSheet("")
-            app.setPalette(app.style().standardPalette())
-            light_palette = app.palette()
-            accent = QColor(accent_color)
-            light_palette.setColor(QPalette.ColorRole.Highlight, accent)
-            highlight_text_color = QColor("black") if accent.lightnessF() > 0.5 else QColor("white")
-            light_palette.setColor(QPalette.ColorRole.HighlightedText, highlight_text_color)
-            app.setPalette(light_palette)
+        apply_app_theme(app, style_name, accent_color)
 
         if save_settings:
             self.data_manager.settings['style_name'] = style_name
             self.data_manager.settings['accent_color'] = accent_color
-            self.data_manager.settings['theme'] = 'dark' if style_name in [STYLE_DEFAULT_DARK, STYLE_GRAPHITE_DARK] else 'light'
+            self.data_manager.settings['theme'] = 'dark' if THEMES.is_dark(style_name) else 'light'
             try:
-                self.data_manager.save_to_file()
+                self.data_manager.save_settings()
             except Exception as e:
                  QMessageBox.warning(self, "Settings Error", f"Could not save settings:\n{e}")
 
+    def _on_calendar_page_changed(self, year: int, month: int) -> None:
+        """Starts loading the shards around the displayed month in the background."""
+        first_day = datetime.date(year, month, 1)
+        # Include the neighbouring months so paging across a year boundary is instant
+        start = first_day - datetime.timedelta(days=31)
+        end = first_day + datetime.timedelta(days=62)
+        for key in self.data_manager.shards_for_range(start, end):
+            self._load_shard_in_background(key)
+        if start.toordinal() < self.data_manager.archived_before():
+            self._load_shard_in_background(ARCHIVE_KEY)
+
+    def _load_shard_in_background(self, key: str) -> None:
+        """Queues a shard (or the archive, under ARCHIVE_KEY) for the loader thread."""
+        if key in self._pending_shards:
+            return
+        if key == ARCHIVE_KEY and self.data_manager.is_archive_loaded():
+            return
+        self._pending_shards.add(key)
+        self._shard_executor.submit(self._read_shard_in_background, key)
+
+    def _read_shard_in_background(self, key: str) -> None:
+        """Runs on the loader thread; hands the result back through shard_loaded."""
+        try:
+            if key == ARCHIVE_KEY:
+                shard_events = self.data_manager.read_archive()
+            else:
+                shard_events = self.data_manager.read_shard(key)
+        except Exception as e:
+            print(f"Warning: Failed to load events for {key}: {e}", file=sys.stderr)
+            shard_events = None
+        self.shard_loaded.emit(key, shard_events)
+
+    def _on_shard_loaded(self, key: str, shard_events: Optional[List[Dict[str, Any]]]) -> None:
+        self._pending_shards.discard(key)
+        if shard_events is None:
+            return
+        if key == ARCHIVE_KEY:
+            merged = self.data_manager.merge_archive(shard_events)
+        else:
+            merged = self.data_manager.merge_shard(key, shard_events)
+        if merged:
+            self.refresh_event_list()
+
+    def _check_external_changes(self) -> None:
+        """Merges saves made by another process; the view follows through _on_data_changed."""
+        self.data_manager.reload_if_changed()
+
+    def _check_kdf_parameters(self) -> None:
+        """Re-keys the data file if its key derivation is far off the target unlock time.
+
+        Calibration and the new key's derivation run on the passphrase change
+        thread, and the files are then re-encrypted there by a RekeyJob, so
+        shards stay unloaded and the window stays responsive.
+        """
+        if self._rekey_job or self.data_manager.rekey_in_progress():
+            return # The passphrase change picks new parameters anyway
+        target_seconds = self.data_manager.settings.get('kdf_target_ms', DEFAULT_KDF_TARGET_MS) / 1000
+        self._rekey_executor.submit(self._prepare_kdf_in_background, target_seconds)
+
+    def _prepare_kdf_in_background(self, target_seconds):
+        """Runs on the passphrase change thread; touches only the DataManager's key cache."""
+        try:
+            iterations = self.data_manager.recommended_kdf_iterations(target_seconds)
+            if not iterations:
+                return
+            kdf = self.data_manager.rekey_kdf(iterations)
+            self.data_manager.derive_key(kdf)
+        except Exception as e:
+            print(f"Warning: Could not update key derivation parameters: {e}", file=sys.stderr)
+            return
+        self.kdf_prepared.emit(kdf)
+
+    def _on_kdf_prepared(self, kdf):
+        if self._closing or self._rekey_job or self.data_manager.rekey_in_progress():
+            return
+        self._flush_changes()
+        try:
+            job = self.data_manager.begin_rekey(kdf)
+        except Exception as e:
+            print(f"Warning: Could not update key derivation parameters: {e}", file=sys.stderr)
+            return
+        print(f"Info: Re-keying data with {kdf['iterations']} key derivation iterations.", file=sys.stderr)
+        self._start_rekey_job(job, "Updating data encryption", "Data encryption updated.")
+
+    def _archive_old_events(self) -> None:
+        """Moves past events into the archive file per the 'archive_after_months' setting."""
+        try:
+            moved = self.data_manager.archive_old_events()
+        except Exception as e:
+            print(f"Warning: Could not archive past events: {e}", file=sys.stderr)
+            return
+        if moved:
+            print(f"Info: Archived {moved} past events.", file=sys.stderr)
+
+    @perf_stats.timed_function("ui.refresh_event_list")
     def refresh_event_list(self):
         self.event_list.clear()
-        selected_qdate = self.calendar.selectedDate()
-        selected_date_str = selected_qdate.toString(DATE_FORMAT)
-        events_on_date = []
-        for event in self.data_manager.events:
-            if event.get('date') == selected_date_str:
-                events_on_date.append(event)
-        def sort_key(evt):
-            time_str = evt.get('time', '')
-            if not time_str: return "00:00" # Sort all-day events first or as specified
-            try:
-                # Ensure consistent parsing for sorting
-                return QTime.fromString(time_str, TIME_FORMAT).toString("HH:mm")
-            except: # Fallback for any unexpected time format
-                return "99:99" 
-        events_on_date.sort(key=sort_key)
-        for event in events_on_date:
-            time_display = event.get('time', "All Day")
-            list_text = f"{time_display} - {event.get('title', 'No Title')}"
-            item = QListWidgetItem(list_text)
-            item.setData(USER_ROLE, event.get('id'))
-            item.setToolTip(event.get('description', 'No description.'))
-            self.event_list.addItem(item)
+        selected_ordinal = self.calendar.selectedDate().toJulianDay() - JULIAN_DAY_OF_ORDINAL_0
+        # Multi-day events are listed on every day they cover
+        if self._tag_filter_active():
+            visible_tags = [tag for tag in self.data_manager.tag_counts() if tag_key(tag) not in self._hidden_tags]
+            events_on_date = self.data_manager.events_on_day(selected_ordinal, visible_tags,
+                                                             include_untagged=not self._hide_untagged)
+        else:
+            events_on_date = self.data_manager.events_on_day(selected_ordinal)
+        archived_ids = set()
+        if selected_ordinal < self.data_manager.archived_before():
+            # Shown once the archive has been read; this refresh runs again then
+            self._load_shard_in_background(ARCHIVE_KEY)
+            shown_ids = {event.get('id') for event in events_on_date}
+            for event in self.data_manager.archived_events_on(selected_ordinal):
+                if event.get('id') not in shown_ids and self._passes_tag_filter(event):
+                    archived_ids.add(event.get('id'))
+                    events_on_date.append(event)
+        events_on_date.sort(key=event_sort_key) # All-day events first, then by time
+        # Overlay results come sorted from their indexes; merging keeps the order without a re-sort
+        merged = merge_sorted([(None, events_on_date)] +
+                              self.overlays.day_streams(selected_ordinal, self._hidden_tags, self._hide_untagged))
+        default_zone = self.data_manager.default_time_zone()
+        for event, source in merged:
+            archived = source is None and event.get('id') in archived_ids
+            self.event_list.addItem(self._event_item(event, default_zone, source, archived))
+
+    def _event_item(self, event, default_zone, source=None, archived=False) -> QListWidgetItem:
+        """Builds the day-view item of an event (source is its OverlaySource, None for this calendar)."""
+        time_display = event.get('time', "All Day")
+        list_text = f"{time_display} - {event.get('title', 'No Title')}"
+        if event.get('end_ordinal') and event['end_ordinal'] > event['date_ordinal']:
+            list_text += f" ({event.get('date')} to {event.get('end_date')})"
+        if event.get('time') and event.get('tz') and event['tz'] != default_zone:
+            list_text += f" ({event['tz']})"
+        if archived:
+            list_text += " (archived)"
+        tooltip = event.get('description', 'No description.')
+        if source is not None:
+            list_text = f"[{source.name}] {list_text}"
+            tooltip = f"{tooltip}\n(read-only, from {source.path})"
+        item = QListWidgetItem(list_text)
+        item.setData(USER_ROLE, event.get('id'))
+        item.setData(SORT_ROLE, event_sort_key(event))
+        item.setToolTip(tooltip)
+        if source is not None:
+            item.setData(OVERLAY_ROLE, source.path)
+            item.setForeground(QColor(source.color))
+        return item
+
+    def _on_data_changed(self, change) -> None:
+        """Updates the view for a Change published by the DataManager."""
+        self.upcoming.apply_change(change)
+        self._refresh_upcoming()
+        if change.kind == SETTINGS_CHANGED:
+            if change.fields & {'style_name', 'accent_color'}: # Also saves made by another process
+                self.apply_theme(self.data_manager.settings.get('style_name', DEFAULT_STYLE),
+                                 self.data_manager.settings.get('accent_color', DEFAULT_ACCENT_COLOR), save_settings=False)
+            if 'time_zone' in change.fields:
+                self.refresh_event_list()
+            return
+        changes = change.changes if change.kind == EVENTS_BULK else (change,)
+        if changes is None or len(changes) > MAX_INCREMENTAL_CHANGES:
+            self.refresh_event_list()
+            return
+        for event_change in changes:
+            self._apply_event_change(event_change.event_id, event_change.new)
+
+    @perf_stats.timed_function("ui.apply_event_change")
+    def _apply_event_change(self, event_id, new_event) -> None:
+        """Removes an event's item from the day view and inserts its new version if it belongs there."""
+        for row in range(self.event_list.count() - 1, -1, -1):
+            item = self.event_list.item(row)
+            if item.data(USER_ROLE) == event_id and not item.data(OVERLAY_ROLE):
+                self.event_list.takeItem(row)
+        if new_event is None:
+            return
+        selected_ordinal = self.calendar.selectedDate().toJulianDay() - JULIAN_DAY_OF_ORDINAL_0
+        first = new_event.get('date_ordinal')
+        if first is None or not first <= selected_ordinal <= (new_event.get('end_ordinal') or first):
+            return
+        if not self._passes_tag_filter(new_event):
+            return
+        # Same order as refresh_event_list: by event_sort_key, this calendar's events before overlay ones
+        key = (event_sort_key(new_event), False)
+        low, high = 0, self.event_list.count()
+        while low < high:
+            middle = (low + high) // 2
+            item = self.event_list.item(middle)
+            if key < (item.data(SORT_ROLE), bool(item.data(OVERLAY_ROLE))):
+                high = middle
+            else:
+                low = middle + 1
+        self.event_list.insertItem(low, self._event_item(new_event, self.data_manager.default_time_zone()))
+
+    # --- Upcoming events (tray menu and panel) ---
+
+    def _advance_upcoming(self) -> None:
+        self.upcoming.advance()
+        self._refresh_upcoming()
+
+    @perf_stats.timed_function("ui.refresh_upcoming")
+    def _refresh_upcoming(self) -> None:
+        """Relists the first upcoming events in the panel and the tray tooltip."""
+        entries = self.upcoming.upcoming(self.data_manager.settings.get('upcoming_count', DEFAULT_UPCOMING_COUNT))
+        labels = [describe(entry) for entry in entries]
+        self.upcoming_list.clear()
+        for entry, label in zip(entries, labels):
+            item = QListWidgetItem(label)
+            item.setData(USER_ROLE, self._upcoming_day(entry))
+            item.setToolTip(entry.event.get('description', 'No description.'))
+            self.upcoming_list.addItem(item)
+        if not entries:
+            self.upcoming_list.addItem(f"No events in the next {self.upcoming.days} days")
+        if self.tray:
+            self.tray.setToolTip(f"bToDo - next: {labels[0]}" if labels else "bToDo - no upcoming events")
+
+    def _upcoming_day(self, entry) -> int:
+        """Date ordinal to show for an entry: its first day, or today if it is under way."""
+        return max(entry.event.get('date_ordinal') or 0, datetime.date.today().toordinal())
+
+    def _populate_tray_menu(self) -> None:
+        self.tray_menu.clear()
+        entries = self.upcoming.upcoming(self.data_manager.settings.get('upcoming_count', DEFAULT_UPCOMING_COUNT))
+        for entry in entries:
+            action = self.tray_menu.addAction(describe(entry))
+            action.triggered.connect(lambda _=False, ordinal=self._upcoming_day(entry): self._show_day(ordinal))
+        if not entries:
+            self.tray_menu.addAction(f"No events in the next {self.upcoming.days} days").setEnabled(False)
+        self.tray_menu.addSeparator()
+        self.tray_menu.addAction("Show bToDo").triggered.connect(lambda: self._show_day(None))
+        self.tray_menu.addAction("Quit").triggered.connect(self.close)
+
+    def _on_tray_activated(self, reason) -> None:
+        if reason == QSystemTrayIcon.ActivationReason.Trigger:
+            self._show_day(None)
+
+    def _show_day(self, ordinal: Optional[int]) -> None:
+        """Brings the window to the front, showing the day view of a date ordinal if given."""
+        if self.isMinimized():
+            self.showNormal()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        if ordinal:
+            self.calendar.setSelectedDate(QDate.fromJulianDay(ordinal + JULIAN_DAY_OF_ORDINAL_0))
+
+    def _on_upcoming_panel_toggled(self, visible: bool) -> None:
+        if bool(self.data_manager.settings.get('upcoming_panel', False)) != visible:
+            self.data_manager.settings['upcoming_panel'] = visible
+            self.data_manager.save_settings()
+
+    # --- Overlay calendars ---
+
+    def _is_overlay_item(self, item, title):
+        """Tells the user overlay events cannot be changed; True if item is one."""
+        path = item.data(OVERLAY_ROLE)
+        if not path:
+            return False
+        source = self.overlays.get(path)
+        name = source.name if source else os.path.basename(path)
+        QMessageBox.information(self, title, f"This event belongs to the overlay calendar '{name}', which is read-only.")
+        return True
+
+    def _restore_overlays(self):
+        """Reopens the overlays listed in the settings (in the background)."""
+        for entry in self.data_manager.settings.get('overlays') or []:
+            if isinstance(entry, dict) and entry.get('path'):
+                self._load_overlay(entry['path'], entry.get('color') or self.overlays.next_color(),
+                                   entry.get('visible', True), interactive=False)
+
+    def open_overlay(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open Overlay Calendar", os.path.dirname(os.path.abspath(self.data_manager.data_file)),
+                                              "bToDo Calendars (*.enc);;All Files (*)")
+        if not path: return
+        if os.path.abspath(path) == os.path.abspath(self.data_manager.data_file):
+            QMessageBox.information(self, "Open Overlay Calendar", "That is the calendar already open for editing.")
+            return
+        if path in self.overlays or os.path.abspath(path) in self._pending_overlays:
+            QMessageBox.information(self, "Open Overlay Calendar", "That calendar is already shown as an overlay.")
+            return
+        self._load_overlay(path, self.overlays.next_color(), True, interactive=True)
+
+    def _load_overlay(self, path, color, visible, interactive):
+        path = os.path.abspath(path)
+        if path in self._pending_overlays or path in self.overlays:
+            return
+        self._pending_overlays[path] = {"path": path, "color": color, "visible": visible, "interactive": interactive}
+        self._shard_executor.submit(self._read_overlay_in_background, path)
+
+    def _read_overlay_in_background(self, path: str) -> None:
+        """Runs on the loader thread: decrypts, sorts and indexes the file, then hands it back."""
+        try:
+            entry = self._pending_overlays[path]
+            events = self.data_manager.read_calendar_file(path)
+            result = OverlaySource(path, events, entry['color'], entry['visible'])
+        except Exception as e:
+            print(f"Warning: Failed to open overlay calendar '{path}': {e}", file=sys.stderr)
+            result = e
+        self.overlay_loaded.emit(path, result)
+
+    def _on_overlay_loaded(self, path: str, result) -> None:
+        entry = self._pending_overlays.pop(path, None)
+        if entry is None:
+            return
+        if not isinstance(result, OverlaySource):
+            if entry['interactive']:
+                QMessageBox.warning(self, "Open Overlay Calendar", f"Could not open '{path}':\n{result}")
+            return
+        self.overlays.add(result)
+        if entry['interactive']:
+            self._save_overlay_settings()
+        if result.visible:
+            self.refresh_event_list()
+
+    def _save_overlay_settings(self):
+        pending = [{key: entry[key] for key in ("path", "color", "visible")} for entry in self._pending_overlays.values()]
+        self.data_manager.settings['overlays'] = self.overlays.to_settings() + pending
+        self.data_manager.save_settings()
+
+    def _populate_calendars_menu(self):
+        """Rebuilds the Calendars menu: one submenu per overlay with visibility, color and close."""
+        self.calendars_menu.clear()
+        self.calendars_menu.addAction(self.open_overlay_action)
+        self.calendars_menu.addSeparator()
+        if not len(self.overlays) and not self._pending_overlays:
+            self.calendars_menu.addAction("No overlays open").setEnabled(False)
+        for source in self.overlays:
+            swatch = QPixmap(OVERLAY_SWATCH_SIZE, OVERLAY_SWATCH_SIZE)
+            swatch.fill(QColor(source.color))
+            submenu = self.calendars_menu.addMenu(QIcon(swatch), f"{source.name} ({len(source)} events)")
+            submenu.setToolTip(source.path)
+            visible_action = submenu.addAction("Visible")
+            visible_action.setCheckable(True)
+            visible_action.setChecked(source.visible)
+            visible_action.toggled.connect(lambda checked, path=source.path: self._set_overlay_visible(path, checked))
+            submenu.addAction("Color...").triggered.connect(lambda _=False, path=source.path: self._choose_overlay_color(path))
+            submenu.addAction("Close").triggered.connect(lambda _=False, path=source.path: self._close_overlay(path))
+        for path in self._pending_overlays:
+            self.calendars_menu.addAction(f"{os.path.basename(path)} (loading...)").setEnabled(False)
+
+    def _set_overlay_visible(self, path, visible):
+        source = self.overlays.get(path)
+        if source is None or source.visible == visible: return
+        source.visible = visible
+        self._save_overlay_settings()
+        self.refresh_event_list()
+
+    def _choose_overlay_color(self, path):
+        source = self.overlays.get(path)
+        if source is None: return
+        color = QColorDialog.getColor(QColor(source.color), self, f"Color for {source.name}")
+        if not color.isValid(): return
+        source.color = color.name()
+        self._save_overlay_settings()
+        self.refresh_event_list()
+
+    def _close_overlay(self, path):
+        if self.overlays.remove(path) is None: return
+        self._save_overlay_settings()
+        self.refresh_event_list()
+
+    # --- Tag filter ---
+
+    def _tag_filter_active(self):
+        return bool(self._hidden_tags) or self._hide_untagged
+
+    def _passes_tag_filter(self, event):
+        """Same rule as DataManager.events_on_day, for events outside its index (archived ones)."""
+        tags = event.get('tags')
+        if not tags:
+            return not self._hide_untagged
+        return any(tag_key(tag) not in self._hidden_tags for tag in tags)
+
+    def _populate_tags_menu(self):
+        """Rebuilds the Tags menu from the tags of the loaded events."""
+        self.tags_menu.clear()
+        counts = self.data_manager.tag_counts()
+        live_names = {tag_key(tag): tag for tag in counts}
+        for key, (name, count) in self.overlays.tag_counts().items():
+            name = live_names.get(key, name)
+            counts[name] = counts.get(name, 0) + count
+        for tag in sorted(counts, key=tag_key):
+            action = self.tags_menu.addAction(f"{tag} ({counts[tag]})")
+            action.setCheckable(True)
+            action.setChecked(tag_key(tag) not in self._hidden_tags)
+            action.toggled.connect(lambda checked, key=tag_key(tag): self._set_tag_visible(key, checked))
+        untagged_action = self.tags_menu.addAction("Untagged")
+        untagged_action.setCheckable(True)
+        untagged_action.setChecked(not self._hide_untagged)
+        untagged_action.toggled.connect(self._set_untagged_visible)
+        self.tags_menu.addSeparator()
+        show_all_action = self.tags_menu.addAction("Show All")
+        show_all_action.setEnabled(self._tag_filter_active())
+        show_all_action.triggered.connect(self._clear_tag_filter)
+
+    def _set_tag_visible(self, key, visible):
+        if visible: self._hidden_tags.discard(key)
+        else: self._hidden_tags.add(key)
+        self._on_tag_filter_changed()
+
+    def _set_untagged_visible(self, visible):
+        self._hide_untagged = not visible
+        self._on_tag_filter_changed()
+
+    def _clear_tag_filter(self):
+        self._hidden_tags.clear()
+        self._hide_untagged = False
+        self._on_tag_filter_changed()
+
+    def _on_tag_filter_changed(self):
+        self.tags_btn.setText(" Tags (filtered)" if self._tag_filter_active() else " Tags")
+        self.refresh_event_list()
+
+    @perf_stats.timed_function("ui.prepare_event_dialog")
+    def _prepare_event_dialog(self, event_data=None) -> EventDialog:
+        """Returns the reusable event dialog, reset for event_data or for a new event on the selected day."""
+        if self._event_dialog is None:
+            self._event_dialog = EventDialog(self, data_manager=self.data_manager)
+        self._event_dialog.reset(event_data, self.calendar.selectedDate())
+        return self._event_dialog
 
     def add_event(self):
-        dialog = EventDialog(self)
-        selected_qdate = self.calendar.selectedDate()
-        dialog.date_edit.setDate(selected_qdate)
+        dialog = self._prepare_event_dialog()
         if dialog.exec() == QDialog.DialogCode.Accepted:
             new_event = dialog.get_event_data()
             if not new_event.get('title'):
@@ -775,8 +1546,7 @@ class MainWindow(QMainWindow):
             new_event['id'] = str(uuid.uuid4()) # Ensure new ID
             try:
                 self.data_manager.add_event(new_event)
-                self.refresh_event_list()
-                if self.notification_manager: self.notification_manager.schedule_notifications()
+                self._update_undo_actions()
             except Exception as e: QMessageBox.critical(self, "Error", f"Failed to add event:\n{e}")
 
     def edit_event(self):
@@ -784,16 +1554,17 @@ class MainWindow(QMainWindow):
         if not item:
              QMessageBox.information(self, "Edit Event", "Please select an event to edit.")
              return
+        if self._is_overlay_item(item, "Edit Event"): return
         event_id = item.data(USER_ROLE)
         if not event_id: return
 
-        event_data = self.data_manager.get_event_by_id(event_id)
+        event_data = self.data_manager.find_event(event_id)
         if not event_data:
             QMessageBox.warning(self, "Error", f"Could not find event data for ID: {event_id}")
             self.refresh_event_list() # Refresh list, event might have been deleted elsewhere
             return
 
-        dialog = EventDialog(self, event_data)
+        dialog = self._prepare_event_dialog(event_data)
         if dialog.exec() == QDialog.DialogCode.Accepted:
             updated_event = dialog.get_event_data()
             if not updated_event.get('title'):
@@ -802,8 +1573,7 @@ class MainWindow(QMainWindow):
             updated_event['id'] = event_id # Preserve existing ID
             try:
                 self.data_manager.update_event(event_id, updated_event)
-                self.refresh_event_list()
-                if self.notification_manager: self.notification_manager.schedule_notifications()
+                self._update_undo_actions()
             except Exception as e: QMessageBox.critical(self, "Error", f"Failed to update event:\n{e}")
 
     def delete_event(self):
@@ -811,11 +1581,12 @@ class MainWindow(QMainWindow):
         if not item:
             QMessageBox.information(self, "Delete Event", "Please select an event to delete.")
             return
+        if self._is_overlay_item(item, "Delete Event"): return
         event_id = item.data(USER_ROLE)
         if not event_id: return
 
         event_title = "this event" # Fallback title
-        ev_data = self.data_manager.get_event_by_id(event_id)
+        ev_data = self.data_manager.find_event(event_id)
         if ev_data: event_title = ev_data.get('title', event_title)
 
 
@@ -826,13 +1597,72 @@ class MainWindow(QMainWindow):
             try:
                 deleted = self.data_manager.delete_event(event_id)
                 if deleted:
-                    self.refresh_event_list()
-                    if self.notification_manager: self.notification_manager.schedule_notifications()
+                    self._update_undo_actions()
                 else:
-                    # This case should ideally not be hit if get_event_by_id worked before
+                    # This case should ideally not be hit if find_event worked before
                     QMessageBox.warning(self, "Delete Error", f"Event ID {event_id} not found for deletion.")
             except Exception as e: QMessageBox.critical(self, "Error", f"Failed to delete event:\n{e}")
 
+    def _flush_changes(self) -> None:
+        """Writes changes held back by group commit."""
+        self._group_commit_timer.stop()
+        try:
+            self.data_manager.flush()
+        except Exception as e:
+            print(f"Error: Failed to save pending changes: {e}", file=sys.stderr)
+
+    def _update_undo_actions(self) -> None:
+        """Enables Undo/Redo and names the change each would apply.
+
+        Runs after every change, so it also arms the group-commit flush.
+        """
+        due = self.data_manager.commit_due_in()
+        if due is not None and not self._group_commit_timer.isActive():
+            self._group_commit_timer.start(int(due * 1000))
+        undo_label = self.data_manager.undo_label()
+        redo_label = self.data_manager.redo_label()
+        self.undo_action.setEnabled(undo_label is not None)
+        self.undo_action.setText(f"&Undo {undo_label}" if undo_label else "&Undo")
+        self.redo_action.setEnabled(redo_label is not None)
+        self.redo_action.setText(f"&Redo {redo_label}" if redo_label else "&Redo")
+
+    def undo(self) -> None:
+        try:
+            self.data_manager.undo()
+        except Exception as e: QMessageBox.critical(self, "Undo Failed", f"Could not undo the last change:\n{e}")
+        self._update_undo_actions()
+
+    def redo(self) -> None:
+        try:
+            self.data_manager.redo()
+        except Exception as e: QMessageBox.critical(self, "Redo Failed", f"Could not redo the change:\n{e}")
+        self._update_undo_actions()
+
+    def find_events(self) -> None:
+        """Searches titles and descriptions, archive included, and jumps to the chosen event's date."""
+        text, ok = QInputDialog.getText(self, "Find Events", "Find events containing:")
+        if not ok or not text.strip():
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            matches = self.data_manager.search_events(text.strip())
+        except Exception as e:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Find Failed", f"Could not search events:\n{e}")
+            return
+        QApplication.restoreOverrideCursor()
+        matches = [ev for ev in matches if ev.get('date_ordinal')]
+        if not matches:
+            QMessageBox.information(self, "Find Events", f"No events contain '{text.strip()}'.")
+            return
+        labels = [f"{ev.get('date', '')} {ev.get('time') or 'All Day'} - {ev.get('title', 'No Title')}" for ev in matches]
+        choice, ok = QInputDialog.getItem(self, "Find Events", f"{len(matches)} matching events:", labels, 0, False)
+        if not ok:
+            return
+        chosen = matches[labels.index(choice)]
+        # Day view of the chosen date (ordinal -> Julian day, as in refresh_event_list)
+        self.calendar.setSelectedDate(QDate.fromJulianDay(chosen['date_ordinal'] + JULIAN_DAY_OF_ORDINAL_0))
+
     def backup_data(self):
         default_filename = f"britton_calendar_backup_{datetime.date.today().strftime('%Y%m%d')}.enc"
         file_path, _ = QFileDialog.getSaveFileName(self, "Backup Calendar Data", default_filename,
@@ -843,29 +1673,198 @@ class MainWindow(QMainWindow):
                 QMessageBox.information(self, "Backup Successful", f"Data backed up to:\n{file_path}")
             except Exception as e: QMessageBox.critical(self, "Backup Failed", f"Could not backup data:\n{e}")
 
+    def _choose_snapshot_repo(self, ask=False) -> Optional[str]:
+        """Returns the snapshot repository folder, asking for one if none is set."""
+        repo_path = self.data_manager.settings.get('snapshot_repo')
+        if ask or not repo_path:
+            repo_path = QFileDialog.getExistingDirectory(self, "Select Snapshot Repository Folder", repo_path or "")
+            if not repo_path: return None
+            self.data_manager.settings['snapshot_repo'] = repo_path
+        return repo_path
+
+    def snapshot_backup(self):
+        repo_path = self._choose_snapshot_repo()
+        if not repo_path: return
+        try:
+            snapshot_id = self.data_manager.snapshot_backup(repo_path)
+            QMessageBox.information(self, "Snapshot Successful", f"Snapshot {snapshot_id} stored in:\n{repo_path}")
+        except Exception as e: QMessageBox.critical(self, "Snapshot Failed", f"Could not create snapshot:\n{e}")
+
+    def restore_snapshot(self):
+        repo_path = self._choose_snapshot_repo(ask=True)
+        if not repo_path: return
+        try:
+            from backup_repository import BackupRepository
+            snapshots = BackupRepository(repo_path, self.data_manager).list_snapshots()
+        except Exception as e:
+            QMessageBox.critical(self, "Restore Failed", f"Could not open snapshot repository:\n{e}")
+            return
+        if not snapshots:
+            QMessageBox.information(self, "Restore Snapshot", "The repository contains no snapshots.")
+            return
+        snapshot_id, ok = QInputDialog.getItem(self, "Restore Snapshot", "Restore calendar to snapshot:",
+                                               list(reversed(snapshots)), 0, False)
+        if not ok or not snapshot_id: return
+        reply = QMessageBox.question(self, "Restore Snapshot",
+                                     f"Replace all current events with snapshot {snapshot_id}?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes: return
+        try:
+            self.data_manager.restore_snapshot(repo_path, snapshot_id)
+            self._update_undo_actions()
+            QMessageBox.information(self, "Restore Successful", f"Calendar restored to snapshot {snapshot_id}.")
+        except Exception as e: QMessageBox.critical(self, "Restore Failed", f"Could not restore snapshot:\n{e}")
+
+    def verify_snapshots(self):
+        repo_path = self._choose_snapshot_repo(ask=True)
+        if not repo_path: return
+        try:
+            from backup_repository import BackupRepository
+            problems = BackupRepository(repo_path, self.data_manager).verify()
+        except Exception as e:
+            QMessageBox.critical(self, "Verify Failed", f"Could not verify snapshots:\n{e}")
+            return
+        if problems:
+            QMessageBox.warning(self, "Snapshot Problems", "\n".join(problems[:20]))
+        else:
+            QMessageBox.information(self, "Verify Snapshots", "All snapshots are intact.")
+
     def export_to_ics(self):
         default_filename = f"britton_calendar_export_{datetime.date.today().strftime('%Y%m%d')}.ics"
         file_path, _ = QFileDialog.getSaveFileName(self, "Export Calendar to iCal", default_filename,
                                                    "iCalendar Files (*.ics);;All Files (*)")
         if file_path:
             try:
-                self.data_manager.export_to_ics(file_path)
+                exported_seq = self.data_manager.export_to_ics(file_path)
+                self._record_export_seq(exported_seq)
                 QMessageBox.information(self, "Export Successful", f"Data exported to:\n{file_path}")
             except NotImplementedError: # Should be handled by DataManager if it still raises this
                  QMessageBox.warning(self, "Export Not Implemented", "iCalendar export failed (not fully implemented).")
             except Exception as e: QMessageBox.critical(self, "Export Failed", f"Could not export data to iCal:\n{e}")
 
+    def export_changes_to_ics(self):
+        """Exports only the events added, changed or deleted since the last export."""
+        since_seq = self.data_manager.settings.get('last_export_seq')
+        if since_seq is None:
+            QMessageBox.information(self, "Export Changes", "No previous export found; exporting the full calendar.")
+            self.export_to_ics()
+            return
+        default_filename = f"britton_calendar_changes_{datetime.date.today().strftime('%Y%m%d')}.ics"
+        file_path, _ = QFileDialog.getSaveFileName(self, "Export Calendar Changes to iCal", default_filename,
+                                                   "iCalendar Files (*.ics);;All Files (*)")
+        if file_path:
+            try:
+                exported_seq = self.data_manager.export_to_ics(file_path, since_seq=since_seq)
+                self._record_export_seq(exported_seq)
+                QMessageBox.information(self, "Export Successful", f"Changes exported to:\n{file_path}")
+            except Exception as e: QMessageBox.critical(self, "Export Failed", f"Could not export changes to iCal:\n{e}")
+
+    def _record_export_seq(self, exported_seq):
+        """Remembers the change sequence of the last export for the next delta export."""
+        self.data_manager.settings['last_export_seq'] = exported_seq
+        try:
+            self.data_manager.save_settings()
+        except Exception as e:
+            print(f"Warning: Could not record export sequence: {e}", file=sys.stderr)
+
     def open_settings(self):
         current_style = self.data_manager.settings.get('style_name', DEFAULT_STYLE)
         current_accent = self.data_manager.settings.get('accent_color', DEFAULT_ACCENT_COLOR)
-        settings_dialog = SettingsDialog(self, current_style, current_accent)
+        current_archive_months = self.data_manager.settings.get('archive_after_months', DEFAULT_ARCHIVE_AFTER_MONTHS)
+        current_time_zone = self.data_manager.settings.get('time_zone', "")
+        settings_dialog = SettingsDialog(self, current_style, current_accent, current_archive_months, current_time_zone,
+                                         self.data_manager.durability_mode())
         if settings_dialog.exec() == QDialog.DialogCode.Accepted:
             new_settings = settings_dialog.get_settings()
+            archive_changed = new_settings['archive_after_months'] != current_archive_months
+            self.data_manager.settings['archive_after_months'] = new_settings['archive_after_months']
+            self.data_manager.settings['time_zone'] = new_settings['time_zone']
+            self.data_manager.settings['durability'] = new_settings['durability']
+            self._flush_changes() # Changes held back under the old mode are written now
             self.apply_theme(new_settings['style_name'], new_settings['accent_color'], save_settings=True)
+            if archive_changed:
+                self._archive_old_events()
+
+    def change_passphrase(self):
+        if self._rekey_job:
+            QMessageBox.information(self, "Change Passphrase", "A passphrase change is still in progress.")
+            return
+        if self.data_manager.rekey_in_progress(): # A change that stopped on a file: try it again
+            self._resume_passphrase_change()
+            return
+        dialog = PassphraseDialog(self, self.data_manager.has_user_passphrase())
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        self._flush_changes()
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor) # Derives the new key
+        try:
+            job = self.data_manager.begin_passphrase_change(dialog.get_passphrase(), dialog.get_backup_paths())
+        except Exception as e:
+            QMessageBox.critical(self, "Change Passphrase", f"Could not change the passphrase:\n{e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+        self._start_rekey_job(job)
+
+    def _resume_passphrase_change(self):
+        job = self.data_manager.resume_passphrase_change()
+        if job:
+            print("Info: Resuming an interrupted passphrase change.", file=sys.stderr)
+            self._start_rekey_job(job)
+
+    def _start_rekey_job(self, job, action_text="Re-encrypting data with the new passphrase",
+                         done_text="Passphrase changed."):
+        """Re-encrypts the files on the passphrase change thread; the calendar stays usable meanwhile."""
+        self._rekey_job = job
+        self._rekey_action_text, self._rekey_done_text = action_text, done_text
+        self.passphrase_action.setEnabled(False)
+        self.snapshot_action.setEnabled(False)
+        self.restore_snapshot_action.setEnabled(False)
+        self._on_rekey_progress(job.total() - job.remaining(), job.total())
+        self._rekey_executor.submit(self._run_rekey_in_background, job)
+
+    def _run_rekey_in_background(self, job):
+        """Runs on the passphrase change thread; results go back through signals."""
+        try:
+            job.run(lambda done, total: self.rekey_progress.emit(done, total))
+        except Exception as e:
+            print(f"Error: Passphrase change stopped: {e}", file=sys.stderr)
+            job.problems.append(str(e))
+        self.rekey_finished.emit(job)
+
+    def _on_rekey_progress(self, done, total):
+        self.statusBar().showMessage(f"{self._rekey_action_text}: {done} of {total} files...")
+
+    def _on_rekey_finished(self, job):
+        self._rekey_job = None
+        self.passphrase_action.setEnabled(True)
+        self.snapshot_action.setEnabled(True)
+        self.restore_snapshot_action.setEnabled(True)
+        self.statusBar().clearMessage()
+        if self.data_manager.rekey_in_progress():
+            if job.problems:
+                QMessageBox.warning(self, "Change Passphrase",
+                                    "The passphrase change is unfinished; it is retried the next time bToDo starts "
+                                    "or from Settings > Change Passphrase.\n\n"
+                                    + "\n".join(job.problems[:10]))
+        elif job.problems:
+            QMessageBox.warning(self, "Change Passphrase", "Passphrase changed, but some backup files could not be "
+                                "re-encrypted and keep the old passphrase:\n\n" + "\n".join(job.problems[:10]))
+        else:
+            self.statusBar().showMessage(self._rekey_done_text, 5000)
 
     def closeEvent(self, event: QCloseEvent):
         print("Closing bToDo.")
-        # Potentially add cleanup here if needed before app closes
+        self._closing = True
+        if self._rekey_job:
+            self._rekey_job.stop() # The journal lets the next start finish the change
+        self._rekey_executor.shutdown(wait=True)
+        self._flush_changes()
+        self._upcoming_timer.stop()
+        if self.tray:
+            self.tray.hide()
+        self._shard_executor.shutdown(wait=False)
         event.accept()
 
 # --- Main Execution Guard (for testing) ---
@@ -874,24 +1873,54 @@ if __name__ == '__main__':
     # In the actual application, DataManager and NotificationManager are instantiated in main.py.
     class MockDataManager:
         def __init__(self):
-            self.events = [
+            self.events = [normalize_event(ev) for ev in [
                 {'id': '1', 'title': 'Test Event 1', 'date': QDate.currentDate().toString(DATE_FORMAT), 'time': '10:00 AM', 'description': 'Desc 1', 'notify': True, 'notify_minutes': 15, 'notify_time': (datetime.datetime.now() - datetime.timedelta(minutes=10)).isoformat(), 'attachments': []},
                 {'id': '2', 'title': 'Test Event 2 All Day', 'date': QDate.currentDate().toString(DATE_FORMAT), 'time': '', 'description': 'All day event test', 'notify': False, 'attachments': []}
-            ]
+            ]]
             self.settings = {'style_name': DEFAULT_STYLE, 'accent_color': DEFAULT_ACCENT_COLOR}
+            self.data_file = "mock_data.enc"
+            self.changes = ChangeBus()
         def get_event_by_id(self, event_id): return next((e for e in self.events if e['id'] == event_id), None)
-        def add_event(self, event): event['id'] = str(uuid.uuid4()); self.events.append(event); print(f"Mock Add: {event['title']}")
+        def find_event(self, event_id): return self.get_event_by_id(event_id)
+        def search_events(self, text): return [e for e in self.events if text.lower() in e['title'].lower()]
+        def archived_before(self): return 0
+        def archived_events_on(self, ordinal): return []
+        def is_archive_loaded(self): return True
+        def archive_old_events(self): return 0
+        def overlapping_events(self, start, end, exclude_id=None): return []
+        def find_free_slot(self, start, end, duration_minutes, day_start=None, day_end=None): return None
+        def tag_counts(self): return {}
+        def default_time_zone(self): return timezones.local_zone_name()
+        def events_on_day(self, ordinal, tags=None, include_untagged=True):
+            return [ev for ev in self.events if ev.get('date_ordinal') == ordinal]
+        def add_event(self, event): event['id'] = str(uuid.uuid4()); self.events.append(normalize_event(event)); print(f"Mock Add: {event['title']}")
         def update_event(self, event_id, event_data): print(f"Mock Update: {event_data['title']}"); return True
         def delete_event(self, event_id): print(f"Mock Delete ID: {event_id}"); return True
         def save_to_file(self): print("Mock Save Settings/Events")
+        def durability_mode(self): return DEFAULT_DURABILITY
+        def commit_due_in(self): return None
+        def flush(self): return False
+        def save_settings(self): print("Mock Save Settings")
         def backup_to_file(self, path): print(f"Mock Backup to {path}")
-        def export_to_ics(self, path): print(f"Mock Export to {path}")
+        def read_calendar_file(self, path): return []
+        def export_to_ics(self, path, since_seq=None): print(f"Mock Export to {path}"); return 0
+        def shards_for_range(self, start, end): return []
+        def reload_if_changed(self): return False
+        def recommended_kdf_iterations(self, target_seconds): return None
+        def rekey_kdf(self, iterations): return {}
+        def begin_rekey(self, new_kdf): raise RuntimeError("Mock: no re-key")
+        def has_user_passphrase(self): return False
+        def rekey_in_progress(self): return False
+        def begin_passphrase_change(self, new_passphrase, backup_paths=()): raise RuntimeError("Mock: no passphrase change")
+        def undo_label(self): return None
+        def redo_label(self): return None
+        def undo(self): return None
+        def redo(self): return None
 
     class MockNotificationManager:
         def __init__(self, data_manager):
             self.data_manager = data_manager # Keep a reference if needed
             print("MockNotificationManager Initialized")
-        def schedule_notifications(self): print("Mock Schedule Notifications Called")
         def check_notifications(self): print("Mock Check Notifications Called")
 
 
@@ -0,0 +1,166 @@
+# File: memory_report.py
+# bToDo - Memory accounting by component
+# Date: 2026-10-18
+#
+# Breaks memory down into events, attachments, indexes, caches and Qt items
+# so a large footprint can be pinned to a subsystem, and wraps tracemalloc
+# so growth between two points in a long session can be diffed by file.
+# Qt-free; the GUI adds its own estimates through extra_components.
+
+import gc
+import sys
+import tracemalloc
+
+try:
+    import resource # Unix only
+except ImportError:
+    resource = None
+
+# DataManager attributes counted as indexes / caches (missing ones are skipped)
+INDEX_ATTRIBUTES = ("shards", "tombstones", "_loaded_shards", "_dirty_shards", "_unsynced", "_archive_by_date",
+                    "_bitmap_index")
+CACHE_ATTRIBUTES = ("_derived_keys", "_interval_index")
+TRACEMALLOC_FRAMES = 1
+
+_baseline = None # Snapshot later ones are compared against
+
+
+def deep_sizeof(obj, seen=None):
+    """Returns the size of obj plus everything it references through containers."""
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__') and not isinstance(item, type):
+            stack.append(vars(item)) # Plain index objects such as IntervalIndex
+    return size
+
+
+def _attachment_strings(events):
+    for ev in events:
+        for att in ev.get('attachments') or ():
+            if isinstance(att, dict) and isinstance(att.get('data'), str):
+                yield att['data']
+
+
+def component_report(data_manager, extra_components=None):
+    """Returns {component: {"bytes": n, "count": n}} plus a "process" entry.
+
+    Attachment strings are counted under attachments only, not events.
+    Archived events (once the archive is loaded) are counted under archive.
+    extra_components ({name: (bytes, count)}) lets callers add estimates
+    for memory Python cannot see, such as Qt items and pixmaps.
+    """
+    events = data_manager.events
+    seen = set()
+    attachment_bytes = 0
+    attachment_count = 0
+    for data in _attachment_strings(events):
+        if id(data) not in seen:
+            seen.add(id(data))
+            attachment_bytes += sys.getsizeof(data)
+        attachment_count += 1
+    report = {
+        "events": {"bytes": deep_sizeof(events, seen), "count": len(events)},
+        "attachments": {"bytes": attachment_bytes, "count": attachment_count},
+    }
+    archive = getattr(data_manager, '_archive', None) or []
+    report["archive"] = {"bytes": deep_sizeof(archive, seen), "count": len(archive)}
+    for name, attributes in (("indexes", INDEX_ATTRIBUTES), ("caches", CACHE_ATTRIBUTES)):
+        values = [getattr(data_manager, attr) for attr in attributes if hasattr(data_manager, attr)]
+        report[name] = {"bytes": sum(deep_sizeof(value, seen) for value in values),
+                        "count": sum(len(value) for value in values if hasattr(value, '__len__'))}
+    for name, (nbytes, count) in (extra_components or {}).items():
+        report[name] = {"bytes": int(nbytes), "count": int(count)}
+    report["process"] = process_memory()
+    return report
+
+
+def process_memory():
+    """Returns the process's peak resident size where the platform reports it."""
+    gc_objects = len(gc.get_objects())
+    if resource is None:
+        return {"peak_rss_bytes": None, "gc_objects": gc_objects}
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024 # Linux reports kilobytes, macOS bytes
+    return {"peak_rss_bytes": peak, "gc_objects": gc_objects}
+
+
+def format_report(report):
+    """Returns the report as aligned text lines."""
+    lines = []
+    for name, entry in report.items():
+        if name == "process":
+            continue
+        lines.append(f"{name:<14} {entry['bytes'] / 1048576:10.2f} MB  {entry['count']:>9} items")
+    process = report.get("process", {})
+    if process.get("peak_rss_bytes"):
+        lines.append(f"{'peak RSS':<14} {process['peak_rss_bytes'] / 1048576:10.2f} MB")
+    return lines
+
+
+# --- tracemalloc snapshots ---
+
+def start_tracing():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+def stop_tracing():
+    global _baseline
+    _baseline = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_tracing():
+    return tracemalloc.is_tracing()
+
+
+def take_snapshot():
+    """Returns a tracemalloc snapshot without tracemalloc's own allocations."""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Memory tracing is not running.")
+    snapshot = tracemalloc.take_snapshot()
+    return snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+def diff_snapshots(before, after, limit=15, key_type='filename'):
+    """Returns the largest allocation changes between two snapshots as text lines.
+
+    Grouping by filename maps growth onto modules (data_manager.py,
+    main_window.py, ...), i.e. onto subsystems.
+    """
+    stats = after.compare_to(before, key_type)
+    lines = [f"Total change: {sum(stat.size_diff for stat in stats) / 1024:+.1f} KiB"]
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  {frame.filename}"
+                     + (f":{frame.lineno}" if key_type == 'lineno' else ""))
+    return lines
+
+
+def set_baseline():
+    """Starts tracing if needed and records the point later diffs start from."""
+    global _baseline
+    start_tracing()
+    _baseline = take_snapshot()
+
+
+def diff_from_baseline(limit=15, key_type='filename'):
+    """Returns diff_snapshots() lines between the baseline and now."""
+    if _baseline is None:
+        raise RuntimeError("No baseline snapshot; start tracing first.")
+    return diff_snapshots(_baseline, take_snapshot(), limit, key_type)
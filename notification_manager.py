@@ -1,15 +1,19 @@
 # File: notification_manager.py
 # bToDo - Created by Patrick Britton
 # Date: 2025-04-28
-# Updated: 2025-04-29 (Use britton.ico for notifications, removed temp icon creation)
+# Updated: 2026-10-18 (Re-arms reminders from DataManager change events)
 
-import datetime
 import os
 import sys
+import time
 
 # PySide6 imports
 from PySide6.QtCore import QObject, QTimer
 
+import perf_stats
+import timezones
+from change_bus import EVENT_UPDATED, EVENTS_BULK
+
 try:
     # Conditional import for Windows-specific notifications
     from winotify import Notification, audio
@@ -31,10 +35,12 @@ class NotificationManager(QObject):
         self.timer.setInterval(30 * 1000)
         self.timer.timeout.connect(self.check_notifications)
         self.timer.start()
+        self.data_manager.changes.subscribe(self._on_events_changed, (EVENT_UPDATED, EVENTS_BULK))
         # self.icon_path = self._create_temp_icon() # REMOVED
 
     # _create_temp_icon method REMOVED
 
+    @perf_stats.timed_function("notify.tick")
     def check_notifications(self):
         # Only proceed if winotify was imported successfully
         if Notification is None:
@@ -48,7 +54,7 @@ class NotificationManager(QObject):
         if not icon_exists:
             print(f"Warning: Notification icon '{ICON_PATH}' not found. Notifications may lack an icon.", file=sys.stderr)
 
-        now = datetime.datetime.now()
+        now = time.time()
         try:
             current_events = list(self.data_manager.events)
         except AttributeError:
@@ -61,23 +67,17 @@ class NotificationManager(QObject):
         for ev in current_events:
             if not ev.get('notify', False):
                 continue
-            notify_time_str = ev.get('notify_time')
-            if not notify_time_str:
-                continue
-            try:
-                notify_dt = datetime.datetime.fromisoformat(notify_time_str)
-            except (ValueError, TypeError) as e:
-                print(f"Warning: Could not parse notify_time '{notify_time_str}': {e}", file=sys.stderr)
-                continue
-            except Exception as e:
-                print(f"Warning: Error processing notify_time '{notify_time_str}': {e}", file=sys.stderr)
+            # Precomputed by DataManager from notify_time in the event's time zone
+            # (None if missing or invalid), so ticks never convert times
+            notify_ts = ev.get('notify_ts')
+            if notify_ts is None:
                 continue
 
             event_id = ev.get('id')
             if event_id in self.notified_ids:
                 continue
 
-            if now >= notify_dt:
+            if now >= notify_ts:
                 if event_id:
                     self.notified_ids.add(event_id)
                 else:
@@ -88,6 +88,8 @@ class NotificationManager(QObject):
                 event_time_str = ev.get('time')
                 date_str = ev.get('date', 'Unknown Date')
                 time_part = f" at {event_time_str}" if event_time_str else ""
+                if event_time_str and ev.get('tz') and ev['tz'] != timezones.local_zone_name():
+                    time_part += f" ({ev['tz']})"
                 msg_lines.append(f"Event on {date_str}{time_part}")
                 desc = ev.get('description')
                 if desc:
@@ -106,10 +108,12 @@ class NotificationManager(QObject):
                 except Exception as e:
                     print(f"Failed to show notification for '{title}': {e}", file=sys.stderr)
 
-    def schedule_notifications(self):
-        """
-        Placeholder method called when events change.
-        The current timer-based check_notifications handles polling.
-        """
-        print("NotificationManager: schedule_notifications called (potential future use).")
-        pass
\ No newline at end of file
+    def _on_events_changed(self, change):
+        """Re-arms the reminder of an event whose reminder time moved."""
+        changes = change.changes if change.kind == EVENTS_BULK else (change,)
+        if changes is None:
+            return # Bulk moves (archiving) keep reminder times
+        for event_change in changes:
+            # Deleted ones stay marked, so undoing a delete does not repeat a past reminder
+            if event_change.kind == EVENT_UPDATED and 'notify_ts' in event_change.fields:
+                self.notified_ids.discard(event_change.event_id)
@@ -0,0 +1,116 @@
+# File: overlay_calendars.py
+# bToDo - Read-only overlay calendars shown beside the live calendar
+# Date: 2026-10-18
+#
+# Backups and archived calendars are separate .enc files. Each one opened
+# as an overlay is decrypted once, its events sorted by event_sort_key and
+# put into its own bitmap index. Because the index hands out slots in
+# insertion order and overlays never change, a day lookup returns that
+# source's events already sorted, and the day view combines the sources
+# with a k-way heapq.merge instead of concatenating and re-sorting.
+# Overlays are never written. Qt-free.
+
+import heapq
+import os
+
+from bitmap_index import BitmapIndex, tag_key
+from data_manager import event_sort_key
+
+OVERLAY_COLORS = ("#8E44AD", "#16A085", "#D35400", "#2980B9", "#C0392B", "#7F8C8D")
+
+
+def _pair_sort_key(pair):
+    return event_sort_key(pair[0])
+
+
+def merge_sorted(streams):
+    """Merges (source, events sorted by event_sort_key) streams into one sorted list of (event, source)."""
+    iterables = [[(event, source) for event in events] for source, events in streams if events]
+    if len(iterables) == 1:
+        return iterables[0]
+    return list(heapq.merge(*iterables, key=_pair_sort_key))
+
+
+class OverlaySource:
+    """One read-only calendar file: its events, sorted and indexed by tag and day."""
+
+    def __init__(self, path, events, color=OVERLAY_COLORS[0], visible=True):
+        self.path = os.path.abspath(path)
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.color = color
+        self.visible = visible
+        # The index is keyed by id; a repeated id would free a slot and break the sorted order
+        unique = {}
+        for number, event in enumerate(events):
+            if event.get('id') is None:
+                event['id'] = f"{self.path}#{number}"
+            unique.setdefault(event['id'], event)
+        self.events = sorted(unique.values(), key=event_sort_key)
+        self._index = BitmapIndex(self.events)
+
+    def __len__(self):
+        return len(self.events)
+
+    def tag_counts(self):
+        return self._index.tag_counts()
+
+    def events_on_day(self, ordinal, hidden_tags=(), hide_untagged=False):
+        """Returns the events covering a date ordinal, sorted, without those the tag filter hides."""
+        index = self._index
+        bits = index.day_mask(ordinal)
+        if bits and (hidden_tags or hide_untagged):
+            shown = [tag for tag in index.tag_counts() if tag_key(tag) not in hidden_tags]
+            bits &= index.tag_mask(shown, include_untagged=not hide_untagged)
+        return index.events(bits)
+
+    def to_setting(self):
+        return {"path": self.path, "color": self.color, "visible": self.visible}
+
+
+class OverlaySet:
+    """The overlays open in a window, in the order they were opened."""
+
+    def __init__(self):
+        self._sources = {} # absolute path -> OverlaySource
+
+    def __iter__(self):
+        return iter(list(self._sources.values()))
+
+    def __len__(self):
+        return len(self._sources)
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self._sources
+
+    def get(self, path):
+        return self._sources.get(os.path.abspath(path))
+
+    def add(self, source):
+        self._sources[source.path] = source
+
+    def remove(self, path):
+        return self._sources.pop(os.path.abspath(path), None)
+
+    def next_color(self):
+        """The first overlay color not in use yet (cycling once all are taken)."""
+        used = [source.color for source in self._sources.values()]
+        free = [color for color in OVERLAY_COLORS if color not in used]
+        return free[0] if free else OVERLAY_COLORS[len(used) % len(OVERLAY_COLORS)]
+
+    def tag_counts(self):
+        """Returns {tag key: (tag as first written, number of events)} over the visible overlays."""
+        counts = {}
+        for source in self._sources.values():
+            if source.visible:
+                for tag, count in source.tag_counts().items():
+                    name, total = counts.get(tag_key(tag), (tag, 0))
+                    counts[tag_key(tag)] = (name, total + count)
+        return counts
+
+    def day_streams(self, ordinal, hidden_tags=(), hide_untagged=False):
+        """Returns (source, sorted events on the day) for each visible overlay, for merge_sorted."""
+        return [(source, source.events_on_day(ordinal, hidden_tags, hide_untagged))
+                for source in self._sources.values() if source.visible]
+
+    def to_settings(self):
+        return [source.to_setting() for source in self._sources.values()]
@@ -0,0 +1,169 @@
+# File: perf_stats.py
+# bToDo - Hot-path timing instrumentation
+# Date: 2026-10-18
+#
+# Records how long key operations take (key derivation, loading, saving,
+# list refreshes, reminder checks, theming, exports) so "it feels slow"
+# reports come with numbers. Qt-free, so DataManager and the CLI can use it.
+#
+# Recording is off unless enabled (BTODO_PERF=1, or Help > Diagnostics).
+# While off, timed() returns a shared no-op object and timed_function()
+# wrappers cost one flag check per call.
+#
+# Usage:
+#   with perf_stats.timed("save.encrypt") as t:
+#       ...
+#       t.add_bytes(len(ciphertext))
+#
+#   @perf_stats.timed_function("ui.refresh_event_list")
+#   def refresh_event_list(self): ...
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+ENV_VAR = "BTODO_PERF"
+RING_SIZE = 1024 # Recent samples kept per operation for percentiles
+
+_enabled = os.environ.get(ENV_VAR, "") not in ("", "0")
+_stats = {}
+_lock = threading.Lock() # Shards are read on a worker thread
+
+
+class OpStats:
+    """Totals for one operation plus a ring buffer of its recent durations."""
+    __slots__ = ("count", "total", "max", "bytes", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.samples = deque(maxlen=RING_SIZE)
+
+    def add(self, seconds, nbytes=0):
+        self.count += 1
+        self.total += seconds
+        self.bytes += nbytes
+        if seconds > self.max:
+            self.max = seconds
+        self.samples.append(seconds)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        def percentile(p):
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total * 1000 / self.count if self.count else 0.0,
+            "p50_ms": percentile(0.50),
+            "p90_ms": percentile(0.90),
+            "p99_ms": percentile(0.99),
+            "max_ms": self.max * 1000,
+            "bytes": self.bytes,
+        }
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def record(name, seconds, nbytes=0):
+    """Adds one sample for an operation (ignored while recording is off)."""
+    if not _enabled:
+        return
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = OpStats()
+        stats.add(seconds, nbytes)
+
+
+class _Timer:
+    __slots__ = ("name", "start", "nbytes")
+
+    def __init__(self, name):
+        self.name = name
+        self.nbytes = 0
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.start, self.nbytes)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def add_bytes(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name):
+    """Context manager timing the enclosed block under `name`."""
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed_function(name):
+    """Decorator timing every call of a function under `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def summary():
+    """Returns {operation: stats dict} for everything recorded so far."""
+    with _lock:
+        return {name: _stats[name].summary() for name in sorted(_stats)}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def export_json(path):
+    """Writes the current summary (and the raw recent samples) to a JSON file."""
+    with _lock:
+        data = {
+            "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "enabled": _enabled,
+            "operations": {name: dict(stats.summary(), recent_ms=[s * 1000 for s in stats.samples])
+                           for name, stats in sorted(_stats.items())},
+        }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
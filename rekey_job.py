@@ -0,0 +1,277 @@
+# File: rekey_job.py
+# bToDo - Passphrase change: streaming re-encryption with a resumable journal
+# Date: 2026-10-18
+#
+# Changing the passphrase re-encrypts every file it protects: the data file,
+# its year shards and archive (attachments are stored inside the shards)
+# and any backup files the user names. The snapshot repository keeps its
+# data key; only the copy of that key in its kdf.json is re-wrapped under the
+# new passphrase, since its objects are addressed by checksums that
+# re-encryption would change.
+#
+# DataManager.begin_passphrase_change() derives the new key, writes the
+# journal and switches the open store to the new key at once, so whatever is
+# saved from then on is already under it. RekeyJob.run() then converts the
+# remaining files one at a time, typically on a worker thread; each file is
+# converted under the store's file lock, so saves simply wait for it.
+#
+# Files are streamed: the old ciphertext is decrypted and the new one
+# encrypted chunk by chunk (AES-EAX works incrementally), so memory use is
+# one chunk whatever the file size. The new file is written beside the old
+# one and replaces it only after the old authentication tag has verified.
+#
+# The journal (e.g. britton_data.rekey.json) lists the files still to
+# convert, the new key parameters and the old keys, wrapped (encrypted)
+# under the new key; it never holds a passphrase. If bToDo stops midway, the
+# next start asks for the NEW passphrase: it unwraps the old keys, so files
+# not converted yet stay readable, and the job resumes. Converting a file
+# twice is harmless: files whose header already names the new key
+# parameters are skipped. A store file that fails to convert stays in the
+# journal, and the journal (the only copy of the old key) stays on disk
+# until every store file is converted; only backup files the user named are
+# given up on with a warning. Qt-free.
+
+import base64
+import json
+import os
+import struct
+import sys
+
+from Crypto.Cipher import AES
+
+import perf_stats
+from data_manager import FILE_MAGIC, LEGACY_KDF, PassphraseError, sync_directory
+from file_lock import FileLock
+
+JOURNAL_SUFFIX = ".rekey.json"
+JOURNAL_FORMAT = 1
+REKEY_CHUNK_BYTES = 1024 * 1024
+TEMP_SUFFIX = ".rekey.tmp"
+CHECK_PLAINTEXT = b"bToDo passphrase check"
+
+
+def journal_path_for(data_file):
+    """Returns the journal path for a data file, e.g. britton_data.rekey.json."""
+    root, _ = os.path.splitext(data_file)
+    return root + JOURNAL_SUFFIX
+
+
+def wrap_key(secret, key):
+    """Encrypts a key (or any short secret) under another key; returns base64 text."""
+    cipher = AES.new(key, AES.MODE_EAX)
+    ciphertext, tag = cipher.encrypt_and_digest(secret)
+    return base64.b64encode(cipher.nonce + tag + ciphertext).decode('ascii')
+
+
+def unwrap_key(wrapped, key):
+    """Reverses wrap_key. Raises ValueError if key is not the one it was wrapped with."""
+    blob = base64.b64decode(wrapped)
+    cipher = AES.new(key, AES.MODE_EAX, nonce=blob[:16])
+    return cipher.decrypt_and_verify(blob[32:], blob[16:32])
+
+
+def same_kdf(a, b):
+    return a.get('salt') == b.get('salt') and int(a.get('iterations', 0)) == int(b.get('iterations', 0))
+
+
+def read_journal(data_file):
+    """Returns the journal of an unfinished passphrase change, or None if there is none."""
+    path = journal_path_for(data_file)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            journal = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Passphrase change journal '{path}' is unreadable: {e}") from e
+    if not isinstance(journal, dict) or journal.get('format', 0) > JOURNAL_FORMAT:
+        raise ValueError(f"Passphrase change journal '{path}' is damaged or from a newer version.")
+    return journal
+
+
+def write_journal(data_file, journal):
+    """Writes the journal atomically and durably; it must be on disk before any file changes key."""
+    path = journal_path_for(data_file)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(journal, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    sync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def create_journal(data_file, new_kdf, new_key, old_keys, files, repository=None, backups=()):
+    """Writes and returns a new journal. old_keys is a list of (kdf, key) the files may use.
+
+    files are the store's own files; backups are extra files the user named.
+    """
+    journal = {
+        "format": JOURNAL_FORMAT,
+        "kdf": new_kdf,
+        "check": wrap_key(CHECK_PLAINTEXT, new_key),
+        "old_keys": [{"kdf": kdf, "key": wrap_key(key, new_key)} for kdf, key in old_keys],
+        "files": list(files),
+        "backups": list(backups),
+        "total": len(files) + len(backups) + (1 if repository else 0),
+        "repository": repository,
+    }
+    write_journal(data_file, journal)
+    return journal
+
+
+def open_journal(journal, new_key):
+    """Checks new_key against a journal; returns the unwrapped old keys as [(kdf, key)].
+
+    Raises PassphraseError if new_key was not derived from the new passphrase.
+    """
+    try:
+        if unwrap_key(journal['check'], new_key) != CHECK_PLAINTEXT:
+            raise ValueError("check value mismatch")
+        return [(entry['kdf'], unwrap_key(entry['key'], new_key)) for entry in journal.get('old_keys', [])]
+    except (ValueError, KeyError) as e:
+        raise PassphraseError("A passphrase change was interrupted; enter the new passphrase to finish it.") from e
+
+
+@perf_stats.timed_function("rekey.file")
+def reencrypt_file(path, old_key_for, new_kdf, new_key, should_stop=None):
+    """Re-encrypts one data file in place under new_key, streaming in chunks.
+
+    old_key_for(kdf) returns the key for the KDF parameters in the file's
+    header. Returns False if should_stop() asked to stop midway (the file
+    is left as it was), True otherwise.
+    """
+    temp_path = path + TEMP_SUFFIX
+    with open(path, 'rb') as src:
+        prefix = src.read(8)
+        if prefix.startswith(FILE_MAGIC):
+            (header_len,) = struct.unpack(">I", prefix[4:8])
+            header_bytes = src.read(header_len)
+            header = json.loads(header_bytes.decode('utf-8'))
+        else: # Original layout without a header
+            src.seek(0)
+            header_bytes, header = b"", {}
+        if header.get('kdf') and same_kdf(header['kdf'], new_kdf):
+            return True # Already converted (or saved under the new key)
+        nonce, tag = src.read(16), src.read(16)
+        if len(tag) < 16:
+            raise ValueError(f"Data file '{path}' is too short.")
+        decryptor = AES.new(old_key_for(header.get('kdf') or LEGACY_KDF), AES.MODE_EAX, nonce=nonce)
+        if header_bytes:
+            decryptor.update(header_bytes)
+        new_header_bytes = json.dumps(dict(header, kdf=new_kdf), separators=(',', ':')).encode('utf-8')
+        encryptor = AES.new(new_key, AES.MODE_EAX)
+        encryptor.update(new_header_bytes)
+        try:
+            with perf_stats.timed("rekey.stream") as timer, open(temp_path, 'wb') as dst:
+                dst.write(FILE_MAGIC + struct.pack(">I", len(new_header_bytes)) + new_header_bytes)
+                dst.write(encryptor.nonce)
+                tag_offset = dst.tell()
+                dst.write(bytes(16)) # The new tag is known only at the end
+                while True:
+                    if should_stop and should_stop():
+                        raise InterruptedError
+                    chunk = src.read(REKEY_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    dst.write(encryptor.encrypt(decryptor.decrypt(chunk)))
+                    timer.add_bytes(len(chunk))
+                try:
+                    decryptor.verify(tag)
+                except ValueError as e:
+                    raise PassphraseError(f"Could not decrypt '{path}': wrong passphrase or damaged file.") from e
+                dst.seek(tag_offset)
+                dst.write(encryptor.digest())
+                dst.flush()
+                os.fsync(dst.fileno())
+        except BaseException as e:
+            try: os.remove(temp_path)
+            except OSError: pass
+            if isinstance(e, InterruptedError):
+                return False
+            raise
+    os.replace(temp_path, path)
+    sync_directory(os.path.dirname(os.path.abspath(path)))
+    return True
+
+
+class RekeyJob:
+    """Converts the files listed in a passphrase-change journal (see the top of this module)."""
+
+    def __init__(self, data_manager, journal):
+        self.data_manager = data_manager
+        self.journal = journal
+        self.problems = [] # Files that could not be converted, with the reason
+        self._stopping = False
+        # A lock of its own: it also keeps this process's saves out while a file is converted
+        self._lock = FileLock(data_manager.data_file + ".lock")
+
+    def total(self):
+        return self.journal.get('total', self.remaining())
+
+    def remaining(self):
+        return (len(self.journal['files']) + len(self.journal.get('backups', ()))
+                + (1 if self.journal.get('repository') else 0))
+
+    def stop(self):
+        """Asks run() to stop at the next chunk; the journal lets a later run resume."""
+        self._stopping = True
+
+    def run(self, progress=None):
+        """Converts the remaining files, calling progress(done, total) after each.
+
+        Returns True when the change is complete (the journal is removed).
+        Returns False if stop() interrupted it or a store file or the
+        snapshot repository could not be converted; those stay in the journal
+        (see self.problems) and a later run retries them.
+        """
+        dm = self.data_manager
+        new_kdf = self.journal['kdf']
+        new_key = dm.derive_key(new_kdf)
+        failed = 0
+        done = self.total() - self.remaining()
+        for entry, is_backup in ([(path, False) for path in self.journal['files']]
+                                 + [(path, True) for path in self.journal.get('backups', ())]):
+            try:
+                with self._lock:
+                    if not reencrypt_file(entry, dm.derive_key, new_kdf, new_key, lambda: self._stopping):
+                        return False
+            except FileNotFoundError:
+                pass # Removed since the change began (e.g. an emptied shard)
+            except (ValueError, OSError) as e:
+                self.problems.append(f"{entry}: {e}")
+                if not is_backup:
+                    # Still under the old key, which only the journal holds now: keep both
+                    print(f"Error: Could not re-encrypt '{entry}'; the change stays unfinished: {e}", file=sys.stderr)
+                    failed += 1
+                    continue
+                print(f"Warning: Could not re-encrypt backup '{entry}'; it keeps the old passphrase: {e}", file=sys.stderr)
+            self.journal['backups' if is_backup else 'files'].remove(entry)
+            write_journal(dm.data_file, self.journal)
+            done += 1
+            if progress:
+                progress(done, self.total())
+        repository = self.journal.get('repository')
+        if repository:
+            if self._stopping:
+                return False
+            from backup_repository import rewrap_repository_key
+            try:
+                rewrap_repository_key(repository['path'], unwrap_key(repository['data_key'], new_key),
+                                      repository['kdf'], dm.derive_key(repository['kdf']))
+            except (ValueError, OSError) as e:
+                print(f"Error: Could not re-key snapshot repository '{repository['path']}'; "
+                      f"the change stays unfinished: {e}", file=sys.stderr)
+                self.problems.append(f"{repository['path']}: {e}")
+                failed += 1
+            else:
+                self.journal['repository'] = None
+                write_journal(dm.data_file, self.journal)
+                done += 1
+                if progress:
+                    progress(done, self.total())
+        if failed:
+            return False
+        os.remove(journal_path_for(dm.data_file))
+        dm.finish_passphrase_change(self.journal)
+        return True
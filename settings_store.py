@@ -0,0 +1,110 @@
+# File: settings_store.py
+# bToDo - Settings file kept apart from the encrypted event store
+# Date: 2026-10-18
+#
+# Settings (theme, accent color, time zone, archive period, ...) live in a
+# small JSON file next to the data file, e.g. britton_data.settings.json,
+# so changing one costs a tiny atomic write instead of re-encrypting the
+# store manifest, and the theme can be applied at startup before the key is
+# derived and the events are decrypted. Nothing in it is secret, so it is
+# not encrypted. The file records its format and a revision that grows with
+# every save; other processes notice saves through a cheap stat check.
+# Qt-free.
+
+import json
+import os
+import sys
+
+SETTINGS_FORMAT = 1
+SETTINGS_SUFFIX = ".settings.json"
+DEFAULT_SETTINGS = {
+    "theme": "light",
+    "accent_color": "#2A82DA",
+    "style_name": "Default Light",
+}
+
+
+def settings_path_for(data_file):
+    """Returns the settings file path for a data file, e.g. britton_data.settings.json."""
+    root, _ = os.path.splitext(data_file)
+    return root + SETTINGS_SUFFIX
+
+
+def default_settings():
+    return dict(DEFAULT_SETTINGS)
+
+
+class SettingsStore:
+    """Loads and saves the settings dict of one data file."""
+
+    def __init__(self, data_file):
+        self.path = settings_path_for(data_file)
+        self.revision = 0
+        self._stamp = None
+        self._saved = None # Copy of the settings as last read or written
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def load(self):
+        """Returns the stored settings merged over the defaults (just the defaults if unreadable)."""
+        settings = default_settings()
+        self._stamp = self._stat()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return settings
+        except (OSError, ValueError) as e:
+            print(f"Warning: Failed to read settings file '{self.path}': {e}", file=sys.stderr)
+            return settings
+        if not isinstance(data, dict):
+            print(f"Warning: Ignoring malformed settings file '{self.path}'.", file=sys.stderr)
+            return settings
+        if data.get('format', 1) > SETTINGS_FORMAT:
+            print(f"Warning: Settings file '{self.path}' was written by a newer version; unknown settings are kept as they are.", file=sys.stderr)
+        if isinstance(data.get('settings'), dict):
+            settings.update(data['settings'])
+        self.revision = int(data.get('revision', 0))
+        self._saved = dict(settings)
+        return settings
+
+    def is_saved(self, settings):
+        """True if settings equal what was last read or written."""
+        return self._saved == settings
+
+    def unsaved_keys(self, settings):
+        """Returns the keys whose values differ from what was last read or written."""
+        saved = self._saved or {}
+        return frozenset(key for key in settings.keys() | saved.keys() if settings.get(key) != saved.get(key))
+
+    def save(self, settings):
+        """Writes settings atomically and bumps the revision."""
+        revision = self.revision + 1
+        payload = json.dumps({"format": SETTINGS_FORMAT, "revision": revision, "settings": settings},
+                             ensure_ascii=False, indent=1)
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(temp_path, self.path)
+        except OSError:
+            if os.path.exists(temp_path):
+                try: os.remove(temp_path)
+                except OSError: pass
+            raise
+        self.revision = revision
+        self._stamp = self._stat()
+        self._saved = dict(settings)
+
+    def changed_on_disk(self):
+        """True if another process saved the settings since we last read or wrote them."""
+        stamp = self._stat()
+        return stamp is not None and stamp != self._stamp
@@ -0,0 +1,96 @@
+# File: stall_watchdog.py
+# bToDo - GUI event-loop stall watchdog
+# Date: 2026-10-18
+#
+# A QTimer on the GUI thread records a heartbeat; a background thread checks
+# it. When the event loop has not serviced the heartbeat for longer than the
+# threshold (a save, export or image decode blocking the GUI thread), the
+# main thread's Python stack is captured with sys._current_frames() and
+# written, with the stall duration, to a rotating log file.
+
+import logging
+import logging.handlers
+import sys
+import threading
+import time
+import traceback
+
+from PySide6.QtCore import QObject, QTimer
+
+DEFAULT_STALL_THRESHOLD_MS = 1000
+HEARTBEAT_INTERVAL_MS = 100
+STALL_LOG_FILENAME = "btodo_stalls.log"
+STALL_LOG_MAX_BYTES = 1024 * 1024
+STALL_LOG_BACKUPS = 3
+
+
+class StallWatchdog(QObject):
+    """Logs event-loop stalls longer than threshold_ms with the GUI thread's stack.
+
+    Create and start() it on the GUI thread once the window is up.
+    """
+
+    def __init__(self, log_path, threshold_ms=DEFAULT_STALL_THRESHOLD_MS, parent=None):
+        super().__init__(parent)
+        self.threshold = threshold_ms / 1000
+        self._gui_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stall_count = 0
+        self._heartbeat = QTimer(self)
+        self._heartbeat.setInterval(HEARTBEAT_INTERVAL_MS)
+        self._heartbeat.timeout.connect(self._beat)
+
+        self._logger = logging.getLogger(f"btodo.stalls.{id(self)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._handler = logging.handlers.RotatingFileHandler(
+            log_path, maxBytes=STALL_LOG_MAX_BYTES, backupCount=STALL_LOG_BACKUPS,
+            encoding='utf-8', delay=True)
+        self._handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        self._logger.addHandler(self._handler)
+
+    def _beat(self):
+        self._last_beat = time.monotonic()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._last_beat = time.monotonic()
+        self._heartbeat.start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="bToDo stall watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._heartbeat.stop()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self._handler.close()
+        self._logger.removeHandler(self._handler)
+
+    def _watch(self):
+        """Runs on the watchdog thread."""
+        stalled_since = None
+        poll = HEARTBEAT_INTERVAL_MS / 1000
+        while not self._stop.wait(poll):
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat
+            if stalled_since is None:
+                if blocked_for > self.threshold:
+                    stalled_since = last_beat
+                    self.stall_count += 1
+                    self._log_stall(blocked_for)
+            elif last_beat > stalled_since:
+                # The heartbeat ran again: the stall is over
+                self._logger.info(f"Stall ended after {last_beat - stalled_since:.2f} s")
+                stalled_since = None
+
+    def _log_stall(self, blocked_for):
+        frame = sys._current_frames().get(self._gui_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "  (GUI thread stack unavailable)\n"
+        self._logger.warning(f"Event loop blocked for {blocked_for:.2f} s "
+                             f"(threshold {self.threshold:.2f} s). GUI thread stack:\n{stack.rstrip()}")
@@ -0,0 +1,27 @@
+# File: tests/test_apply_changes.py
+# bToDo - DataManager.apply_changes
+# Date: 2026-10-18
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_manager import DataManager
+
+
+def test_add_with_existing_id_is_rejected(tmp_path):
+    dm = DataManager(str(tmp_path / "data.enc"), kdf_iterations=100_000)
+    dm.apply_changes(added=[{"id": "a", "title": "First", "date": "2025-05-01"}])
+
+    result = dm.apply_changes(added=[{"id": "a", "title": "Second", "date": "2025-05-02"},
+                                     {"id": "b", "title": "Third", "date": "2025-05-03"},
+                                     {"id": "b", "title": "Fourth", "date": "2025-05-04"}])
+
+    assert result['added'] == ["b"]
+    assert result['duplicate'] == ["a", "b"]
+    assert sorted(ev['id'] for ev in dm.events) == ["a", "b"]
+    assert dm.find_event("a")['title'] == "First"
+    reopened = DataManager(dm.data_file)
+    reopened.load_all_shards()
+    assert sorted(ev['id'] for ev in reopened.events) == ["a", "b"]
@@ -0,0 +1,50 @@
+# File: tests/test_backup_repository.py
+# bToDo - Snapshot repository maintenance reads only manifests and checksums
+# Date: 2026-10-18
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_repository import BackupRepository
+from data_manager import DataManager
+
+
+def _events(count, text):
+    return [{"id": f"ev{i}", "title": f"{text} {i}", "date": "2025-05-01",
+             "attachments": [{"filename": "a.txt", "data": f"{text}-{i % 3}"}]} for i in range(count)]
+
+
+def _count_object_reads(repo, monkeypatch):
+    reads = []
+    real = repo._get_object
+    monkeypatch.setattr(repo, "_get_object", lambda object_id: reads.append(object_id) or real(object_id))
+    return reads
+
+
+def test_quick_verify_and_gc_do_not_decrypt_objects(tmp_path, monkeypatch):
+    dm = DataManager(str(tmp_path / "data.enc"), kdf_iterations=100_000)
+    repo = BackupRepository(str(tmp_path / "repo"), dm)
+    for text in ("one", "two", "three"):
+        repo.create_snapshot(_events(20, text), {"theme": "light"})
+    reads = _count_object_reads(repo, monkeypatch)
+
+    assert repo.verify() == []
+    assert repo.apply_retention(keep_last=1, keep_daily=0, keep_weekly=0)
+    assert reads == []
+
+    assert repo.verify(deep=True) == []
+    assert reads # deep decrypts every object
+    events, _ = repo.restore(repo.list_snapshots()[-1])
+    assert sorted(ev['attachments'][0]['data'] for ev in events)[:2] == ["three-0", "three-0"]
+
+
+def test_verify_reports_missing_attachment(tmp_path):
+    dm = DataManager(str(tmp_path / "data.enc"), kdf_iterations=100_000)
+    repo = BackupRepository(str(tmp_path / "repo"), dm)
+    snapshot_id = repo.create_snapshot(_events(1, "only"), {})
+    attachment_id = repo._load_manifest(snapshot_id)['events'][0][2][0][0]
+    os.remove(repo._object_path(attachment_id))
+
+    assert repo.verify() == [f"{snapshot_id}: object {attachment_id} is missing"]
@@ -0,0 +1,122 @@
+# File: tests/test_rekey_job.py
+# bToDo - Passphrase change: resume, failures, idempotence, wrong passphrase
+# Date: 2026-10-18
+
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rekey_job
+from data_manager import DataManager, PassphraseError
+from rekey_job import journal_path_for, open_journal, read_journal
+
+YEARS = (2020, 2021, 2026)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(rekey_job, "REKEY_CHUNK_BYTES", 1024) # Several chunks per file
+    dm = DataManager(str(tmp_path / "data.enc"), kdf_iterations=100_000)
+    dm.apply_changes(added=[{"id": f"{year}-{i}", "title": f"Event {i}" + "x" * 500, "date": f"{year}-03-{i + 1:02d}"}
+                            for year in YEARS for i in range(10)])
+    return dm
+
+
+def _event_ids(path, passphrase):
+    dm = DataManager(path, passphrase=passphrase)
+    dm.load_all_shards()
+    return sorted(ev['id'] for ev in dm.events)
+
+
+def _store_files(dm):
+    return [dm.data_file] + [dm._shard_path(str(year)) for year in YEARS]
+
+
+def test_stop_then_resume(store):
+    expected = sorted(ev['id'] for ev in store.events)
+    job = store.begin_passphrase_change("new secret")
+    job.run(lambda done, total: job.stop() if done == 1 else None)
+
+    assert store.rekey_in_progress()
+    assert len(read_journal(store.data_file)['files']) == len(_store_files(store)) - 1
+
+    reopened = DataManager(store.data_file, passphrase="new secret")
+    assert reopened.rekey_in_progress()
+    assert reopened.resume_passphrase_change().run() is True
+    assert not reopened.rekey_in_progress()
+    assert not os.path.exists(journal_path_for(store.data_file))
+    assert _event_ids(store.data_file, "new secret") == expected
+    with pytest.raises(PassphraseError):
+        DataManager(store.data_file)
+
+
+def test_failed_store_file_keeps_journal_and_old_key(store, monkeypatch):
+    failing = store._shard_path("2021")
+    real_reencrypt = rekey_job.reencrypt_file
+
+    def reencrypt(path, *args, **kwargs):
+        if path == failing:
+            raise OSError("disk full")
+        return real_reencrypt(path, *args, **kwargs)
+    monkeypatch.setattr(rekey_job, "reencrypt_file", reencrypt)
+    job = store.begin_passphrase_change("new secret")
+
+    assert job.run() is False
+    assert store.rekey_in_progress()
+    journal = read_journal(store.data_file)
+    assert journal['files'] == [failing]
+    # The journal still unwraps the key the unconverted shard needs
+    old_kdf = DataManager.read_file_header(failing)['kdf']
+    old_keys = open_journal(journal, store.derive_key(journal['kdf']))
+    assert any(kdf['salt'] == old_kdf['salt'] for kdf, _ in old_keys)
+    assert len(_event_ids(store.data_file, "new secret")) == 10 * len(YEARS)
+
+    monkeypatch.setattr(rekey_job, "reencrypt_file", real_reencrypt)
+    reopened = DataManager(store.data_file, passphrase="new secret")
+    assert reopened.resume_passphrase_change().run() is True
+    assert DataManager.read_file_header(failing)['kdf'] == journal['kdf']
+
+
+def test_rerun_after_crash_is_idempotent(store, tmp_path):
+    """A crash after files were converted but before the journal said so: the rerun skips them."""
+    job = store.begin_passphrase_change("new secret")
+    journal_copy = str(tmp_path / "journal.copy")
+    shutil.copy(journal_path_for(store.data_file), journal_copy)
+    assert job.run() is True
+    converted = {path: open(path, 'rb').read() for path in _store_files(store)}
+
+    shutil.copy(journal_copy, journal_path_for(store.data_file))
+    reopened = DataManager(store.data_file, passphrase="new secret")
+    assert reopened.resume_passphrase_change().run() is True
+    assert {path: open(path, 'rb').read() for path in _store_files(store)} == converted
+    assert len(_event_ids(store.data_file, "new secret")) == 10 * len(YEARS)
+
+
+def test_wrong_new_passphrase_is_refused(store):
+    job = store.begin_passphrase_change("new secret")
+    job.stop()
+    assert job.run() is False
+    for passphrase in (None, "wrong"):
+        with pytest.raises(PassphraseError):
+            DataManager(store.data_file, passphrase=passphrase)
+    assert DataManager(store.data_file, passphrase="new secret").rekey_in_progress()
+
+
+def test_repository_key_is_rewrapped(store, tmp_path):
+    repo_path = str(tmp_path / "repo")
+    store.settings['snapshot_repo'] = repo_path
+    store.save_settings()
+    store.snapshot_backup(repo_path)
+    assert store.begin_passphrase_change("new secret").run() is True
+
+    with open(os.path.join(repo_path, "kdf.json"), encoding='utf-8') as f:
+        assert json.load(f).get('wrapped_key')
+    reopened = DataManager(store.data_file, passphrase="new secret")
+    reopened.restore_snapshot(repo_path)
+    reopened.load_all_shards()
+    assert len(reopened.events) == 10 * len(YEARS)
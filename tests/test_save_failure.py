@@ -0,0 +1,61 @@
+# File: tests/test_save_failure.py
+# bToDo - A failed save reverts the change it tried to save
+# Date: 2026-10-18
+
+import errno
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_manager
+from data_manager import DataManager
+
+
+def _reopened_ids(path):
+    dm = DataManager(path)
+    dm.load_all_shards()
+    return sorted(ev['id'] for ev in dm.events)
+
+
+def test_failed_write_reverts_add(tmp_path, monkeypatch):
+    dm = DataManager(str(tmp_path / "data.enc"), kdf_iterations=100_000)
+    dm.add_event({"id": "a", "title": "A", "date": "2025-05-01"})
+
+    def disk_full(src, dst):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    with monkeypatch.context() as m:
+        m.setattr(data_manager.os, "replace", disk_full)
+        with pytest.raises(OSError):
+            dm.add_event({"id": "b", "title": "B", "date": "2025-05-02"})
+
+    assert [ev['id'] for ev in dm.events] == ["a"]
+    assert dm.undo_label() == "Add 'A'"
+    assert _reopened_ids(dm.data_file) == ["a"]
+
+    dm.add_event({"id": "c", "title": "C", "date": "2025-05-03"})
+    assert _reopened_ids(dm.data_file) == ["a", "c"]
+
+
+def test_failed_manifest_write_after_shard_reverts_shard(tmp_path, monkeypatch):
+    """The shard may reach the disk before the manifest write fails; the next save rewrites it."""
+    dm = DataManager(str(tmp_path / "data.enc"), kdf_iterations=100_000)
+    dm.add_event({"id": "a", "title": "A", "date": "2025-05-01"})
+    real_replace = os.replace
+
+    def fail_on_manifest(src, dst):
+        if os.path.abspath(dst) == os.path.abspath(dm.data_file):
+            raise OSError(errno.ENOSPC, "No space left on device")
+        real_replace(src, dst)
+    with monkeypatch.context() as m:
+        m.setattr(data_manager.os, "replace", fail_on_manifest)
+        with pytest.raises(OSError):
+            dm.update_event("a", {"id": "a", "title": "Renamed", "date": "2025-05-01"})
+
+    assert dm.get_event_by_id("a")['title'] == "A"
+    dm.add_event({"id": "b", "title": "B", "date": "2025-05-02"})
+    reopened = DataManager(dm.data_file)
+    reopened.load_all_shards()
+    assert reopened.get_event_by_id("a")['title'] == "A"
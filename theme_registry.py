@@ -0,0 +1,167 @@
+# File: theme_registry.py
+# bToDo - Theme registry with cached stylesheets and palettes
+# Date: 2026-10-18
+#
+# Themes are either palette-only (Default Light, Default Dark, defined here)
+# or stylesheet themes read from .qss files: the built-in ones in themes/
+# and user themes in btodo_themes/ next to the data file. A .qss file may
+# start with comment lines giving its display name and base palette:
+#   /* name: My Theme */
+#   /* base: dark */
+# and uses {accent_color} where the accent color goes.
+#
+# Only file names are listed up front; a theme's file is read the first
+# time it is used, and the finished stylesheet and palette are cached per
+# (theme, accent) so switching back and forth costs no formatting or
+# palette building.
+
+import os
+import re
+import sys
+
+from PySide6.QtGui import QColor, QPalette
+
+STYLE_DEFAULT_LIGHT = "Default Light"
+STYLE_DEFAULT_DARK = "Default Dark"
+THEME_SUFFIX = ".qss"
+USER_THEMES_DIRNAME = "btodo_themes"
+ACCENT_PLACEHOLDER = "{accent_color}"
+MAX_CACHED_THEMES = 32 # (theme, accent) pairs
+_HEADER_LINE = re.compile(r"/\*\s*(\w+)\s*:\s*(.*?)\s*\*/")
+
+DARK_PALETTE = {
+    QPalette.ColorRole.Window: (45, 45, 45),
+    QPalette.ColorRole.WindowText: (220, 220, 220),
+    QPalette.ColorRole.Base: (35, 35, 35),
+    QPalette.ColorRole.AlternateBase: (55, 55, 55),
+    QPalette.ColorRole.ToolTipBase: (50, 50, 50),
+    QPalette.ColorRole.ToolTipText: (220, 220, 220),
+    QPalette.ColorRole.Text: (220, 220, 220),
+    QPalette.ColorRole.Button: (60, 60, 60),
+    QPalette.ColorRole.ButtonText: (220, 220, 220),
+    QPalette.ColorRole.BrightText: (255, 80, 80),
+    QPalette.ColorRole.Link: (42, 130, 218),
+}
+DARK_DISABLED_TEXT = (120, 120, 120)
+
+
+def user_themes_dir(data_file):
+    """Returns the user theme folder for a data file (next to it)."""
+    return os.path.join(os.path.dirname(os.path.abspath(data_file)), USER_THEMES_DIRNAME)
+
+
+def read_theme_header(path):
+    """Returns the {key: value} header comments of a .qss file (reads only its first lines)."""
+    header = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                match = _HEADER_LINE.fullmatch(line.strip())
+                if not match:
+                    break
+                header[match.group(1).lower()] = match.group(2)
+    except OSError as e:
+        print(f"Warning: Could not read theme file '{path}': {e}", file=sys.stderr)
+    return header
+
+
+class ThemeRegistry:
+    """Finds themes, and builds and caches their stylesheets and palettes."""
+
+    def __init__(self, *directories):
+        # name -> {"path": .qss path or None, "base": "light"/"dark"}
+        self._themes = {
+            STYLE_DEFAULT_LIGHT: {"path": None, "base": "light"},
+            STYLE_DEFAULT_DARK: {"path": None, "base": "dark"},
+        }
+        self._directories = []
+        self._templates = {} # name -> stylesheet text with the accent placeholder
+        self._compiled = {} # (name, accent) -> (stylesheet, QPalette)
+        self._applied = None
+        self._standard_palette = None
+        for directory in directories:
+            self.add_directory(directory)
+
+    def add_directory(self, directory):
+        """Registers the .qss themes in a directory; later directories override earlier ones."""
+        directory = os.path.abspath(directory)
+        if directory in self._directories or not os.path.isdir(directory):
+            return
+        self._directories.append(directory)
+        try:
+            filenames = sorted(name for name in os.listdir(directory) if name.lower().endswith(THEME_SUFFIX))
+        except OSError as e:
+            print(f"Warning: Could not list themes in '{directory}': {e}", file=sys.stderr)
+            return
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            header = read_theme_header(path)
+            name = header.get('name') or os.path.splitext(filename)[0].replace("_", " ").title()
+            self._themes[name] = {"path": path, "base": "dark" if header.get('base', '').lower() == "dark" else "light"}
+            self._templates.pop(name, None)
+        self._compiled.clear()
+
+    def names(self):
+        return list(self._themes)
+
+    def is_dark(self, name):
+        return self._themes.get(name, {}).get('base') == "dark"
+
+    def _template(self, name):
+        template = self._templates.get(name)
+        if template is None:
+            path = self._themes[name]['path']
+            template = ""
+            if path:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        template = f.read()
+                except OSError as e:
+                    print(f"Warning: Could not read theme file '{path}': {e}", file=sys.stderr)
+            self._templates[name] = template
+        return template
+
+    def _palette(self, app, base, accent_color):
+        if self._standard_palette is None:
+            self._standard_palette = QPalette(app.style().standardPalette())
+        palette = QPalette(self._standard_palette)
+        accent = QColor(accent_color)
+        if base == "dark":
+            for role, rgb in DARK_PALETTE.items():
+                palette.setColor(role, QColor(*rgb))
+            palette.setColor(QPalette.ColorRole.HighlightedText, QColor(255, 255, 255))
+            disabled_text = QColor(*DARK_DISABLED_TEXT)
+            palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Text, disabled_text)
+            palette.setColor(QPalette.ColorGroup.Disabled, QPalette.ColorRole.ButtonText, disabled_text)
+        else:
+            palette.setColor(QPalette.ColorRole.HighlightedText, QColor("black") if accent.lightnessF() > 0.5 else QColor("white"))
+        palette.setColor(QPalette.ColorRole.Highlight, accent)
+        return palette
+
+    def compiled(self, app, name, accent_color):
+        """Returns the cached (stylesheet, palette) for a theme and accent color."""
+        key = (name, accent_color)
+        entry = self._compiled.get(key)
+        if entry is None:
+            theme = self._themes[name]
+            stylesheet = self._template(name).replace(ACCENT_PLACEHOLDER, accent_color)
+            entry = (stylesheet, self._palette(app, theme['base'], accent_color))
+            if len(self._compiled) >= MAX_CACHED_THEMES:
+                self._compiled.clear()
+            self._compiled[key] = entry
+        return entry
+
+    def apply(self, app, name, accent_color):
+        """Styles the application; does nothing if this theme and accent are already applied."""
+        if name not in self._themes:
+            print(f"Warning: Unknown theme '{name}'; using {STYLE_DEFAULT_LIGHT}.", file=sys.stderr)
+            name = STYLE_DEFAULT_LIGHT
+        if self._applied == (name, accent_color):
+            return
+        if self._applied is None:
+            app.setStyle("Fusion")
+        stylesheet, palette = self.compiled(app, name, accent_color)
+        app.setPalette(palette)
+        if app.styleSheet() != stylesheet:
+            app.setStyleSheet(stylesheet)
+        self._applied = (name, accent_color)
@@ -0,0 +1,195 @@
+# File: timezones.py
+# bToDo - Time zone lookups with cached UTC offsets
+# Date: 2026-10-18
+#
+# Events keep their wall-clock date and time plus an optional IANA zone
+# name ('tz'); events without one are in the computer's local time. Turning
+# wall time into UTC needs the zone's offset on that date, which zoneinfo
+# computes from its transition tables on every call. Offsets are memoized
+# per (zone, date), so exporting or scheduling thousands of events costs one
+# lookup per distinct day. Days with a DST transition are cached as such and
+# resolved per call. Qt-free.
+#
+# Windows has no system zone database; the 'tzdata' package provides it.
+
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+
+try:
+    import zoneinfo
+except ImportError: # Python < 3.9
+    zoneinfo = None
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+MAX_CACHED_OFFSETS = 20000 # (zone, date) entries; cleared when full
+
+_offsets = {} # (zone name or None, date ordinal) -> offset minutes, or None on a transition day
+
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    """Returns the ZoneInfo for an IANA name, or None if it is empty or unknown."""
+    if not name or zoneinfo is None:
+        return None
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError, OSError):
+        print(f"Warning: Unknown time zone '{name}'; using local time.", file=sys.stderr)
+        return None
+
+
+def is_valid_zone(name):
+    return get_zone(name) is not None
+
+
+@lru_cache(maxsize=1)
+def local_zone_name():
+    """Returns the IANA name of the computer's time zone, or None if it cannot be told."""
+    candidates = [os.environ.get('TZ', '').lstrip(':')]
+    try:
+        target = os.path.realpath('/etc/localtime')
+        if 'zoneinfo' + os.sep in target:
+            candidates.append(target.split('zoneinfo' + os.sep, 1)[1])
+    except OSError:
+        pass
+    for name in candidates:
+        if name and get_zone(name) is not None:
+            return name
+    return None
+
+
+@lru_cache(maxsize=1)
+def available_zones():
+    """Returns the sorted IANA zone names, or [] without a zone database."""
+    if zoneinfo is None:
+        return []
+    try:
+        return sorted(zoneinfo.available_timezones())
+    except Exception:
+        return []
+
+
+def _offset_at(zone_name, wall):
+    """UTC offset in minutes of a naive wall-clock datetime in the zone (None = local time)."""
+    zone = get_zone(zone_name)
+    if zone is None:
+        # Naive timestamp() applies the operating system's local rules
+        utc = datetime.fromtimestamp(wall.timestamp(), timezone.utc).replace(tzinfo=None)
+        return round((wall - utc).total_seconds() / 60)
+    return round(zone.utcoffset(wall.replace(fold=0)).total_seconds() / 60)
+
+
+def utc_offset_minutes(zone_name, ordinal, minutes=0):
+    """UTC offset in minutes at a wall-clock time (minutes past midnight) on a date ordinal."""
+    key = (zone_name, ordinal)
+    offset = _offsets.get(key, False)
+    if offset is False:
+        day = datetime.fromordinal(ordinal)
+        try:
+            first = _offset_at(zone_name, day)
+            last = _offset_at(zone_name, day + timedelta(hours=23, minutes=59))
+        except (OverflowError, OSError, ValueError):
+            first, last = 0, 1 # Out of the platform's range: resolve per call below
+        offset = first if first == last else None
+        if len(_offsets) >= MAX_CACHED_OFFSETS:
+            _offsets.clear()
+        _offsets[key] = offset
+    if offset is None: # DST changes on this day
+        try:
+            return _offset_at(zone_name, datetime.fromordinal(ordinal) + timedelta(minutes=minutes))
+        except (OverflowError, OSError, ValueError):
+            return 0
+    return offset
+
+
+def wall_to_timestamp(zone_name, ordinal, minutes):
+    """POSIX timestamp of a wall-clock time in the zone (None = local time)."""
+    local_seconds = (ordinal - EPOCH_ORDINAL) * SECONDS_PER_DAY + minutes * 60
+    return local_seconds - utc_offset_minutes(zone_name, ordinal, minutes) * 60
+
+
+def wall_to_utc(zone_name, value):
+    """Converts a naive wall-clock datetime in the zone to a naive UTC datetime."""
+    ordinal = value.toordinal()
+    minutes = value.hour * 60 + value.minute
+    return value - timedelta(minutes=utc_offset_minutes(zone_name, ordinal, minutes))
+
+
+def clear_cache():
+    """Forgets cached offsets, e.g. after the computer's time zone changed."""
+    _offsets.clear()
+    local_zone_name.cache_clear()
+
+
+def _format_offset(minutes):
+    sign = "+" if minutes >= 0 else "-"
+    minutes = abs(minutes)
+    return f"{sign}{minutes // 60:02d}{minutes % 60:02d}"
+
+
+def _transitions(zone, year):
+    """Yields (onset in the old local time, offset before, offset after, is DST, abbreviation) per change in a year."""
+    def at(moment):
+        return moment.astimezone(zone)
+    start = datetime(year, 1, 1, tzinfo=timezone.utc)
+    previous = at(start).utcoffset()
+    day = start
+    for _ in range(366):
+        following = day + timedelta(days=1)
+        if following.year != year:
+            break
+        if at(following).utcoffset() != previous:
+            # Narrow the change down to the minute
+            lo, hi = 0, 24 * 60
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if at(day + timedelta(minutes=mid)).utcoffset() == previous:
+                    lo = mid
+                else:
+                    hi = mid
+            hi = day + timedelta(minutes=hi)
+            local = at(hi)
+            after = local.utcoffset()
+            onset = (hi + previous).replace(tzinfo=None)
+            yield onset, previous, after, bool(local.dst()), local.tzname()
+            previous = after
+        day = following
+
+
+def vtimezone_lines(zone_name, years):
+    """Builds a VTIMEZONE block for an IANA zone covering the given years, or [] if unknown.
+
+    Each transition is written as its own STANDARD/DAYLIGHT component with an
+    explicit DTSTART, so no recurrence rules have to be derived.
+    """
+    zone = get_zone(zone_name)
+    if zone is None:
+        return []
+    lines = ["BEGIN:VTIMEZONE", f"TZID:{zone_name}"]
+    components = 0
+    if years: # The last change of the year before sets the offset on January 1
+        years = set(years) | {min(years) - 1}
+    for year in sorted(years):
+        for onset, before, after, is_dst, name in _transitions(zone, year):
+            kind = "DAYLIGHT" if is_dst else "STANDARD"
+            lines += [f"BEGIN:{kind}", f"DTSTART:{onset.strftime('%Y%m%dT%H%M%S')}",
+                      f"TZOFFSETFROM:{_format_offset(int(before.total_seconds() // 60))}",
+                      f"TZOFFSETTO:{_format_offset(int(after.total_seconds() // 60))}"]
+            if name:
+                lines.append(f"TZNAME:{name}")
+            lines.append(f"END:{kind}")
+            components += 1
+    if not components: # No changes in these years: one fixed offset
+        first = datetime(min(years) if years else 1970, 1, 1)
+        offset = _format_offset(int(zone.utcoffset(first).total_seconds() // 60))
+        lines += ["BEGIN:STANDARD", f"DTSTART:{first.strftime('%Y%m%dT%H%M%S')}",
+                  f"TZOFFSETFROM:{offset}", f"TZOFFSETTO:{offset}"]
+        name = zone.tzname(first)
+        if name:
+            lines.append(f"TZNAME:{name}")
+        lines.append("END:STANDARD")
+    lines.append("END:VTIMEZONE")
+    return lines
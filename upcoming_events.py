@@ -0,0 +1,157 @@
+# File: upcoming_events.py
+# bToDo - Rolling window of upcoming events
+# Date: 2026-10-18
+#
+# Behind the tray menu and the Upcoming panel. The window holds the events
+# that have not ended yet and start within the next few days, sorted by
+# start time. It is filled once from the per-day index (one lookup per day,
+# never a pass over all events); after that, advance() only drops entries
+# that have ended and looks up the days that came into range, and
+# apply_change() patches in the Changes the DataManager publishes, so
+# refreshing every minute costs next to nothing. Qt-free.
+
+import sys
+import time
+from bisect import insort
+from collections import namedtuple
+from datetime import date, timedelta
+
+import timezones
+from change_bus import EVENTS_BULK, SETTINGS_CHANGED
+from data_manager import MINUTES_PER_DAY, event_interval
+
+DEFAULT_UPCOMING_DAYS = 7
+MAX_UPCOMING_DAYS = 60
+DEFAULT_UPCOMING_COUNT = 10
+
+UpcomingEntry = namedtuple("UpcomingEntry", ("start_ts", "event_id", "end_ts", "event"))
+
+
+def event_timestamps(event):
+    """POSIX (start, end) of an event, or None if undated. All-day events use local time."""
+    interval = event_interval(event)
+    if interval is None:
+        return None
+    zone = event.get('tz') if event.get('time_minutes') is not None else None
+    start, end = interval
+    return (timezones.wall_to_timestamp(zone, start // MINUTES_PER_DAY, start % MINUTES_PER_DAY),
+            timezones.wall_to_timestamp(zone, end // MINUTES_PER_DAY, end % MINUTES_PER_DAY))
+
+
+def describe(entry, now=None):
+    """One-line label such as 'Today 10:00 AM - Title' or 'Now - Title'."""
+    now = time.time() if now is None else now
+    event = entry.event
+    title = event.get('title', 'No Title')
+    if entry.start_ts <= now:
+        return f"Now - {title}"
+    day = date.fromtimestamp(entry.start_ts)
+    today = date.fromtimestamp(now)
+    if day == today:
+        day_text = "Today"
+    elif day == today + timedelta(days=1):
+        day_text = "Tomorrow"
+    else:
+        day_text = day.strftime("%a %d %b")
+    if event.get('time_minutes') is None:
+        return f"{day_text} (all day) - {title}"
+    return f"{day_text} {event.get('time')} - {title}"
+
+
+class UpcomingWindow:
+    """Events starting within the next `days` days that have not ended, by start time."""
+
+    def __init__(self, data_manager, days=DEFAULT_UPCOMING_DAYS):
+        self.data_manager = data_manager
+        self.days = max(1, min(int(days), MAX_UPCOMING_DAYS))
+        self._entries = [] # UpcomingEntry, sorted
+        self._ids = set()
+        self._now = None
+        self._last_ordinal = None # Last local day fully in range
+        self._end_ts = None # Entries start before this
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_days(self, days):
+        days = max(1, min(int(days), MAX_UPCOMING_DAYS))
+        if days != self.days:
+            self.days = days
+            self.rebuild()
+
+    def rebuild(self, now=None):
+        """Fills the window from scratch."""
+        self._entries = []
+        self._ids = set()
+        self._now = time.time() if now is None else now
+        today = date.fromtimestamp(self._now).toordinal()
+        self._last_ordinal = today - 1
+        self._extend(today)
+
+    def advance(self, now=None):
+        """Moves the window to now: drops ended events and adds the days that came into range."""
+        now = time.time() if now is None else now
+        if self._now is None:
+            self.rebuild(now)
+            return
+        self._now = now
+        if self._entries and self._entries[0].start_ts < now:
+            # Only entries already started can have ended; the rest keep their order
+            self._entries = [entry for entry in self._entries if entry.end_ts > now]
+            self._ids = {entry.event_id for entry in self._entries}
+        self._extend(date.fromtimestamp(now).toordinal())
+
+    def _extend(self, today):
+        last = today + self.days
+        self._end_ts = timezones.wall_to_timestamp(None, last + 1, 0)
+        first = self._last_ordinal + 1
+        if first > last:
+            return
+        # A day either side: events in other time zones may start on a neighbouring local day.
+        # Those two days are looked up again next time, when more of them is in range.
+        for key in self.data_manager.shards_for_range(date.fromordinal(first - 1), date.fromordinal(last + 1)):
+            self.data_manager.load_shard(key)
+        for ordinal in range(first - 1, last + 2):
+            for event in self.data_manager.events_on_day(ordinal):
+                self._add(event)
+        self._last_ordinal = last
+
+    def _add(self, event):
+        event_id = event.get('id') or ""
+        if event_id in self._ids:
+            return # Multi-day events are found on each of their days
+        try:
+            stamps = event_timestamps(event)
+        except (OverflowError, OSError, ValueError) as e:
+            print(f"Warning: Skipping event '{event.get('title')}' in upcoming events: {e}", file=sys.stderr)
+            return
+        if stamps is None or stamps[1] <= self._now or stamps[0] >= self._end_ts:
+            return
+        insort(self._entries, UpcomingEntry(stamps[0], event_id, stamps[1], event))
+        self._ids.add(event_id)
+
+    def _remove(self, event_id):
+        if event_id in self._ids:
+            self._entries = [entry for entry in self._entries if entry.event_id != event_id]
+            self._ids.discard(event_id)
+
+    def apply_change(self, change):
+        """Updates the window for a Change from the DataManager's ChangeBus."""
+        if self._now is None:
+            return
+        if change.kind == SETTINGS_CHANGED:
+            if 'time_zone' in change.fields:
+                self.rebuild(self._now)
+            return
+        changes = change.changes if change.kind == EVENTS_BULK else (change,)
+        if changes is None:
+            self.rebuild(self._now)
+            return
+        for event_change in changes:
+            self._remove(event_change.event_id or "")
+            if event_change.new is not None:
+                self._add(event_change.new)
+
+    def upcoming(self, count=DEFAULT_UPCOMING_COUNT):
+        """Returns the first count entries."""
+        return self._entries[:count]